@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 from pydantic import Field
+from typing import Optional
 
 # Load environment variables from .env file in the backend directory
 dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env')
@@ -11,15 +12,167 @@ class Settings(BaseSettings):
     # Supabase
     supabase_url: str = Field(..., env="SUPABASE_URL")
     supabase_key: str = Field(..., env="SUPABASE_KEY")
+    supabase_service_role_key: Optional[str] = Field(default=None, env="SUPABASE_SERVICE_ROLE_KEY")
+    # Async data layer connection pool
+    supabase_max_connections: int = Field(default=20, env="SUPABASE_MAX_CONNECTIONS")
+    supabase_timeout: float = Field(default=10.0, env="SUPABASE_TIMEOUT")
 
     # OpenAI
     openai_api_key: str = Field(..., env="OPENAI_API_KEY")
     openai_assistant_id: str = Field(..., env="OPENAI_ASSISTANT_ID")
 
+    # Assistant run polling (shared poller with adaptive backoff)
+    run_poll_min_interval: float = Field(default=0.25, env="RUN_POLL_MIN_INTERVAL")
+    run_poll_max_interval: float = Field(default=2.0, env="RUN_POLL_MAX_INTERVAL")
+    run_poll_max_concurrency: int = Field(default=16, env="RUN_POLL_MAX_CONCURRENCY")
+
+    # Assistant tool calls
+    # Max tool calls from one requires_action executed at once
+    tool_call_concurrency: int = Field(default=8, env="TOOL_CALL_CONCURRENCY")
+    # Default per-call deadline in seconds (tools may override it at registration)
+    tool_call_timeout: float = Field(default=60.0, env="TOOL_CALL_TIMEOUT")
+
+    # Chat run queue: runs on one thread are serialized; at most this many queued user
+    # messages are merged into a single run (1 = never merge)
+    chat_run_merge_max: int = Field(default=10, env="CHAT_RUN_MERGE_MAX")
+
+    # Project -> OpenAI thread ID cache
+    thread_cache_size: int = Field(default=1024, env="THREAD_CACHE_SIZE")
+    thread_cache_ttl: float = Field(default=3600.0, env="THREAD_CACHE_TTL")
+
+    # Project / scene snapshot cache (agent tools + pipeline)
+    snapshot_cache_size: int = Field(default=2048, env="SNAPSHOT_CACHE_SIZE")
+    # Seconds before a snapshot is refetched, covering edits made outside this backend (0 = invalidation only)
+    snapshot_cache_ttl: float = Field(default=30.0, env="SNAPSHOT_CACHE_TTL")
+
+    # Canvas update notifications (debounced per scene field, flushed in bulk)
+    # Seconds a field must be quiet before its latest value is written
+    canvas_update_debounce: float = Field(default=1.0, env="CANVAS_UPDATE_DEBOUNCE")
+    # Upper bound on how long a continuously edited field waits
+    canvas_update_max_delay: float = Field(default=5.0, env="CANVAS_UPDATE_MAX_DELAY")
+    canvas_update_flush_interval: float = Field(default=0.5, env="CANVAS_UPDATE_FLUSH_INTERVAL")
+    # Max buffered (scene, field) keys before an immediate flush
+    canvas_update_max_pending: int = Field(default=5000, env="CANVAS_UPDATE_MAX_PENDING")
+
+    # Idempotency-Key handling for chat send / pipeline start (per process)
+    idempotency_cache_size: int = Field(default=10000, env="IDEMPOTENCY_CACHE_SIZE")
+    # Seconds a completed response is replayed to retries with the same key
+    idempotency_ttl: float = Field(default=86400.0, env="IDEMPOTENCY_TTL")
+
+    # Request tracing (GET /debug/traces)
+    # Fraction of traces kept; failed traces and those slower than TRACE_SLOW_MS are always kept
+    trace_sample_rate: float = Field(default=0.1, env="TRACE_SAMPLE_RATE")
+    # Root span duration (ms) above which a trace is always kept (0 = sampling only)
+    trace_slow_ms: float = Field(default=2000.0, env="TRACE_SLOW_MS")
+    # Kept traces held in memory for the debug endpoint
+    trace_buffer_size: int = Field(default=200, env="TRACE_BUFFER_SIZE")
+    # Optional JSONL file kept traces are appended to (one span per line)
+    trace_export_path: Optional[str] = Field(default=None, env="TRACE_EXPORT_PATH")
+
+    # Fal generation (queue API: submit, poll status, fetch result)
+    fal_key: Optional[str] = Field(default=None, env="FAL_KEY")
+    # Point at a local fake Fal server for benchmarks / testing
+    fal_queue_url: str = Field(default="https://queue.fal.run", env="FAL_QUEUE_URL")
+    fal_image_model_v1: str = Field(default="fal-ai/flux-subject", env="FAL_IMAGE_MODEL_V1")
+    fal_image_model_v2: str = Field(default="fal-ai/bria/product-shot", env="FAL_IMAGE_MODEL_V2")
+    fal_video_model: str = Field(default="fal-ai/kling-video/v1.6/standard/image-to-video", env="FAL_VIDEO_MODEL")
+    fal_max_connections: int = Field(default=20, env="FAL_MAX_CONNECTIONS")
+    fal_request_timeout: float = Field(default=30.0, env="FAL_REQUEST_TIMEOUT")
+    # Status polling starts at the min interval and backs off while the status is unchanged
+    fal_poll_min_interval: float = Field(default=1.0, env="FAL_POLL_MIN_INTERVAL")
+    fal_poll_max_interval: float = Field(default=10.0, env="FAL_POLL_MAX_INTERVAL")
+    # Retries per HTTP request on connection errors, 429 and 5xx
+    fal_max_retries: int = Field(default=3, env="FAL_MAX_RETRIES")
+    # Seconds a job may take from submit to result before it is cancelled
+    fal_job_timeout: float = Field(default=600.0, env="FAL_JOB_TIMEOUT")
+    # Public URL of POST /api/webhooks/fal. When set, the pipeline submits jobs with this
+    # callback and Fal's callbacks advance each scene, instead of the pipeline polling
+    fal_webhook_url: Optional[str] = Field(default=None, env="FAL_WEBHOOK_URL")
+    # Shared secret added to the callback URL and checked by the webhook endpoint (required: webhooks stay off without it)
+    fal_webhook_secret: Optional[str] = Field(default=None, env="FAL_WEBHOOK_SECRET")
+
+    # Generated media cache: regenerating with identical inputs returns the stored URL
+    # Where entries live: "sqlite" (local file), "supabase" (generation_cache table) or "none" (disabled)
+    generation_cache_backend: str = Field(default="sqlite", env="GENERATION_CACHE_BACKEND")
+    generation_cache_sqlite_path: str = Field(default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "generation_cache.db"), env="GENERATION_CACHE_SQLITE_PATH")
+    # Least recently used entries beyond this are evicted
+    generation_cache_max_entries: int = Field(default=10000, env="GENERATION_CACHE_MAX_ENTRIES")
+    # Seconds an entry is served; keep below how long Fal keeps generated media (0 = no expiry)
+    generation_cache_ttl: float = Field(default=604800.0, env="GENERATION_CACHE_TTL")
+
+    # Provider rate limits: process-wide token buckets, requests/second per endpoint group (0 = unlimited)
+    # runs.create / submit_tool_outputs / cancel / stream
+    openai_rate_runs: float = Field(default=20.0, env="OPENAI_RATE_RUNS")
+    # runs.retrieve (run status polling)
+    openai_rate_run_polls: float = Field(default=50.0, env="OPENAI_RATE_RUN_POLLS")
+    # messages.create / messages.list
+    openai_rate_messages: float = Field(default=50.0, env="OPENAI_RATE_MESSAGES")
+    openai_rate_threads: float = Field(default=10.0, env="OPENAI_RATE_THREADS")
+    fal_rate_submit: float = Field(default=10.0, env="FAL_RATE_SUBMIT")
+    # Fal status / result / cancel
+    fal_rate_status: float = Field(default=50.0, env="FAL_RATE_STATUS")
+    # Bucket size in seconds of traffic: a burst of up to rate * this goes out without waiting
+    rate_limit_burst_seconds: float = Field(default=2.0, env="RATE_LIMIT_BURST_SECONDS")
+    # Retries of a 429 / transient OpenAI error (Retry-After honoured, else jittered backoff)
+    openai_max_retries: int = Field(default=3, env="OPENAI_MAX_RETRIES")
+    # A Retry-After longer than this is not waited out; the call fails instead
+    rate_limit_max_retry_delay: float = Field(default=30.0, env="RATE_LIMIT_MAX_RETRY_DELAY")
+
+    # Circuit breakers (Supabase, OpenAI, each MCP server): fail fast with 503 while a dependency is down
+    # Consecutive failures (connection errors, timeouts, 5xx) that open a dependency's circuit
+    circuit_failure_threshold: int = Field(default=5, env="CIRCUIT_FAILURE_THRESHOLD")
+    # Seconds an open circuit fails fast before probe calls are let through
+    circuit_recovery_timeout: float = Field(default=30.0, env="CIRCUIT_RECOVERY_TIMEOUT")
+    # Probe calls allowed at once while half-open
+    circuit_half_open_max_calls: int = Field(default=1, env="CIRCUIT_HALF_OPEN_MAX_CALLS")
+
     # Server Config (Optional with defaults)
     host: str = Field(default="127.0.0.1", env="HOST")
     port: int = Field(default=8000, env="PORT")
 
+    # Generation Pipeline
+    # Max scenes generated at once for a single project (1 = sequential)
+    pipeline_scene_concurrency: int = Field(default=4, env="PIPELINE_SCENE_CONCURRENCY")
+    # Max scenes generated at once across all projects in this process
+    pipeline_global_concurrency: int = Field(default=16, env="PIPELINE_GLOBAL_CONCURRENCY")
+    # Scenes in generating_* whose heartbeat is older than this are treated as abandoned
+    pipeline_scene_lease_seconds: float = Field(default=300.0, env="PIPELINE_SCENE_LEASE_SECONDS")
+    pipeline_scene_heartbeat_interval: float = Field(default=60.0, env="PIPELINE_SCENE_HEARTBEAT_INTERVAL")
+    # Re-queue abandoned scenes (and enqueue their projects) when the API or a worker starts
+    pipeline_recover_on_startup: bool = Field(default=True, env="PIPELINE_RECOVER_ON_STARTUP")
+    # Scene status updates are buffered this long (seconds) and written in bulk
+    scene_status_flush_interval: float = Field(default=0.25, env="SCENE_STATUS_FLUSH_INTERVAL")
+    scene_status_max_retries: int = Field(default=3, env="SCENE_STATUS_MAX_RETRIES")
+
+    # Pipeline Job Queue
+    # Where jobs are persisted: "sqlite" (local file) or "supabase" (pipeline_jobs table)
+    pipeline_queue_backend: str = Field(default="sqlite", env="PIPELINE_QUEUE_BACKEND")
+    pipeline_queue_sqlite_path: str = Field(default=os.path.join(os.path.dirname(os.path.dirname(__file__)), "pipeline_jobs.db"), env="PIPELINE_QUEUE_SQLITE_PATH")
+    # Run pipeline workers inside the API process (disable when using `python -m app.worker`)
+    pipeline_workers_in_api: bool = Field(default=True, env="PIPELINE_WORKERS_IN_API")
+    pipeline_worker_concurrency: int = Field(default=2, env="PIPELINE_WORKER_CONCURRENCY")
+    pipeline_job_max_attempts: int = Field(default=3, env="PIPELINE_JOB_MAX_ATTEMPTS")
+    pipeline_job_lease_seconds: float = Field(default=300.0, env="PIPELINE_JOB_LEASE_SECONDS")
+    pipeline_job_retry_base_delay: float = Field(default=10.0, env="PIPELINE_JOB_RETRY_BASE_DELAY")
+    pipeline_queue_poll_interval: float = Field(default=2.0, env="PIPELINE_QUEUE_POLL_INTERVAL")
+
+    # Cross-process leases (one pipeline run / thread creation per project at a time)
+    # Where leases live: "memory" (this process only) or "supabase" (backend_leases table).
+    # Use "supabase" when running several uvicorn workers, pipeline workers or hosts.
+    lease_backend: str = Field(default="memory", env="LEASE_BACKEND")
+    # Seconds a lease outlives its holder; holders renew every third of this
+    lease_ttl: float = Field(default=60.0, env="LEASE_TTL")
+    # Seconds a chat request waits for another worker to finish creating the project's thread
+    thread_lease_wait: float = Field(default=15.0, env="THREAD_LEASE_WAIT")
+
+    # MCP Server Pool
+    # Max long-lived processes per MCP server script
+    mcp_pool_size: int = Field(default=2, env="MCP_POOL_SIZE")
+    # Seconds a worker may sit idle before it is shut down (0 = never reap)
+    mcp_pool_idle_timeout: float = Field(default=300.0, env="MCP_POOL_IDLE_TIMEOUT")
+    # Seconds to wait for a single MCP tool call
+    mcp_call_timeout: float = Field(default=120.0, env="MCP_CALL_TIMEOUT")
+
     class Config:
         env_file = dotenv_path
         case_sensitive = True # Important for environment variable names
@@ -1,9 +1,12 @@
 import logging
 import json # Added for MCP communication
-import subprocess # Added for MCP communication
+import asyncio
 import os # Added to construct path
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+import math
+import time
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Any, Optional, Dict # Added Optional, Dict
 from dotenv import load_dotenv # Added to load .env file
@@ -13,7 +16,20 @@ from dotenv import load_dotenv # Added to load .env file
 load_dotenv()
 
 # Import the pipeline runner function
-from .services.pipeline_runner import start_project_generation
+from .services.pipeline_runner import start_project_generation, recover_interrupted_pipelines
+from .services.mcp_pool import mcp_pools, McpWorkerError
+from .services.job_queue import PipelineWorkerPool, create_worker_pool, get_job_store
+from .services.metrics import CONTENT_TYPE_LATEST, MCP_CALLS, MCP_LATENCY, render_latest
+from .services.tracing import span, tracer
+from .services.rate_limiter import rate_limiter
+from .services.circuit_breaker import CircuitOpenError, circuit_breakers
+from .services.idempotency import MAX_KEY_LENGTH, IdempotencyConflict, fingerprint, idempotency_store
+from .services.fal_client import close_fal_client, get_fal_client
+from .services.generation_cache import get_generation_cache
+from .services.leases import get_lease_manager
+from .services.scene_state_machine import STAGE_STATUSES, CallbackNotReady, scene_state_machine
+from .supabase_client import close_supabase_connections, get_service_supabase_repository
+from .config import settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -61,6 +77,7 @@ class ChatMessageResponse(BaseModel):
     run_id: str
     status: Optional[str] = None # e.g., 'completed', 'requires_action'
     required_action: Optional[Any] = None
+    merged_messages: Optional[int] = None # >1 when queued messages were answered by one run
 
 # New Models for MCP Proxy
 class McpCallRequest(BaseModel):
@@ -69,6 +86,16 @@ class McpCallRequest(BaseModel):
 
 # --- Helper Functions ---
 
+def service_unavailable(error: CircuitOpenError) -> HTTPException:
+    """503 for a call failed fast by an open circuit; Retry-After is when the circuit next probes."""
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, error: CircuitOpenError):
+    """Any endpoint reaching a dependency whose circuit is open answers 503 instead of 500."""
+    exc = service_unavailable(error)
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers)
+
 # Define path to the MCP server executable
 # IMPORTANT: Assumes this backend runs from the workspace root or adjusts path accordingly
 # Using an absolute path based on previous steps
@@ -77,128 +104,136 @@ CANVAS_CONTENT_GENERATOR_SCRIPT = os.path.join(MCP_SERVER_BASE_PATH, "canvas-con
 
 async def execute_mcp_stdio(server_script_path: str, tool_name: str, arguments: Dict[str, Any], env: Optional[Dict[str, str]] = None) -> Any:
     """
-    Executes a local MCP server script via stdio and calls a tool.
+    Calls a tool on a local MCP server script via stdio.
+    Requests are sent to a pool of long-lived server processes (see services/mcp_pool.py)
+    instead of spawning a new node process per call.
     """
     if not os.path.exists(server_script_path):
          logger.error(f"MCP server script not found at: {server_script_path}")
          raise HTTPException(status_code=500, detail=f"MCP server script not found: {os.path.basename(server_script_path)}")
 
-    mcp_request = {
-        "jsonrpc": "2.0",
-        "method": "CallTool",
-        "params": {"name": tool_name, "arguments": arguments},
-        "id": 1 # Simple ID for request/response matching
-    }
-    request_json = json.dumps(mcp_request) + "\n" # MCP expects newline delimited JSON
-
-    process = None
+    server = os.path.basename(server_script_path)
+    started = time.perf_counter()
     try:
-        logger.info(f"Starting MCP server: node {server_script_path}")
-        # Combine current environment with provided env vars (like API keys from config)
-        # For now, we assume keys are in the environment where this backend runs
-        # Later, this could read from mcp_settings.json
-        current_env = os.environ.copy()
-        if env:
-            current_env.update(env)
-
-        # Import asyncio here as it's used within this async function
-        import asyncio
-
-        process = await asyncio.create_subprocess_exec(
-            'node', server_script_path,
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE, # Capture stderr for debugging
-            env=current_env
-        )
-
-        logger.info(f"Sending request to MCP server: {request_json.strip()}")
-        process.stdin.write(request_json.encode('utf-8'))
-        await process.stdin.drain()
-        process.stdin.close() # Close stdin to signal end of input
-
-        # Read response from stdout
-        response_json = ""
-        while True:
-            line = await process.stdout.readline()
-            if not line:
-                break # End of stream
-            response_json += line.decode('utf-8')
-            # Basic check if we likely have a full JSON object
-            if response_json.strip().endswith('}'):
-                 try:
-                     # Try parsing early to potentially break sooner
-                     json.loads(response_json)
-                     break
-                 except json.JSONDecodeError:
-                     continue # Incomplete JSON, keep reading
-
-        # Read any remaining stderr output
-        stderr_output = await process.stderr.read()
-        stderr_text = stderr_output.decode('utf-8').strip()
-        if stderr_text:
-             logger.warning(f"MCP server stderr ({os.path.basename(server_script_path)}): {stderr_text}")
-
-
-        await process.wait() # Wait for process to terminate
-
-        logger.info(f"Received response from MCP server: {response_json.strip()}")
-
-        if process.returncode != 0:
-             logger.error(f"MCP server process exited with code {process.returncode}")
-             raise HTTPException(status_code=500, detail=f"MCP server execution failed (code {process.returncode}). Stderr: {stderr_text}")
-
-        if not response_json.strip():
-             logger.error("Received empty response from MCP server.")
-             raise HTTPException(status_code=500, detail="Received empty response from MCP server.")
-
-        try:
-            mcp_response = json.loads(response_json)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON response from MCP server: {e}. Response: {response_json}")
-            raise HTTPException(status_code=500, detail="Failed to parse response from MCP server.")
-
-        # Handle JSON-RPC errors
-        if 'error' in mcp_response:
-            error_details = mcp_response['error']
-            logger.error(f"MCP server returned error: {error_details}")
-            raise HTTPException(status_code=500, detail=f"MCP Error: {error_details.get('message', 'Unknown MCP error')}")
-
-        # Extract the actual result (assuming it's in result.content[0].text and needs parsing again)
-        # This matches the structure our canvas-content-generator returns
-        try:
-            result_text = mcp_response.get('result', {}).get('content', [{}])[0].get('text', '{}')
-            final_result = json.loads(result_text)
-            return final_result
-        except (json.JSONDecodeError, IndexError, KeyError, TypeError) as e:
-             logger.error(f"Failed to extract final result from MCP response structure: {e}. Response: {mcp_response}")
-             # Return the raw MCP result if extraction fails, frontend might handle it
-             return mcp_response.get('result', {})
-
-
+        pool = mcp_pools.get_pool(server_script_path, env)
+        with span("mcp.call", server=server, tool=tool_name):
+            mcp_response = await pool.call("CallTool", {"name": tool_name, "arguments": arguments})
+        logger.info(f"Received response from MCP server: {json.dumps(mcp_response)}")
+    except CircuitOpenError as e:
+        MCP_CALLS.inc(server, "rejected")
+        logger.warning(f"MCP tool '{tool_name}' not called: {e}")
+        raise service_unavailable(e)
+    except asyncio.TimeoutError:
+        MCP_CALLS.inc(server, "timeout")
+        logger.error(f"MCP tool '{tool_name}' timed out after {pool.call_timeout}s")
+        raise HTTPException(status_code=504, detail=f"MCP tool '{tool_name}' timed out.")
+    except McpWorkerError as e:
+        MCP_CALLS.inc(server, "error")
+        logger.error(f"MCP server failed while executing tool '{tool_name}': {e}")
+        raise HTTPException(status_code=500, detail=f"MCP server execution failed: {str(e)}")
     except Exception as e:
+        MCP_CALLS.inc(server, "error")
         logger.exception(f"Error executing MCP tool '{tool_name}': {e}")
-        # Ensure process is terminated if it exists and hasn't finished
-        if process and process.returncode is None:
-            try:
-                process.terminate()
-                await process.wait() # Ensure termination completes
-            except ProcessLookupError:
-                pass # Process already finished
-            except Exception as term_err:
-                logger.error(f"Error terminating MCP process: {term_err}")
         raise HTTPException(status_code=500, detail=f"Failed to execute MCP tool: {str(e)}")
     finally:
-         # Ensure process is cleaned up if it exists and finished
-         if process and process.returncode is not None:
-              try:
-                   # Attempt to close transports if needed, though closing stdin above might suffice
-                   if process.stdin and not process.stdin.is_closing(): process.stdin.close()
-                   # No need to explicitly close stdout/stderr pipes after reading
-              except Exception as close_err:
-                   logger.warning(f"Error during MCP process cleanup: {close_err}")
+        MCP_LATENCY.observe(time.perf_counter() - started, server)
+
+    # Handle JSON-RPC errors
+    if 'error' in mcp_response:
+        MCP_CALLS.inc(server, "error")
+        error_details = mcp_response['error']
+        logger.error(f"MCP server returned error: {error_details}")
+        raise HTTPException(status_code=500, detail=f"MCP Error: {error_details.get('message', 'Unknown MCP error')}")
+
+    # Extract the actual result (assuming it's in result.content[0].text and needs parsing again)
+    # This matches the structure our canvas-content-generator returns
+    MCP_CALLS.inc(server, "ok")
+    try:
+        result_text = mcp_response.get('result', {}).get('content', [{}])[0].get('text', '{}')
+        final_result = json.loads(result_text)
+        return final_result
+    except (json.JSONDecodeError, IndexError, KeyError, TypeError) as e:
+         logger.error(f"Failed to extract final result from MCP response structure: {e}. Response: {mcp_response}")
+         # Return the raw MCP result if extraction fails, frontend might handle it
+         return mcp_response.get('result', {})
 
 
+async def run_idempotent(scope: str, idempotency_key: Optional[str], payload: Any, response: Response, fn) -> Any:
+    """
+    Runs `fn` once per Idempotency-Key within `scope`: retries attach to the in-flight
+    request or get its stored response (marked with an Idempotent-Replayed header).
+    Without a key, `fn` simply runs.
+    """
+    if not idempotency_key:
+        return await fn()
+    if len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters.")
+    try:
+        result, replayed = await idempotency_store.run(
+            f"{scope}:{idempotency_key}",
+            fingerprint(payload),
+            fn,
+            # Client errors are final; server errors may succeed on retry
+            store_error=lambda e: isinstance(e, HTTPException) and e.status_code < 500
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+# --- Lifecycle ---
+
+# Pipeline workers running inside this API process (None when run separately via `python -m app.worker`)
+pipeline_workers: Optional[PipelineWorkerPool] = None
+
+@app.on_event("startup")
+async def start_pipeline_workers():
+    """Starts in-process pipeline workers unless PIPELINE_WORKERS_IN_API is disabled."""
+    global pipeline_workers
+    if settings.pipeline_workers_in_api:
+        pipeline_workers = create_worker_pool(start_project_generation)
+        pipeline_workers.start()
+
+@app.on_event("startup")
+async def recover_pipelines():
+    """Re-queues scenes a crashed pipeline left in generating_* and enqueues their projects."""
+    if settings.pipeline_recover_on_startup:
+        await recover_interrupted_pipelines(get_job_store())
+
+@app.on_event("shutdown")
+async def stop_pipeline_workers():
+    """Stops in-process pipeline workers; interrupted jobs are retried once their lease expires."""
+    if pipeline_workers:
+        await pipeline_workers.stop()
+
+@app.on_event("shutdown")
+async def flush_canvas_updates():
+    """Writes any canvas update notifications still waiting out their debounce."""
+    from .services.agent_service import agent_service
+    await agent_service.canvas_updates.close()
+
+@app.on_event("shutdown")
+async def flush_trace_export():
+    """Writes kept traces still queued for TRACE_EXPORT_PATH."""
+    await asyncio.to_thread(tracer.close)
+
+@app.on_event("shutdown")
+async def shutdown_mcp_pools():
+    """Terminates pooled MCP server processes."""
+    await mcp_pools.close_all()
+
+@app.on_event("shutdown")
+async def shutdown_fal_connections():
+    """Closes the pooled HTTP connections used by the Fal generation client."""
+    await close_fal_client()
+
+@app.on_event("shutdown")
+async def shutdown_supabase_connections():
+    """Closes the pooled HTTP connections used by the async Supabase repository."""
+    await close_supabase_connections()
+
 # --- API Endpoints ---
 
 @app.get("/")
@@ -207,12 +242,31 @@ async def read_root():
     logger.info("Root endpoint accessed.")
     return {"message": "Agent Backend is running."}
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: OpenAI, Supabase, MCP and pipeline latencies plus executor queue depth."""
+    return Response(render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/debug/traces")
+async def list_traces(limit: int = 50, min_duration_ms: float = 0.0, name: Optional[str] = None):
+    """Recently kept traces (newest first), e.g. ?name=chat.process_message&min_duration_ms=5000."""
+    return {"stats": tracer.stats(), "traces": tracer.recent(limit, min_duration_ms, name)}
+
+@app.get("/debug/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """All spans of one kept trace, in start order."""
+    spans = tracer.get_trace(trace_id)
+    if spans is None:
+        raise HTTPException(status_code=404, detail="Trace not found (not sampled, or evicted from the buffer).")
+    return {"trace_id": trace_id, "spans": spans}
+
 @app.post("/api/agent/notify-update")
 async def notify_update(notification: NotificationPayload):
     """
     Endpoint to receive notifications from the frontend (e.g., Canvas updates).
+    Returns immediately; updates are debounced and written in bulk in the background.
     """
-    logger.info(f"Received notification: Type={notification.type}, Payload={notification.payload}")
+    logger.debug(f"Received notification: Type={notification.type}, Payload={notification.payload}")
 
     # Process the notification using the AgentService
     try:
@@ -231,6 +285,12 @@ async def notify_update(notification: NotificationPayload):
     # For now, just acknowledge receipt
     return {"status": "Notification received", "data": notification.dict()}
 
+@app.get("/api/agent/notify-update/stats")
+async def notify_update_stats():
+    """Reports buffered canvas updates and how many notifications each database write absorbed."""
+    from .services.agent_service import agent_service
+    return agent_service.canvas_updates.stats()
+
 # --- Agent Service ---
 # Import agent service (ensure it's initialized appropriately elsewhere if needed)
 from .services.agent_service import agent_service
@@ -238,31 +298,84 @@ from .services.agent_service import agent_service
 # --- Chat Endpoint ---
 # Assuming agent_service is available globally or initialized correctly
 @app.post("/api/chat/{project_id}/send", response_model=ChatMessageResponse)
-async def send_chat_message(project_id: str, request_data: ChatMessageRequest):
+async def send_chat_message(project_id: str, request_data: ChatMessageRequest, response: Response,
+                            idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")):
     """
     Handles incoming chat messages, interacts with the AgentService/OpenAI Assistant,
     and returns the assistant's response.
+    With an Idempotency-Key header, a retried request reuses the original run's response.
     """
     logger.info(f"Received chat message for project {project_id}. Thread ID: {request_data.thread_id}")
-    try:
-        # This part needs agent_service to be properly set up
-        response_data = await agent_service.process_chat_message(
-            project_id=project_id,
-            thread_id=request_data.thread_id,
-            message_text=request_data.input,
-            attachments=request_data.attachments or []
-        )
-        return ChatMessageResponse(**response_data)
-
-    except ValueError as ve:
-        logger.warning(f"Validation error processing chat for project {project_id}: {ve}")
-        raise HTTPException(status_code=400, detail=str(ve))
-    except ConnectionError as ce:
-        logger.error(f"Connection error processing chat for project {project_id}: {ce}")
-        raise HTTPException(status_code=503, detail="Service unavailable. Could not connect to required backend services.")
-    except Exception as e:
-        logger.exception(f"Unexpected error processing chat for project {project_id}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+
+    async def process() -> ChatMessageResponse:
+        try:
+            # This part needs agent_service to be properly set up
+            response_data = await agent_service.process_chat_message(
+                project_id=project_id,
+                thread_id=request_data.thread_id,
+                message_text=request_data.input,
+                attachments=request_data.attachments or []
+            )
+            return ChatMessageResponse(**response_data)
+
+        except ValueError as ve:
+            logger.warning(f"Validation error processing chat for project {project_id}: {ve}")
+            raise HTTPException(status_code=400, detail=str(ve))
+        except CircuitOpenError as e:
+            logger.warning(f"Chat for project {project_id} failed fast: {e}")
+            raise service_unavailable(e)
+        except ConnectionError as ce:
+            logger.error(f"Connection error processing chat for project {project_id}: {ce}")
+            raise HTTPException(status_code=503, detail="Service unavailable. Could not connect to required backend services.")
+        except Exception as e:
+            logger.exception(f"Unexpected error processing chat for project {project_id}")
+            raise HTTPException(status_code=500, detail="Internal server error")
+
+    return await run_idempotent(f"chat:{project_id}", idempotency_key, request_data.dict(), response, process)
+
+
+@app.post("/api/chat/{project_id}/stream")
+async def stream_chat_message(project_id: str, request_data: ChatMessageRequest):
+    """
+    Streams the assistant's response as Server-Sent Events.
+    Emits `thread`, `run`, `text_delta`, `tool_call` and `tool_output` events as they
+    arrive, then a final `done` (or `error`) event with the full response content.
+    """
+    logger.info(f"Received streaming chat message for project {project_id}. Thread ID: {request_data.thread_id}")
+    if not agent_service.assistant_id or agent_service.assistant_id == "YOUR_OPENAI_ASSISTANT_ID":
+        raise HTTPException(status_code=400, detail="OpenAI Assistant ID is not configured.")
+
+    async def event_stream():
+        try:
+            async for event in agent_service.stream_chat_message(
+                project_id=project_id,
+                thread_id=request_data.thread_id,
+                message_text=request_data.input
+            ):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        except ConnectionError as ce:
+            logger.error(f"Connection error streaming chat for project {project_id}: {ce}")
+            yield f"event: error\ndata: {json.dumps({'message': 'Service unavailable. Could not connect to required backend services.'})}\n\n"
+        except Exception:
+            logger.exception(f"Unexpected error streaming chat for project {project_id}")
+            yield f"event: error\ndata: {json.dumps({'message': 'Internal server error'})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/agent/tools/stats")
+async def tool_stats():
+    """Per-tool call counts, errors, validation rejections and latency (find slow tools here)."""
+    from .services.agent_service import tool_registry
+    return tool_registry.stats()
+
+@app.get("/api/chat/queues")
+async def chat_run_queue_status():
+    """Reports per-thread run queue depth, merged messages and time spent waiting for a turn."""
+    return agent_service.run_queue.stats()
 
 
 # --- MCP Proxy Endpoint ---
@@ -302,9 +415,6 @@ async def mcp_call_proxy(request: McpCallRequest):
         # Filter out None values to avoid passing unset variables
         mcp_env = {k: v for k, v in mcp_env.items() if v is not None}
 
-        # Import asyncio here if not already imported at the top
-        import asyncio
-
         result = await execute_mcp_stdio(target_script, tool_name, arguments, env=mcp_env)
         return result
     except HTTPException as http_exc:
@@ -314,19 +424,123 @@ async def mcp_call_proxy(request: McpCallRequest):
         logger.exception(f"Failed to execute MCP tool '{tool_name}' via proxy.")
         raise HTTPException(status_code=500, detail=f"Error calling MCP tool: {str(e)}")
 
+@app.get("/api/mcp/pools")
+async def mcp_pool_status():
+    """Reports worker counts and in-flight requests for each MCP server pool."""
+    return {"pools": mcp_pools.stats()}
+
 
-# --- Generation Pipeline Endpoint ---
+# --- Generation Pipeline Endpoints ---
 @app.post("/api/pipeline/start/{project_id}")
-async def trigger_generation_pipeline(project_id: str, background_tasks: BackgroundTasks):
+async def trigger_generation_pipeline(project_id: str, response: Response,
+                                      idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key")):
     """
-    Triggers the generation pipeline for a specific project as a background task.
+    Queues the generation pipeline for a specific project on the durable job queue.
+    If a job for the project is already queued or running, that job is returned instead.
+    With an Idempotency-Key header, a retry returns the original response even after that
+    job has finished, rather than starting the pipeline again.
     """
     logger.info(f"Received request to start generation pipeline for project: {project_id}")
-    # Add the pipeline function as a background task
-    background_tasks.add_task(start_project_generation, project_id)
-    logger.info(f"Generation pipeline for project {project_id} added to background tasks.")
-    # Return immediately
-    return {"message": f"Generation pipeline started for project {project_id}"}
+
+    async def enqueue() -> Dict[str, Any]:
+        try:
+            job, created = await get_job_store().enqueue(project_id, max_attempts=settings.pipeline_job_max_attempts)
+        except CircuitOpenError as e:
+            raise service_unavailable(e)
+        except Exception as e:
+            logger.exception(f"Failed to enqueue generation pipeline for project {project_id}")
+            raise HTTPException(status_code=503, detail="Could not queue generation pipeline.")
+
+        if created:
+            logger.info(f"Generation pipeline for project {project_id} queued as job {job['id']}.")
+            message = f"Generation pipeline started for project {project_id}"
+        else:
+            logger.info(f"Generation pipeline for project {project_id} already active as job {job['id']}.")
+            message = f"Generation pipeline already in progress for project {project_id}"
+        # Return immediately
+        return {"message": message, "job_id": job["id"], "status": job["status"], "deduplicated": not created}
+
+    return await run_idempotent(f"pipeline:{project_id}", idempotency_key, {}, response, enqueue)
+
+@app.get("/api/idempotency/stats")
+async def idempotency_stats():
+    """Reports requests executed, attached to an in-flight twin, or replayed from the store."""
+    return idempotency_store.stats()
+
+@app.get("/api/generation/stats")
+async def generation_stats():
+    """
+    Reports Fal generation jobs in flight, completed and failed, plus polls, retries, callbacks,
+    cache hits and requests that joined an identical one already in flight.
+    """
+    return {
+        "fal": get_fal_client().stats(),
+        "callbacks": scene_state_machine.stats(),
+        "cache": get_generation_cache().stats(),
+        "deduplicated": agent_service.generation_flights.stats(),
+    }
+
+@app.get("/api/rate-limits")
+async def rate_limit_stats():
+    """Reports each provider rate limit bucket: rate, tokens left, callers waiting and time spent waiting."""
+    return rate_limiter.stats()
+
+@app.get("/api/circuits")
+async def circuit_breaker_status():
+    """Reports each dependency's circuit (closed / open / half_open), recent failures and calls failed fast."""
+    return circuit_breakers.stats()
+
+@app.get("/api/leases")
+async def lease_status():
+    """Reports the lease backend, the leases this process holds and how often acquiring one found it busy."""
+    return get_lease_manager().stats()
+
+@app.post("/api/webhooks/fal")
+async def fal_webhook(request: Request, scene_id: str, stage: str, token: Optional[str] = None):
+    """
+    Fal job callback advancing a scene's generation (see services/scene_state_machine.py).
+    Callbacks that no longer apply still return 200 so Fal does not redeliver them; a
+    failure to store the result, or a callback that arrives before its submit is recorded,
+    returns 5xx so it does.
+    """
+    if not scene_state_machine.enabled:
+        raise HTTPException(status_code=404, detail="Fal webhooks are not enabled.")
+    if not scene_state_machine.verify(token):
+        raise HTTPException(status_code=401, detail="Invalid webhook token.")
+    if stage not in STAGE_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unknown stage: {stage}")
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Webhook body must be a JSON object.")
+    if not body.get("request_id"):
+        raise HTTPException(status_code=400, detail="Webhook body has no request_id.")
+    try:
+        applied = await scene_state_machine.handle_callback(get_service_supabase_repository(), scene_id, stage, body)
+    except CallbackNotReady as e:
+        # Fal redelivers on a 5xx, by which time the submit is recorded
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"scene_id": scene_id, "stage": stage, "applied": applied}
+
+@app.get("/api/pipeline/jobs/{job_id}")
+async def get_pipeline_job(job_id: str):
+    """Returns the state of a pipeline job (status, attempts, last_error, ...)."""
+    job = await get_job_store().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Pipeline job not found: {job_id}")
+    return job
+
+@app.get("/api/pipeline/status/{project_id}")
+async def get_pipeline_status(project_id: str):
+    """Returns the most recent pipeline job for a project, plus local worker pool state."""
+    job = await get_job_store().get_latest_for_project(project_id)
+    return {
+        "project_id": project_id,
+        "job": job,
+        "workers": pipeline_workers.stats() if pipeline_workers else None
+    }
 
 # --- Run the server (for local development) ---
 if __name__ == "__main__":
@@ -2,35 +2,133 @@ import logging
 import time
 import asyncio
 import json
-from typing import Any, Dict, Optional, List
-from openai import OpenAI, AssistantEventHandler
+import functools
+from typing import Any, AsyncIterator, Callable, Dict, Optional, List, Tuple
+from openai import OpenAI, AssistantEventHandler, NotFoundError
 from openai.types.beta.threads import Run
 # from openai.types.beta.threads.runs import ToolOutput # ToolOutput is no longer directly imported in recent openai versions
 # Instead, tool outputs are passed as a list of dictionaries
 from ..config import settings # Import settings
-from ..supabase_client import get_supabase_client # Import Supabase client getter
+from ..supabase_client import get_supabase_repository # Async Supabase data layer
+from ..supabase_repository import SupabaseError, SupabaseRepository
+from .run_poller import RunStatusPoller
+from .caching import SingleFlight, TTLCache
+from .circuit_breaker import CircuitOpenError
+from .fal_client import get_fal_client
+from .generation_cache import generation_cache_key, get_generation_cache
+from .leases import get_lease_manager
+from .rate_limiter import openai_call
+from .tracing import current_span, span, traced
+from .notification_coalescer import NotificationCoalescer, CanvasUpdate
+from .snapshot_cache import snapshot_cache
+from .thread_run_queue import ThreadRunQueue
+from .tool_registry import ToolRegistry, ToolValidationError, UnknownToolError
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# --- Fal generation requests (shared with the webhook-driven scene state machine) ---
+
+# Scene column holding the image generated by each version (image_url always gets it too)
+IMAGE_RESULT_COLUMNS = {"v1": "scene_image_v1_url", "v2": "scene_image_v2_url"}
+
+def image_generation_request(scene: Dict[str, Any], image_prompt: str, version: str) -> Tuple[str, Dict[str, Any], str]:
+    """(model, payload, scene column for the result) generating a scene image of `version`."""
+    product_image_url = scene.get("product_image_url")
+    if version == "v1":
+        # Subject-driven generation from the prompt
+        payload = {
+            "prompt": image_prompt,
+            "image_url": product_image_url,
+            "image_size": "portrait_16_9",
+            "num_images": 1,
+            "output_format": "jpeg",
+            "enable_safety_checker": True,
+        }
+        return settings.fal_image_model_v1, payload, IMAGE_RESULT_COLUMNS["v1"]
+    # Product shot placed into the v1 scene image when there is one, else the prompt
+    payload = {"image_url": product_image_url, "shot_size": [768, 1360]}
+    if scene.get("scene_image_v1_url"):
+        payload["ref_image_url"] = scene["scene_image_v1_url"]
+    else:
+        payload["scene_description"] = image_prompt
+    return settings.fal_image_model_v2, payload, IMAGE_RESULT_COLUMNS["v2"]
+
+def video_generation_request(scene: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    """(model, payload) animating the scene image according to its description."""
+    return settings.fal_video_model, {"prompt": scene.get("description"), "image_url": scene.get("image_url")}
+
+def image_output_url(output: Dict[str, Any]) -> Optional[str]:
+    images = output.get("images") or []
+    return images[0].get("url") if images else None
+
+def video_output_url(output: Dict[str, Any]) -> Optional[str]:
+    return (output.get("video") or {}).get("url")
+
+class ChatStreamEventHandler(AssistantEventHandler):
+    """
+    Forwards Assistant run stream events to `emit(event, data)`.
+    The OpenAI SDK drives this handler from a worker thread, so `emit` must be thread-safe.
+    """
+    def __init__(self, emit: Callable[[str, Dict[str, Any]], None]):
+        super().__init__()
+        self._emit = emit
+
+    def on_run_step_created(self, run_step) -> None:
+        self._emit("run", {"run_id": run_step.run_id, "status": "in_progress"})
+
+    def on_text_delta(self, delta, snapshot) -> None:
+        if delta.value:
+            self._emit("text_delta", {"value": delta.value})
+
+    def on_tool_call_done(self, tool_call) -> None:
+        if tool_call.type == "function":
+            self._emit("tool_call", {
+                "tool_call_id": tool_call.id,
+                "name": tool_call.function.name,
+                "arguments": tool_call.function.arguments
+            })
+
+# Assistant function tools, registered by the @tool_registry.tool decorators on AgentService.
+# Definitions and argument validators are built once at import, not per request.
+tool_registry = ToolRegistry()
+
 class AgentService:
     """
     Placeholder class for handling agent logic, interactions with OpenAI Assistants,
     and processing notifications.
     """
+
     def __init__(self):
         try:
-            self.client = OpenAI(api_key=settings.openai_api_key)
+            # Retries are done by openai_call, which also pauses the shared rate limit on 429s
+            self.client = OpenAI(api_key=settings.openai_api_key, max_retries=0)
             self.assistant_id = settings.openai_assistant_id
             if not self.assistant_id or self.assistant_id == "YOUR_OPENAI_ASSISTANT_ID":
                  logger.warning("OpenAI Assistant ID is not configured in .env file.")
                  # Potentially raise an error or handle gracefully
+            # One poller shared by all chat requests instead of a polling loop per request
+            self.run_poller = RunStatusPoller(
+                self.client,
+                min_interval=settings.run_poll_min_interval,
+                max_interval=settings.run_poll_max_interval,
+                max_concurrency=settings.run_poll_max_concurrency
+            )
             logger.info(f"AgentService initialized. Using Assistant ID: {self.assistant_id}")
         except Exception as e:
             logger.exception("Failed to initialize OpenAI client in AgentService.")
             raise RuntimeError("Could not initialize OpenAI client.") from e
-        # No in-memory store needed now
-
+        # project_id -> OpenAI thread ID, in front of the chat_sessions lookup
+        self._thread_cache: TTLCache[str] = TTLCache(settings.thread_cache_size, ttl=settings.thread_cache_ttl)
+        self._thread_singleflight = SingleFlight()
+        # Identical generation requests for a scene in flight at once (chat and pipeline, two tabs) share one job
+        self.generation_flights = SingleFlight()
+        # One active run per OpenAI thread; messages sent meanwhile are merged into the next run
+        self.run_queue = ThreadRunQueue(max_merge=settings.chat_run_merge_max)
+        # Debounced canvas edit notifications, written to canvas_scenes in bulk
+        self.canvas_updates = NotificationCoalescer(self._apply_canvas_updates)
+
+    @traced("chat.thread_lookup", root=False)
     async def _get_or_create_thread(self, project_id: str, existing_thread_id: Optional[str]) -> str:
         """
         Gets the existing OpenAI thread ID associated with the project from the database,
@@ -41,230 +139,133 @@ class AgentService:
             # Optional: Verify thread exists in OpenAI API? Could add overhead.
             return existing_thread_id
 
-        supabase = get_supabase_client()
+        cached_thread_id = self._thread_cache.get(project_id)
+        if cached_thread_id:
+            logger.info(f"Using cached thread_id: {cached_thread_id} for project {project_id}")
+            return cached_thread_id
+
+        # Concurrent first messages for the same project share one lookup/creation,
+        # so only one OpenAI thread gets created.
+        return await self._thread_singleflight.do(project_id, lambda: self._lookup_or_create_thread(project_id))
+
+    async def _lookup_or_create_thread(self, project_id: str) -> str:
+        """
+        Looks up the project's thread ID in the database, creating and saving a new thread
+        if none exists. Successful results are written to the thread cache. Creation holds
+        the project's `thread:` lease so API workers never create two threads for a project.
+        """
+        repository = get_supabase_repository()
         logger.info(f"Checking database for existing thread_id for project {project_id}")
 
         try:
             # TODO: Adapt table/column names if different (e.g., canvas_projects table?)
             # Assuming a direct link or a separate chat_sessions table
-            response = await asyncio.to_thread(
-                supabase.table("chat_sessions") # Or potentially canvas_projects
-                .select("openai_thread_id")
-                .eq("project_id", project_id)
-                .maybe_single() # Expect 0 or 1 result
-                .execute
-            )
-
-            if response.error:
-                raise Exception(f"Supabase error fetching thread ID: {response.error.message}")
+            db_thread_id = await repository.get_chat_thread_id(project_id)
 
-            if response.data and response.data.get("openai_thread_id"):
-                db_thread_id = response.data["openai_thread_id"]
+            if db_thread_id:
                 logger.info(f"Found existing thread_id in database: {db_thread_id} for project {project_id}")
+                self._thread_cache.set(project_id, db_thread_id)
                 return db_thread_id
-            else:
-                 logger.info(f"No existing thread_id found in database for project {project_id}. Creating new thread.")
-                 # Create new thread via OpenAI API
-                 thread = await asyncio.to_thread(self.client.beta.threads.create)
-                 new_thread_id = thread.id
-                 logger.info(f"Created new OpenAI thread with id: {new_thread_id}")
-
-                 # Save the new thread ID to the database
-                 # This uses upsert: creates if no record for project_id exists, updates if it does (e.g., if it was null before)
-                 # TODO: Adapt table/column names and logic if using a different structure
-                 update_response = await asyncio.to_thread(
-                     supabase.table("chat_sessions")
-                     .upsert({"project_id": project_id, "openai_thread_id": new_thread_id}, on_conflict="project_id")
-                     .execute
-                 )
-
-                 if update_response.error:
-                      # Log error but proceed with the new thread ID anyway for this session
-                      logger.error(f"Failed to save new thread_id {new_thread_id} to database for project {project_id}: {update_response.error.message}")
-                 else:
-                      logger.info(f"Successfully saved new thread_id {new_thread_id} to database for project {project_id}")
-
-                 return new_thread_id
 
+            logger.info(f"No existing thread_id found in database for project {project_id}. Creating new thread.")
+            # Another API worker may be creating this project's thread at the same moment:
+            # create it under the project's thread lease, looking again once it is held
+            async with get_lease_manager().hold(f"thread:{project_id}", wait=settings.thread_lease_wait):
+                db_thread_id = await repository.get_chat_thread_id(project_id)
+                if db_thread_id:
+                    logger.info(f"Thread {db_thread_id} for project {project_id} was created by another worker")
+                    self._thread_cache.set(project_id, db_thread_id)
+                    return db_thread_id
+                return await self._create_thread(repository, project_id)
+
+        except CircuitOpenError:
+            # Supabase or OpenAI is known to be down: surface that (503) without a traceback per request
+            self._thread_cache.invalidate(project_id)
+            raise
         except Exception as e:
             logger.exception(f"Error getting or creating thread for project {project_id}")
+            self._thread_cache.invalidate(project_id)
             # Decide on fallback behavior: re-raise, return None, or try creating without saving?
             # Raising for now to make the issue visible.
             raise ConnectionError(f"Could not get or create OpenAI thread for project {project_id}.") from e
 
+    async def _create_thread(self, repository: SupabaseRepository, project_id: str) -> str:
+        """Creates an OpenAI thread for the project and saves its ID (caching it if saved)."""
+        # Create new thread via OpenAI API
+        thread = await openai_call("threads.create", self.client.beta.threads.create)
+        new_thread_id = thread.id
+        logger.info(f"Created new OpenAI thread with id: {new_thread_id}")
+
+        # Save the new thread ID to the database
+        # This uses upsert: creates if no record for project_id exists, updates if it does (e.g., if it was null before)
+        # TODO: Adapt table/column names and logic if using a different structure
+        try:
+            await repository.save_chat_thread_id(project_id, new_thread_id)
+            logger.info(f"Successfully saved new thread_id {new_thread_id} to database for project {project_id}")
+            self._thread_cache.set(project_id, new_thread_id)
+        except (SupabaseError, CircuitOpenError) as save_error:
+            # Log error but proceed with the new thread ID anyway for this session
+            # Not cached: the database has no record of it, so the next lookup should retry
+            logger.error(f"Failed to save new thread_id {new_thread_id} to database for project {project_id}: {save_error}")
+            self._thread_cache.invalidate(project_id)
+
+        return new_thread_id
+
+    def _get_tool_definitions(self) -> List[Dict[str, Any]]:
+        """Returns the function tool definitions passed to every Assistant run (prebuilt by the registry)."""
+        return tool_registry.definitions()
+
+    @traced("chat.process_message")
     async def process_chat_message(self, project_id: str, thread_id: Optional[str], message_text: str, attachments: list = []) -> Dict[str, Any]:
         """
         Processes an incoming chat message using the OpenAI Assistant API.
+        Runs on the same thread are serialized; if the thread is busy, the message waits and
+        may share the next run with other queued messages (the response then covers all of them).
         """
         logger.info(f"Processing chat message for project {project_id}, thread {thread_id}: '{message_text}'")
+        current_span().set_attribute("project_id", project_id)
 
         if not self.assistant_id or self.assistant_id == "YOUR_OPENAI_ASSISTANT_ID":
              raise ValueError("OpenAI Assistant ID is not configured.")
 
         current_thread_id = await self._get_or_create_thread(project_id, thread_id)
 
+        return await self.run_queue.submit(
+            current_thread_id,
+            message_text,
+            functools.partial(self._run_chat_messages, project_id, current_thread_id)
+        )
+
+    @traced("chat.run", root=False)
+    async def _run_chat_messages(self, project_id: str, current_thread_id: str, message_texts: List[str]) -> Dict[str, Any]:
+        """Adds the queued user messages to the thread and performs one run answering them."""
+        current_span().set_attribute("messages", len(message_texts))
         try:
-            # 1. Add the user message to the thread
-            logger.info(f"Adding message to thread {current_thread_id}")
+            # 1. Add the user message(s) to the thread
+            logger.info(f"Adding {len(message_texts)} message(s) to thread {current_thread_id}")
             # TODO: Handle attachments correctly when adding message
-            message = await asyncio.to_thread(
-                self.client.beta.threads.messages.create,
-                thread_id=current_thread_id,
-                role="user",
-                content=message_text,
-                # attachments=attachments # Add attachment handling later if needed
-            )
-            logger.info(f"Message {message.id} added to thread {current_thread_id}")
+            for message_text in message_texts:
+                message = await openai_call(
+                    "messages.create", self.client.beta.threads.messages.create,
+                    thread_id=current_thread_id,
+                    role="user",
+                    content=message_text,
+                    # attachments=attachments # Add attachment handling later if needed
+                )
+                logger.info(f"Message {message.id} added to thread {current_thread_id}")
 
             # 2. Create a Run
             logger.info(f"Creating run for thread {current_thread_id} with assistant {self.assistant_id}")
-            run = await asyncio.to_thread(
-                self.client.beta.threads.runs.create,
+            run = await openai_call(
+                "runs.create", self.client.beta.threads.runs.create,
                 thread_id=current_thread_id,
                 assistant_id=self.assistant_id,
                 # instructions="Override assistant instructions here if needed",
-                tools=[ # Define the tools the assistant can use
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "get_project_details",
-                            "description": "Get the project title and a list of its scenes (ID and title).",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "project_id": {
-                                        "type": "string",
-                                        "description": "The ID of the project to fetch details for."
-                                    }
-                                },
-                                "required": ["project_id"]
-                            }
-                        }
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "update_scene_script",
-                            "description": "Update the script content for a specific scene.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "scene_id": {
-                                        "type": "string",
-                                        "description": "The ID of the scene to update."
-                                    },
-                                    "script_content": {
-                                        "type": "string",
-                                        "description": "The new script content for the scene."
-                                    }
-                                },
-                                "required": ["scene_id", "script_content"]
-                            }
-                        }
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "create_scene",
-                            "description": "Create a new scene within a project.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "project_id": {
-                                        "type": "string",
-                                        "description": "The ID of the project to add the scene to."
-                                    },
-                                    "title": {
-                                        "type": "string",
-                                        "description": "The title for the new scene."
-                                    }
-                                },
-                                "required": ["project_id", "title"]
-                            }
-                        }
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "trigger_image_generation",
-                            "description": "Starts the process to generate a scene image using a specific prompt and product image.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "scene_id": {
-                                        "type": "string",
-                                        "description": "The ID of the scene for which to generate the image."
-                                    },
-                                    "image_prompt": { # Assuming prompt is passed, could also fetch from scene_id
-                                        "type": "string",
-                                        "description": "The detailed prompt to use for image generation."
-                                    },
-                                     # Product image URL will be fetched based on scene_id
-                                    "version": {
-                                        "type": "string",
-                                        "enum": ["v1", "v2"],
-                                        "description": "The generation model version to use (v1 or v2)."
-                                    }
-                                },
-                                "required": ["scene_id", "image_prompt", "version"]
-                            }
-                        }
-                    },
-                    { # Added comma here
-                        "type": "function",
-                        "function": {
-                            "name": "trigger_video_generation",
-                            "description": "Starts the process to generate a scene video using the scene image and description.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "scene_id": {
-                                        "type": "string",
-                                        "description": "The ID of the scene for which to generate the video."
-                                    }
-                                    # Assuming image_url and description are fetched based on scene_id
-                                },
-                                "required": ["scene_id"]
-                            }
-                        }
-                    }, # Added comma here
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "create_multiple_scenes",
-                            "description": "Creates multiple new scenes within a project based on provided script content for each.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "project_id": {
-                                        "type": "string",
-                                        "description": "The ID of the project to add the scenes to."
-                                    },
-                                    "scenes": {
-                                        "type": "array",
-                                        "description": "A list of scene objects to create.",
-                                        "items": {
-                                            "type": "object",
-                                            "properties": {
-                                                "title": {"type": "string", "description": "Title for the scene (e.g., 'Scene 1')"},
-                                                "script": {"type": "string", "description": "The script content for this specific scene."},
-                                                "scene_order": {"type": "integer", "description": "The order number for this scene."}
-                                                # Add other fields like voice_over_text if the agent provides them
-                                            },
-                                            "required": ["title", "script", "scene_order"]
-                                        }
-                                    }
-                                },
-                                "required": ["project_id", "scenes"]
-                            }
-                        }
-                    }
-                    # TODO: Add more tools later if needed
-                ] # Correctly close tools list
+                tools=self._get_tool_definitions()
             ) # Correctly close runs.create call
             logger.info(f"Run {run.id} created with status: {run.status}")
 
-            # 3. Poll the Run status and handle actions
+            # 3. Wait on the Run status and handle actions
             while run.status in ['queued', 'in_progress', 'cancelling', 'requires_action']:
                 if run.status == 'requires_action' and run.required_action:
                     logger.info(f"Run {run.id} requires action. Processing tool calls...")
@@ -272,33 +273,32 @@ class AgentService:
 
                     logger.info(f"Submitting tool outputs for run {run.id}")
                     try:
-                        run = await asyncio.to_thread(
-                            self.client.beta.threads.runs.submit_tool_outputs,
+                        run = await openai_call(
+                            "runs.submit_tool_outputs", self.client.beta.threads.runs.submit_tool_outputs,
                             thread_id=current_thread_id,
                             run_id=run.id,
                             tool_outputs=tool_outputs
                         )
                         logger.info(f"Tool outputs submitted for run {run.id}. New status: {run.status}")
-                        # Immediately continue to the next polling iteration
-                        await asyncio.sleep(0.5) # Short sleep before re-polling after submission
+                        # Continue with the status returned by the submission
+                    except CircuitOpenError:
+                        raise
                     except Exception as tool_submission_error:
                          logger.exception(f"Error submitting tool outputs for run {run.id}")
                          # Decide how to handle this - fail the run?
-                         run = await asyncio.to_thread(self.client.beta.threads.runs.cancel, thread_id=current_thread_id, run_id=run.id)
+                         run = await openai_call("runs.cancel", self.client.beta.threads.runs.cancel, thread_id=current_thread_id, run_id=run.id)
                          raise RuntimeError(f"Failed to submit tool outputs: {tool_submission_error}") from tool_submission_error
                 else:
-                    # If not requires_action, wait before polling again
-                    await asyncio.sleep(1)
-
-                # Re-retrieve the run status
-                run = await asyncio.to_thread(self.client.beta.threads.runs.retrieve, thread_id=current_thread_id, run_id=run.id)
-                logger.info(f"Run {run.id} status: {run.status}")
+                    # Wait for the shared poller to report a status change instead of sleeping and re-polling here
+                    with span("chat.run_wait", root=False, status=run.status):
+                        run = await self.run_poller.wait_for_status_change(current_thread_id, run.id, run.status)
+                    logger.info(f"Run {run.id} status: {run.status}")
 
             # 4. Handle final Run status after the loop exits
             if run.status == 'completed':
                 logger.info(f"Run {run.id} completed. Fetching messages...")
-                messages_response = await asyncio.to_thread(
-                    self.client.beta.threads.messages.list,
+                messages_response = await openai_call(
+                    "messages.list", self.client.beta.threads.messages.list,
                     thread_id=current_thread_id,
                     order="desc", # Get the latest messages first
                     limit=10 # Limit to recent messages
@@ -318,7 +318,8 @@ class AgentService:
                          "thread_id": current_thread_id,
                          "content": "", # Or a system message like "Task completed."
                          "run_id": run.id,
-                         "status": run.status
+                         "status": run.status,
+                         "merged_messages": len(message_texts)
                      }
 
 
@@ -336,7 +337,8 @@ class AgentService:
                     "thread_id": current_thread_id,
                     "content": response_content.strip(),
                     "run_id": run.id,
-                    "status": run.status
+                    "status": run.status,
+                    "merged_messages": len(message_texts)
                 }
             # Handle other terminal states
             elif run.status in ['failed', 'cancelled', 'expired']:
@@ -352,72 +354,208 @@ class AgentService:
 
         except Exception as e:
             logger.exception(f"Error processing chat message in thread {current_thread_id}")
+            if isinstance(e, NotFoundError):
+                # The cached thread no longer exists upstream; force a fresh lookup next time
+                self._thread_cache.invalidate(project_id)
             raise # Re-raise the exception to be handled by the API endpoint
 
-    async def _process_tool_calls(self, required_action) -> List[Dict[str, str]]: # MODIFIED Line 357
-        """Processes required tool calls and returns their outputs."""
-        tool_outputs: List[Dict[str, str]] = [] # MODIFIED Line 359
+    async def stream_chat_message(self, project_id: str, thread_id: Optional[str], message_text: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Processes an incoming chat message using Assistant run streaming.
+        Yields {"event": ..., "data": {...}} dicts as the run progresses: `thread`, `run`,
+        `text_delta`, `tool_call`, `tool_output`, and finally `done` (or `error`).
+        Tool outputs are submitted through the streaming API, so no polling is involved.
+        If the thread is busy, a `queued` event is emitted and the run waits for its turn.
+        """
+        logger.info(f"Streaming chat message for project {project_id}, thread {thread_id}: '{message_text}'")
 
-        for tool_call in required_action.submit_tool_outputs.tool_calls:
-            function_name = tool_call.function.name
-            arguments = json.loads(tool_call.function.arguments)
-            tool_call_id = tool_call.id
+        if not self.assistant_id or self.assistant_id == "YOUR_OPENAI_ASSISTANT_ID":
+             raise ValueError("OpenAI Assistant ID is not configured.")
 
-            logger.info(f"Executing tool call: {function_name}({arguments}) ID: {tool_call_id}")
+        current_thread_id = await self._get_or_create_thread(project_id, thread_id)
+        yield {"event": "thread", "data": {"thread_id": current_thread_id}}
 
-            output = None
-            try:
-                # --- Map function names to actual backend functions ---
-                if function_name == "get_project_details":
-                    output = await self._tool_get_project_details(**arguments)
-                elif function_name == "update_scene_script":
-                    output = await self._tool_update_scene_script(**arguments)
-                elif function_name == "create_scene":
-                    output = await self._tool_create_scene(**arguments)
-                elif function_name == "trigger_image_generation":
-                    output = await self._tool_trigger_image_generation(**arguments)
-                elif function_name == "trigger_video_generation":
-                    output = await self._tool_trigger_video_generation(**arguments)
-                elif function_name == "create_multiple_scenes":
-                    output = await self._tool_create_multiple_scenes(**arguments)
-                # TODO: Add mappings for other tools
-                else:
-                    logger.warning(f"Unknown tool function called: {function_name}")
-                    output = json.dumps({"error": f"Unknown tool function: {function_name}"})
+        depth = self.run_queue.depth(current_thread_id)
+        if depth:
+            # Another run is active on this thread; the stream starts once it is our turn
+            yield {"event": "queued", "data": {"thread_id": current_thread_id, "position": depth}}
 
-            except Exception as e:
-                logger.exception(f"Error executing tool call {function_name} with ID {tool_call_id}")
-                output = json.dumps({"error": f"Error executing tool {function_name}: {str(e)}"})
+        async with self.run_queue.exclusive(current_thread_id):
+            logger.info(f"Adding message to thread {current_thread_id}")
+            message = await openai_call(
+                "messages.create", self.client.beta.threads.messages.create,
+                thread_id=current_thread_id,
+                role="user",
+                content=message_text,
+            )
+            logger.info(f"Message {message.id} added to thread {current_thread_id}")
 
-            # MODIFIED Line 392 (was ToolOutput(...))
-            tool_outputs.append({"tool_call_id": tool_call_id, "output": output})
+            open_run_stream = functools.partial(
+                self.client.beta.threads.runs.stream,
+                thread_id=current_thread_id,
+                assistant_id=self.assistant_id,
+                tools=self._get_tool_definitions()
+            )
 
-        return tool_outputs
+            response_content = ""
+            while True:
+                run = None
+                async for event in self._forward_run_stream(open_run_stream):
+                    if event["event"] == "run_finished":
+                        run = event["data"]
+                        continue
+                    if event["event"] == "text_delta":
+                        response_content += event["data"]["value"]
+                    yield event
+
+                if run is not None and run.status == 'requires_action' and run.required_action:
+                    logger.info(f"Run {run.id} requires action. Processing tool calls...")
+                    tool_outputs = await self._process_tool_calls(run.required_action)
+                    for tool_output in tool_outputs:
+                        yield {"event": "tool_output", "data": tool_output}
+
+                    logger.info(f"Submitting tool outputs for run {run.id} via stream")
+                    open_run_stream = functools.partial(
+                        self.client.beta.threads.runs.submit_tool_outputs_stream,
+                        thread_id=current_thread_id,
+                        run_id=run.id,
+                        tool_outputs=tool_outputs
+                    )
+                    continue
+                break
+
+            if run is not None and run.status == 'completed':
+                logger.info(f"Streamed run {run.id} completed.")
+                yield {"event": "done", "data": {
+                    "thread_id": current_thread_id,
+                    "run_id": run.id,
+                    "status": run.status,
+                    "content": response_content.strip()
+                }}
+            else:
+                status = run.status if run is not None else "unknown"
+                error_message = f"Assistant run ended with status: {status}"
+                if run is not None and run.last_error:
+                    error_message += f". Error: {run.last_error.message} (Code: {run.last_error.code})"
+                logger.error(error_message)
+                yield {"event": "error", "data": {
+                    "thread_id": current_thread_id,
+                    "run_id": run.id if run is not None else None,
+                    "status": status,
+                    "message": error_message
+                }}
 
-    # --- Placeholder Tool Implementations ---
-    # Replace these with actual logic interacting with Supabase or other services
+    async def _forward_run_stream(self, open_run_stream: Callable[..., Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Drives one (blocking) OpenAI run stream on a worker thread and yields its events on
+        the event loop as they arrive. The last event is `run_finished` carrying the final Run.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(event: str, data: Any):
+            loop.call_soon_threadsafe(queue.put_nowait, {"event": event, "data": data})
+
+        def drain() -> Run:
+            with open_run_stream(event_handler=ChatStreamEventHandler(emit)) as stream:
+                stream.until_done()
+                return stream.current_run
+
+        stream_task = asyncio.ensure_future(openai_call("runs.stream", drain))
+        # End-of-stream marker, queued after every event the stream emitted. Queued from the
+        # task rather than from drain(), so a call refused before drain() runs (circuit open,
+        # rate limit) still ends the loop and its error is raised below.
+        stream_task.add_done_callback(lambda _: queue.put_nowait(None))
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield event
+        yield {"event": "run_finished", "data": await stream_task}
+
+    @traced("chat.tool_calls", root=False)
+    async def _process_tool_calls(self, required_action) -> List[Dict[str, str]]:
+        """
+        Processes required tool calls concurrently (up to TOOL_CALL_CONCURRENCY at once) and
+        returns their outputs in the same order as the tool calls.
+        """
+        tool_calls = required_action.submit_tool_outputs.tool_calls
+        current_span().set_attribute("tool_calls", len(tool_calls))
+        semaphore = asyncio.Semaphore(max(1, settings.tool_call_concurrency))
+
+        async def execute_bounded(tool_call) -> str:
+            async with semaphore:
+                return await self._execute_tool_call(tool_call)
+
+        # gather preserves argument order, so outputs line up with tool_call ids
+        outputs = await asyncio.gather(*(execute_bounded(tool_call) for tool_call in tool_calls))
+        return [
+            {"tool_call_id": tool_call.id, "output": output}
+            for tool_call, output in zip(tool_calls, outputs)
+        ]
+
+    async def _execute_tool_call(self, tool_call) -> str:
+        """Runs a single tool call under its own deadline and returns the output string for the model."""
+        function_name = tool_call.function.name
+        tool_call_id = tool_call.id
+        timeout = tool_registry.timeout_for(function_name, settings.tool_call_timeout)
+
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+            logger.info(f"Executing tool call: {function_name}({arguments}) ID: {tool_call_id}")
+            return await asyncio.wait_for(self._dispatch_tool(function_name, arguments), timeout=timeout)
+
+        except asyncio.TimeoutError:
+            logger.error(f"Tool call {function_name} with ID {tool_call_id} timed out after {timeout}s")
+            return json.dumps({
+                "error": f"Tool {function_name} timed out after {timeout} seconds.",
+                "timeout": True,
+                "timeout_seconds": timeout
+            })
+        except Exception as e:
+            logger.exception(f"Error executing tool call {function_name} with ID {tool_call_id}")
+            return json.dumps({"error": f"Error executing tool {function_name}: {str(e)}"})
+
+    async def _dispatch_tool(self, function_name: str, arguments: Dict[str, Any]) -> str:
+        """Validates the arguments and runs the registered tool implementation."""
+        try:
+            return await tool_registry.dispatch(self, function_name, arguments)
+        except UnknownToolError:
+            logger.warning(f"Unknown tool function called: {function_name}")
+            return json.dumps({"error": f"Unknown tool function: {function_name}"})
+        except ToolValidationError as e:
+            # Returned to the model so it can correct the call
+            logger.warning(str(e))
+            return json.dumps({"error": str(e), "validation_errors": e.errors})
 
+    # --- Placeholder Tool Implementations ---
+    # Replace these with actual logic interacting with Supabase or other services.
+    # Each @tool_registry.tool carries the schema sent to the Assistant; add new tools the same way.
+
+    @tool_registry.tool(
+        "get_project_details",
+        "Get the project title and a list of its scenes (ID and title).",
+        {
+            "type": "object",
+            "properties": {
+                "project_id": {
+                    "type": "string",
+                    "description": "The ID of the project to fetch details for."
+                }
+            },
+            "required": ["project_id"]
+        }
+    )
     async def _tool_get_project_details(self, project_id: str) -> str:
         """Tool implementation: Fetches project title and scene list from Supabase."""
         logger.info(f"Tool: get_project_details called for project_id: {project_id}")
         try:
-            supabase = get_supabase_client()
-            # Fetch project title and associated scenes (id and title only)
-            project_response = await asyncio.to_thread(
-                supabase.table("canvas_projects")
-                .select("id, title, canvas_scenes(id, title, scene_order)")
-                .eq("id", project_id)
-                .single()
-                .execute
-            )
-
-            if project_response.error:
-                raise Exception(f"Supabase error fetching project: {project_response.error.message}")
+            # Fetch project title and associated scenes (id and title only), cached until a write tool invalidates it
+            project_data = await snapshot_cache.get_project_with_scenes(get_supabase_repository(), project_id)
 
-            if not project_response.data:
+            if not project_data:
                  return json.dumps({"error": f"Project with ID {project_id} not found."})
 
-            project_data = project_response.data
             # Sort scenes by order
             scenes = sorted(project_data.get("canvas_scenes", []), key=lambda s: s.get("scene_order", 0))
 
@@ -432,25 +570,34 @@ class AgentService:
             logger.exception(f"Error in _tool_get_project_details for project {project_id}")
             return json.dumps({"error": f"Failed to get project details: {str(e)}"})
 
+    @tool_registry.tool(
+        "update_scene_script",
+        "Update the script content for a specific scene.",
+        {
+            "type": "object",
+            "properties": {
+                "scene_id": {
+                    "type": "string",
+                    "description": "The ID of the scene to update."
+                },
+                "script_content": {
+                    "type": "string",
+                    "description": "The new script content for the scene."
+                }
+            },
+            "required": ["scene_id", "script_content"]
+        }
+    )
     async def _tool_update_scene_script(self, scene_id: str, script_content: str) -> str:
         """Tool implementation: Updates the script for a given scene in Supabase."""
         logger.info(f"Tool: update_scene_script called for scene_id: {scene_id}")
         try:
-            supabase = get_supabase_client()
-            response = await asyncio.to_thread(
-                supabase.table("canvas_scenes")
-                .update({"script": script_content, "updated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())})
-                .eq("id", scene_id)
-                .execute
+            # Raises SupabaseError if the update fails
+            await get_supabase_repository().update_scene(
+                scene_id,
+                {"script": script_content, "updated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
             )
-
-            # Check if the update was successful (e.g., data is not empty or error is None)
-            # Note: Supabase update response might not return data by default unless specified with select()
-            if response.error:
-                 raise Exception(f"Supabase error updating scene script: {response.error.message}")
-
-            # You might want to check response.count or similar if available and relevant
-            # For simplicity, we assume success if no error is thrown
+            snapshot_cache.invalidate_scene(scene_id)
 
             logger.info(f"Successfully updated script for scene {scene_id}")
             return json.dumps({"success": True, "scene_id": scene_id, "message": "Scene script updated successfully."})
@@ -459,51 +606,50 @@ class AgentService:
             logger.exception(f"Error in _tool_update_scene_script for scene {scene_id}")
             return json.dumps({"success": False, "error": f"Failed to update scene script: {str(e)}"})
 
+    @tool_registry.tool(
+        "create_scene",
+        "Create a new scene within a project.",
+        {
+            "type": "object",
+            "properties": {
+                "project_id": {
+                    "type": "string",
+                    "description": "The ID of the project to add the scene to."
+                },
+                "title": {
+                    "type": "string",
+                    "description": "The title for the new scene."
+                }
+            },
+            "required": ["project_id", "title"]
+        }
+    )
     async def _tool_create_scene(self, project_id: str, title: str) -> str:
         """Tool implementation: Creates a new scene for a project in Supabase."""
         logger.info(f"Tool: create_scene called for project_id: {project_id} with title: {title}")
         try:
-            supabase = get_supabase_client()
+            repository = get_supabase_repository()
 
             # 1. Get the current max scene_order for the project
-            order_response = await asyncio.to_thread(
-                supabase.table("canvas_scenes")
-                .select("scene_order")
-                .eq("project_id", project_id)
-                .order("scene_order", desc=True)
-                .limit(1)
-                .execute
-            )
-
-            if order_response.error:
-                raise Exception(f"Supabase error fetching scene order: {order_response.error.message}")
-
-            next_order = 1
-            if order_response.data:
-                next_order = (order_response.data[0].get("scene_order") or 0) + 1
+            next_order = await repository.get_max_scene_order(project_id) + 1
 
             # 2. Insert the new scene
-            insert_response = await asyncio.to_thread(
-                supabase.table("canvas_scenes")
-                .insert({
-                    "project_id": project_id,
-                    "title": title,
-                    "scene_order": next_order,
-                    # Add default empty values for other fields if needed by schema
-                    "script": "",
-                    "description": "",
-                    "voice_over_text": "",
-                    "image_prompt": "",
-                })
-                .select("id") # Select the ID of the newly created scene
-                .single() # Expecting only one row back
-                .execute
-            )
-
-            if insert_response.error:
-                raise Exception(f"Supabase error inserting new scene: {insert_response.error.message}")
-
-            new_scene_id = insert_response.data.get("id")
+            inserted = await repository.insert_scenes([{
+                "project_id": project_id,
+                "title": title,
+                "scene_order": next_order,
+                # Add default empty values for other fields if needed by schema
+                "script": "",
+                "description": "",
+                "voice_over_text": "",
+                "image_prompt": "",
+            }])
+
+            if not inserted:
+                raise SupabaseError("Insert returned no rows for the new scene.")
+
+            snapshot_cache.invalidate_project(project_id)
+            new_scene_id = inserted[0].get("id")
             logger.info(f"Successfully created new scene {new_scene_id} for project {project_id}")
             return json.dumps({"success": True, "scene_id": new_scene_id, "message": "New scene created successfully."})
 
@@ -511,104 +657,193 @@ class AgentService:
             logger.exception(f"Error in _tool_create_scene for project {project_id}")
             return json.dumps({"success": False, "error": f"Failed to create scene: {str(e)}"})
 
-    async def _tool_trigger_image_generation(self, scene_id: str, image_prompt: str, version: str) -> str: # Removed product_image_url from signature
-        """Tool implementation: Triggers image generation for a scene."""
+    @tool_registry.tool(
+        "trigger_image_generation",
+        "Generates a scene image from a specific prompt and the scene's product image, and saves it to the scene. "
+        "Identical inputs reuse the previously generated image unless bypass_cache is set.",
+        {
+            "type": "object",
+            "properties": {
+                "scene_id": {
+                    "type": "string",
+                    "description": "The ID of the scene for which to generate the image."
+                },
+                "image_prompt": { # Assuming prompt is passed, could also fetch from scene_id
+                    "type": "string",
+                    "description": "The detailed prompt to use for image generation."
+                },
+                 # Product image URL will be fetched based on scene_id
+                "version": {
+                    "type": "string",
+                    "enum": ["v1", "v2"],
+                    "description": "The generation model version to use (v1 or v2)."
+                },
+                "bypass_cache": {
+                    "type": "boolean",
+                    "description": "Generate a new image even if one was already made from identical inputs (e.g. the user asks for another variation)."
+                }
+            },
+            "required": ["scene_id", "image_prompt", "version"]
+        },
+        timeout=180.0 # Generation takes longer than TOOL_CALL_TIMEOUT
+    )
+    async def _tool_trigger_image_generation(self, scene_id: str, image_prompt: str, version: str, bypass_cache: bool = False) -> str: # Removed product_image_url from signature
+        """Tool implementation: Generates a scene image on Fal and stores its URL on the scene."""
         logger.info(f"Tool: trigger_image_generation called for scene_id: {scene_id}, version: {version}")
 
         try:
-            supabase = get_supabase_client()
-
-            # 1. Fetch the scene to get the product_image_url
-            scene_response = await asyncio.to_thread(
-                supabase.table("canvas_scenes")
-                .select("productImageUrl")
-                .eq("id", scene_id)
-                .single()
-                .execute
-            )
+            # 1. Fetch the scene to get the product image (and the v1 image, used as v2's reference)
+            # Served from the snapshot cache when the pipeline already loaded this scene
+            repository = get_supabase_repository()
+            scene = await snapshot_cache.get_scene(repository, scene_id, "product_image_url, scene_image_v1_url")
 
-            if scene_response.error:
-                raise Exception(f"Supabase error fetching scene: {scene_response.error.message}")
-
-            if not scene_response.data:
+            if not scene:
                 return json.dumps({"success": False, "error": f"Scene with ID {scene_id} not found."})
 
-            product_image_url = scene_response.data.get("productImageUrl")
+            product_image_url = scene.get("product_image_url")
             if not product_image_url:
                 return json.dumps({"success": False, "error": f"Product image URL not found for scene {scene_id}."})
 
-            # 2. Construct the URL for the Fal function (replace with your actual Fal endpoint)
-            # Assuming you have a Fal function deployed that takes scene_id, prompt, product_image_url, and version
-            fal_function_url = f"https://your-fal-app/generate-image" # Replace with your actual URL
-
-            # 3. Trigger the Fal function (replace with your actual Fal API call)
-            # This is a placeholder - adapt to your specific Fal setup
-            logger.info(f"Triggering Fal image generation for scene {scene_id} with prompt and product image.")
-            # In a real implementation, you would make an HTTP request to the Fal function
-            # with the scene_id, image_prompt, product_image_url, and version as parameters.
-            # You would then return a success or failure message based on the Fal function's response.
-            await asyncio.sleep(2) # Simulate a delay for image generation
+            # 2. Build the request for the model behind this version
+            model, payload, column = image_generation_request(scene, image_prompt, version)
 
-            # Placeholder response
-            mock_image_url = f"https://example.com/generated-image-{scene_id}.jpg"
-            return json.dumps({"success": True, "scene_id": scene_id, "image_url": mock_image_url, "message": "Image generation triggered (placeholder)."})
+            # 3. Generate and store the image; a concurrent identical request joins this one
+            cache_key = generation_cache_key("image", model, payload)
+            return await self.generation_flights.do(
+                ("image", scene_id, cache_key, bypass_cache),
+                lambda: self._generate_scene_image(repository, scene_id, model, payload, column, cache_key, bypass_cache)
+            )
 
         except Exception as e:
             logger.exception(f"Error in _tool_trigger_image_generation for scene {scene_id}")
             return json.dumps({"success": False, "error": f"Failed to trigger image generation: {str(e)}"})
 
-    async def _tool_trigger_video_generation(self, scene_id: str) -> str:
-        """Tool implementation: Triggers video generation for a scene."""
+    async def _generate_scene_image(self, repository, scene_id: str, model: str, payload: Dict[str, Any], column: str,
+                                    cache_key: str, bypass_cache: bool) -> str:
+        # Reuse an image generated from identical inputs, else submit to the Fal queue and wait
+        cache = get_generation_cache()
+        image_url = await cache.get(cache_key, "image", bypass=bypass_cache)
+        cached = image_url is not None
+        if not cached:
+            logger.info(f"Submitting Fal image generation ({model}) for scene {scene_id}.")
+            image_url = image_output_url(await get_fal_client().run(model, payload))
+            if not image_url:
+                return json.dumps({"success": False, "error": f"Image generation returned no image for scene {scene_id}."})
+            await cache.put(cache_key, "image", model, image_url)
+        else:
+            logger.info(f"Reusing cached image for scene {scene_id}.")
+
+        # Store the image on the scene
+        update = {column: image_url, "image_url": image_url}
+        await repository.update_scene(scene_id, update)
+        snapshot_cache.apply_scene_update(scene_id, update)
+        return json.dumps({"success": True, "scene_id": scene_id, "image_url": image_url, "cached": cached,
+                           "message": "Image reused from an identical earlier generation." if cached else "Image generated."})
+
+    @tool_registry.tool(
+        "trigger_video_generation",
+        "Generates a scene video from the scene image and description, and saves it to the scene. "
+        "Identical inputs reuse the previously generated video unless bypass_cache is set.",
+        {
+            "type": "object",
+            "properties": {
+                "scene_id": {
+                    "type": "string",
+                    "description": "The ID of the scene for which to generate the video."
+                },
+                # Assuming image_url and description are fetched based on scene_id
+                "bypass_cache": {
+                    "type": "boolean",
+                    "description": "Generate a new video even if one was already made from identical inputs (e.g. the user asks for another variation)."
+                }
+            },
+            "required": ["scene_id"]
+        },
+        timeout=300.0
+    )
+    async def _tool_trigger_video_generation(self, scene_id: str, bypass_cache: bool = False) -> str:
+        """Tool implementation: Generates a scene video on Fal and stores its URL on the scene."""
         logger.info(f"Tool: trigger_video_generation called for scene_id: {scene_id}")
         try:
             # 1. Fetch the scene to get the image_url and description
-            supabase = get_supabase_client()
             logger.debug(f"Fetching scene data for scene_id: {scene_id}")
-            scene_response = await asyncio.to_thread(
-                supabase.table("canvas_scenes")
-                .select("image_url, description")
-                .eq("id", scene_id)
-                .single()
-                .execute
-            )
+            repository = get_supabase_repository()
+            scene = await snapshot_cache.get_scene(repository, scene_id, "image_url, description")
 
-            if scene_response.error:
-                raise Exception(f"Supabase error fetching scene: {scene_response.error.message}")
-
-            if not scene_response.data:
+            if not scene:
                 return json.dumps({"success": False, "error": f"Scene with ID {scene_id} not found."})
 
-            image_url = scene_response.data.get("image_url")
-            description = scene_response.data.get("description")
+            image_url = scene.get("image_url")
+            description = scene.get("description")
 
             if not image_url or not description:
                 return json.dumps({"success": False, "error": f"Image URL or description not found for scene {scene_id}."})
 
-            # 2. Construct the URL for the Fal function (replace with your actual Fal endpoint)
-            # Assuming you have a Fal function deployed that takes scene_id, image_url, and description
-            fal_function_url = f"https://your-fal-app/generate-video" # Replace with your actual URL
-
-            # 3. Trigger the Fal function (replace with your actual Fal API call)
-            # This is a placeholder - adapt to your specific Fal setup
-            logger.info(f"Triggering Fal video generation for scene {scene_id} with image and description.")
-            # In a real implementation, you would make an HTTP request to the Fal function
-            # with the scene_id, image_url, and description as parameters.
-            # You would then return a success or failure message based on the Fal function's response.
-            await asyncio.sleep(3) # Simulate a delay for video generation
-
-            # Placeholder response
-            mock_video_url = f"https://example.com/generated-video-{scene_id}.mp4"
-            return json.dumps({"success": True, "scene_id": scene_id, "video_url": mock_video_url, "message": "Video generation triggered (placeholder)."})
+            # 2. Generate and store the video; a concurrent identical request joins this one
+            model, payload = video_generation_request(scene)
+            cache_key = generation_cache_key("video", model, payload)
+            return await self.generation_flights.do(
+                ("video", scene_id, cache_key, bypass_cache),
+                lambda: self._generate_scene_video(repository, scene_id, model, payload, cache_key, bypass_cache)
+            )
 
         except Exception as e:
             logger.exception(f"Error in _tool_trigger_video_generation for scene {scene_id}")
             return json.dumps({"success": False, "error": f"Failed to trigger video generation: {str(e)}"})
 
+    async def _generate_scene_video(self, repository, scene_id: str, model: str, payload: Dict[str, Any],
+                                    cache_key: str, bypass_cache: bool) -> str:
+        # Reuse a video generated from identical inputs, else submit image-to-video to the Fal queue and wait
+        cache = get_generation_cache()
+        video_url = await cache.get(cache_key, "video", bypass=bypass_cache)
+        cached = video_url is not None
+        if not cached:
+            logger.info(f"Submitting Fal video generation for scene {scene_id}.")
+            video_url = video_output_url(await get_fal_client().run(model, payload))
+            if not video_url:
+                return json.dumps({"success": False, "error": f"Video generation returned no video for scene {scene_id}."})
+            await cache.put(cache_key, "video", model, video_url)
+        else:
+            logger.info(f"Reusing cached video for scene {scene_id}.")
+
+        # Store the video on the scene
+        await repository.update_scene(scene_id, {"video_url": video_url})
+        snapshot_cache.apply_scene_update(scene_id, {"video_url": video_url})
+        return json.dumps({"success": True, "scene_id": scene_id, "video_url": video_url, "cached": cached,
+                           "message": "Video reused from an identical earlier generation." if cached else "Video generated."})
+
+    @tool_registry.tool(
+        "create_multiple_scenes",
+        "Creates multiple new scenes within a project based on provided script content for each.",
+        {
+            "type": "object",
+            "properties": {
+                "project_id": {
+                    "type": "string",
+                    "description": "The ID of the project to add the scenes to."
+                },
+                "scenes": {
+                    "type": "array",
+                    "description": "A list of scene objects to create.",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "title": {"type": "string", "description": "Title for the scene (e.g., 'Scene 1')"},
+                            "script": {"type": "string", "description": "The script content for this specific scene."},
+                            "scene_order": {"type": "integer", "description": "The order number for this scene."}
+                            # Add other fields like voice_over_text if the agent provides them
+                        },
+                        "required": ["title", "script", "scene_order"]
+                    }
+                }
+            },
+            "required": ["project_id", "scenes"]
+        }
+    )
     async def _tool_create_multiple_scenes(self, project_id: str, scenes: List[Dict[str, Any]]) -> str:
         """Tool implementation: Creates multiple new scenes for a project in Supabase based on provided script content for each."""
         logger.info(f"Tool: create_multiple_scenes called for project_id: {project_id} with {len(scenes)} scenes")
         try:
-            supabase = get_supabase_client()
             scenes_to_insert = []
 
             # Validate each scene and prepare for insertion
@@ -628,17 +863,10 @@ class AgentService:
                 })
 
             # Insert the new scenes in a single batch operation
-            insert_response = await asyncio.to_thread(
-                supabase.table("canvas_scenes")
-                .insert(scenes_to_insert)
-                .select("id")  # Select the IDs of the newly created scenes
-                .execute
-            )
+            inserted = await get_supabase_repository().insert_scenes(scenes_to_insert)
+            snapshot_cache.invalidate_project(project_id)
 
-            if insert_response.error:
-                raise Exception(f"Supabase error inserting new scenes: {insert_response.error.message}")
-
-            new_scene_ids = [record.get("id") for record in insert_response.data]
+            new_scene_ids = [record.get("id") for record in inserted]
             logger.info(f"Successfully created {len(new_scene_ids)} new scenes for project {project_id}")
             return json.dumps({"success": True, "scene_ids": new_scene_ids, "message": "New scenes created successfully."})
 
@@ -649,35 +877,35 @@ class AgentService:
     async def handle_canvas_update_notification(self, scene_id: str, field: str, value: Any):
         """
         Handles notifications from the frontend about canvas updates.
-        This is a placeholder - implement actual logic to react to updates.
+        Notifications arrive per keystroke, so they are only buffered here: the latest value
+        per (scene_id, field) is applied by _apply_canvas_updates once the field goes quiet.
         """
-        logger.info(f"Received canvas update: scene_id={scene_id}, field={field}, value={value}")
+        logger.debug(f"Received canvas update: scene_id={scene_id}, field={field}, value={value}")
+        self.canvas_updates.submit(scene_id, field, value)
 
-        try:
-            supabase = get_supabase_client()
-
-            # Example: Update the 'updated_at' timestamp on the scene
-            scene_response = await asyncio.to_thread(
-                supabase.table("canvas_scenes")
-                .update({"updated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())})
-                .eq("id", scene_id)
-                .execute
-            )
-
-            if scene_response.error:
-                logger.error(f"Supabase error updating scene timestamp: {scene_response.error.message}")
-            else:
-                logger.info(f"Successfully updated timestamp for scene {scene_id}")
-
-            # Add more logic here to trigger other actions based on the update
-            # - E.g., If field is 'script', trigger a re-generation of voiceover?
-            # - If field is 'image_prompt', trigger a re-generation of the image?
-
-            # For now, just log the update
-            logger.info(f"Canvas update processed (placeholder logic).")
-
-        except Exception as e:
-            logger.exception(f"Error handling canvas update for scene {scene_id}")
+    async def _apply_canvas_updates(self, updates: List[CanvasUpdate]) -> int:
+        """
+        Applies a batch of coalesced canvas updates. This is a placeholder - implement actual
+        logic to react to updates. Returns the number of database writes made.
+        """
+        scene_ids = list(dict.fromkeys(scene_id for scene_id, _, _ in updates))
+        logger.info(f"Applying {len(updates)} coalesced canvas updates across {len(scene_ids)} scenes")
+
+        # Example: Update the 'updated_at' timestamp on the scenes (one request for the whole batch)
+        # SupabaseError propagates so the coalescer can retry the batch
+        await get_supabase_repository().update_scenes(
+            scene_ids, {"updated_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        )
+        # The frontend edited these scenes directly
+        snapshot_cache.invalidate_scenes(scene_ids)
+
+        # Add more logic here to trigger other actions based on the update
+        # - E.g., If field is 'script', trigger a re-generation of voiceover?
+        # - If field is 'image_prompt', trigger a re-generation of the image?
+        return 1
+
+# Shared instance used by the API endpoints and the generation pipeline
+agent_service = AgentService()
 
 async def test():
     import asyncio
@@ -0,0 +1,187 @@
+"""
+Circuit breakers for the backend's external dependencies (Supabase, OpenAI, MCP servers).
+
+    closed --(N consecutive failures)--> open --(recovery timeout)--> half_open
+      ^                                   ^                              |
+      +------------(probe succeeds)-------+-------(probe fails)----------+
+
+While a dependency's circuit is open, calls to it fail at once with CircuitOpenError
+instead of each waiting out a timeout (and holding an executor thread or spawning an MCP
+process) against a dependency that is down. After the recovery timeout a few probe calls
+are let through; their outcome closes the circuit or opens it again.
+
+Only failures that say the dependency is unhealthy count (connection errors, timeouts,
+5xx); a 4xx or a 429 means it answered. CircuitOpenError is a ConnectionError, so the API
+turns it into a 503.
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+from ..config import settings
+from .metrics import CIRCUIT_REJECTED, CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# circuit_state gauge values
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling a dependency whose circuit is open."""
+    def __init__(self, dependency: str, retry_after: float):
+        super().__init__(f"{dependency} is unavailable (circuit open); retry in {retry_after:.0f}s.")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+def _any_failure(error: BaseException) -> bool:
+    return True
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self.last_error: Optional[str] = None
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], name)
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a probe through."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.recovery_timeout - time.monotonic())
+
+    @contextmanager
+    def guard(self, is_failure: Callable[[BaseException], bool] = _any_failure) -> Iterator[None]:
+        """
+        Wraps one call to the dependency: raises CircuitOpenError if the circuit does not
+        admit it, otherwise records the call's outcome. Exceptions for which `is_failure`
+        returns False count as successes (the dependency answered).
+        """
+        probe = self._admit()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # No verdict on the dependency; just free the probe slot
+            if probe:
+                self._probes -= 1
+            raise
+        except BaseException as e:
+            if is_failure(e):
+                self._on_failure(e, probe)
+            else:
+                self._on_success(probe)
+            raise
+        else:
+            self._on_success(probe)
+
+    def _admit(self) -> bool:
+        """Lets a call through or raises CircuitOpenError; returns True for a half-open probe."""
+        if self.state == OPEN:
+            if self.retry_after > 0:
+                self._reject()
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                self._reject()
+            self._probes += 1
+            self.calls += 1
+            return True
+        self.calls += 1
+        return False
+
+    def _reject(self):
+        self.rejected += 1
+        CIRCUIT_REJECTED.inc(self.name)
+        raise CircuitOpenError(self.name, max(self.retry_after, 1.0))
+
+    def _on_success(self, probe: bool):
+        self.consecutive_failures = 0
+        if probe:
+            self._probes -= 1
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED)
+
+    def _on_failure(self, error: BaseException, probe: bool):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = f"{error.__class__.__name__}: {error}"[:300]
+        if probe:
+            self._probes -= 1
+        if (probe and self.state == HALF_OPEN) or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+            logger.error(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures "
+                         f"(last: {self.last_error}); failing fast for {self.recovery_timeout:.0f}s.")
+        elif state == CLOSED:
+            logger.info(f"Circuit for {self.name} closed; {self.name} is responding again.")
+        else:
+            self._probes = 0
+            logger.info(f"Circuit for {self.name} half-open; probing after {previous}.")
+        CIRCUIT_STATE.set(_STATE_VALUES[state], self.name)
+        CIRCUIT_TRANSITIONS.inc(self.name, state)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "retry_after": round(self.retry_after, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout": self.recovery_timeout,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+            "last_error": self.last_error,
+        }
+
+
+class CircuitBreakerRegistry:
+    """One breaker per dependency name, created with the configured thresholds on first use."""
+    def __init__(self, failure_threshold: int, recovery_timeout: float, half_open_max_calls: int):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = self._breakers[name] = CircuitBreaker(
+                name, self.failure_threshold, self.recovery_timeout, self.half_open_max_calls
+            )
+        return breaker
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: breaker.stats() for name, breaker in sorted(self._breakers.items())}
+
+
+circuit_breakers = CircuitBreakerRegistry(
+    settings.circuit_failure_threshold,
+    settings.circuit_recovery_timeout,
+    settings.circuit_half_open_max_calls,
+)
@@ -0,0 +1,263 @@
+"""
+Async client for Fal's queue API, used by the image and video generation tools.
+
+A job is submitted with POST {FAL_QUEUE_URL}/{model}, polled at
+{FAL_QUEUE_URL}/{app}/requests/{id}/status and its output fetched from
+{FAL_QUEUE_URL}/{app}/requests/{id} once COMPLETED. Every request goes through one pooled
+keep-alive httpx.AsyncClient. Polling is adaptive: it starts at FAL_POLL_MIN_INTERVAL,
+backs off while the status is unchanged (further while the job is deep in the queue) and
+drops back to the minimum when the status moves. Each HTTP request is retried a bounded
+number of times on connection errors, 429 and 5xx (honouring Retry-After); a submit is
+only resent when Fal cannot have accepted it, so retries never start a duplicate job.
+Requests pass the process-wide Fal rate limits (services/rate_limiter.py).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Set
+from urllib.parse import urlencode
+import httpx
+from ..config import settings
+from .metrics import FAL_JOB_LATENCY, FAL_JOBS, FAL_POLLS, FAL_REQUESTS
+from .rate_limiter import rate_limiter, retry_after_seconds, retry_delay
+from .tracing import detached, span
+
+logger = logging.getLogger(__name__)
+
+FAILED_STATUSES = ("FAILED", "ERROR", "CANCELLED")
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Responses that guarantee a submit was not queued
+_SUBMIT_RETRY_STATUSES = {429, 503}
+# Transport errors raised before the request reached the server
+_UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class FalError(Exception):
+    """Raised when a Fal request fails or a generation job ends unsuccessfully."""
+    def __init__(self, message: str, status_code: Optional[int] = None, request_id: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.request_id = request_id
+
+
+class FalTimeout(FalError):
+    """Raised when a job does not complete within its deadline (the job is cancelled)."""
+
+
+def _app_root(model: str) -> str:
+    """Status and result URLs live under the app (owner/name), not the full model path."""
+    return "/".join(model.split("/")[:2])
+
+
+class FalClient:
+    def __init__(self, http_client: httpx.AsyncClient, api_key: Optional[str], queue_url: str,
+                 poll_min_interval: float = 1.0, poll_max_interval: float = 10.0, poll_backoff: float = 1.5,
+                 max_retries: int = 3, job_timeout: float = 600.0):
+        self._http = http_client
+        self.api_key = api_key
+        self.queue_url = queue_url.rstrip("/")
+        self.poll_min_interval = poll_min_interval
+        self.poll_max_interval = max(poll_min_interval, poll_max_interval)
+        self.poll_backoff = poll_backoff
+        self.max_retries = max(0, max_retries)
+        self.job_timeout = job_timeout
+        self._headers = {"Authorization": f"Key {api_key}"}
+        self._background: Set[asyncio.Task] = set()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.polls = 0
+        self.retries = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    # --- Queue API ---
+
+    async def submit(self, model: str, payload: Dict[str, Any], webhook_url: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queues a job; the response carries its request_id. With `webhook_url`, Fal POSTs the
+        outcome there when the job finishes, so the caller does not need to poll.
+        """
+        if not self.configured:
+            raise FalError("FAL_KEY is not configured.")
+        url = f"{self.queue_url}/{model}"
+        if webhook_url:
+            url = f"{url}?{urlencode({'fal_webhook': webhook_url})}"
+        submitted = await self._request("submit", "POST", url, json=payload)
+        if not submitted.get("request_id"):
+            raise FalError(f"Fal did not return a request_id for {model}: {submitted}")
+        self.submitted += 1
+        return submitted
+
+    async def status(self, model: str, request_id: str) -> Dict[str, Any]:
+        return await self._request("status", "GET", f"{self.queue_url}/{_app_root(model)}/requests/{request_id}/status")
+
+    async def result(self, model: str, request_id: str) -> Dict[str, Any]:
+        return await self._request("result", "GET", f"{self.queue_url}/{_app_root(model)}/requests/{request_id}")
+
+    async def cancel(self, model: str, request_id: str):
+        """Asks Fal to drop a queued job; failures are only logged."""
+        try:
+            await self._request("cancel", "PUT", f"{self.queue_url}/{_app_root(model)}/requests/{request_id}/cancel")
+        except FalError as e:
+            logger.warning(f"Could not cancel Fal job {request_id}: {e}")
+
+    async def run(self, model: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Submits a job, waits for it to complete and returns the model's output."""
+        deadline = time.perf_counter() + (timeout if timeout is not None else self.job_timeout)
+        started = time.perf_counter()
+        outcome = "error"
+        request_id: Optional[str] = None
+        self.in_flight += 1
+        try:
+            with span("fal.job", root=False, model=model) as job_span:
+                request_id = (await self.submit(model, payload))["request_id"]
+                job_span.set_attribute("request_id", request_id)
+                try:
+                    await asyncio.wait_for(self._wait(model, request_id, job_span), max(0.0, deadline - time.perf_counter()))
+                except asyncio.TimeoutError:
+                    outcome = "timeout"
+                    self._cancel_in_background(model, request_id)
+                    raise FalTimeout(f"Fal job {request_id} did not complete in time.", request_id=request_id)
+                result = await self.result(model, request_id)
+                outcome = "ok"
+                return result
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            if request_id:
+                self._cancel_in_background(model, request_id)
+            raise
+        finally:
+            self.in_flight -= 1
+            if outcome == "ok":
+                self.completed += 1
+            else:
+                self.failed += 1
+            FAL_JOB_LATENCY.observe(time.perf_counter() - started, model)
+            FAL_JOBS.inc(model, outcome)
+
+    # --- Internals ---
+
+    async def _wait(self, model: str, request_id: str, job_span: Any):
+        interval = self.poll_min_interval
+        last_status: Optional[str] = None
+        polls = 0
+        while True:
+            await asyncio.sleep(interval)
+            state = await self.status(model, request_id)
+            polls += 1
+            self.polls += 1
+            FAL_POLLS.inc(model)
+            status = state.get("status")
+            if status == "COMPLETED":
+                job_span.set_attribute("polls", polls)
+                return
+            if status in FAILED_STATUSES:
+                raise FalError(f"Fal job {request_id} ended with status {status}: {state.get('error') or state}", request_id=request_id)
+            interval = self._next_interval(interval, status != last_status, state.get("queue_position"))
+            last_status = status
+
+    def _next_interval(self, interval: float, changed: bool, queue_position: Optional[int]) -> float:
+        if changed:
+            return self.poll_min_interval
+        interval = min(self.poll_max_interval, interval * self.poll_backoff)
+        if queue_position:
+            # Nothing happens for a job deep in the queue; wait about one poll per position ahead
+            interval = min(self.poll_max_interval, max(interval, self.poll_min_interval * queue_position))
+        return interval
+
+    def _cancel_in_background(self, model: str, request_id: str):
+        with detached():
+            task = asyncio.ensure_future(self.cancel(model, request_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _request(self, endpoint: str, method: str, url: str, json: Any = None) -> Dict[str, Any]:
+        retry_statuses = _SUBMIT_RETRY_STATUSES if method == "POST" else _RETRY_STATUSES
+        attempt = 0
+        while True:
+            final = attempt >= self.max_retries
+            outcome = "error"
+            await rate_limiter.acquire("fal", endpoint)
+            try:
+                with span(f"fal.{endpoint}", root=False, attempt=attempt):
+                    try:
+                        response = await self._http.request(method, url, json=json, headers=self._headers)
+                    except httpx.TransportError as e:
+                        if final or (method == "POST" and not isinstance(e, _UNSENT_ERRORS)):
+                            raise FalError(f"{method} {url} failed: {e!r}") from e
+                        delay = retry_delay(attempt)
+                        logger.warning(f"Fal {endpoint} request failed ({e!r}); retrying in {delay:.2f}s")
+                    else:
+                        delay = None
+                        if response.status_code in retry_statuses and not final:
+                            retry_after = retry_after_seconds(response.headers)
+                            if response.status_code == 429 and retry_after:
+                                rate_limiter.pause("fal", endpoint, retry_after)
+                            delay = retry_delay(attempt, retry_after)
+                        if delay is not None:
+                            logger.warning(f"Fal {endpoint} request returned {response.status_code}; retrying in {delay:.2f}s")
+                        elif response.status_code >= 400:
+                            raise FalError(f"{method} {url} failed ({response.status_code}): {response.text}", response.status_code)
+                        else:
+                            outcome = "ok"
+                            return response.json() if response.content else {}
+                outcome = "retry"
+            finally:
+                FAL_REQUESTS.inc(endpoint, outcome)
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": self.configured,
+            "queue_url": self.queue_url,
+            "in_flight": self.in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "polls": self.polls,
+            "retries": self.retries,
+        }
+
+
+# One pooled HTTP client shared by every generation job in the process
+_http_client: Optional[httpx.AsyncClient] = None
+_fal_client: Optional[FalClient] = None
+
+
+def get_fal_client() -> FalClient:
+    """Returns the shared Fal client, creating it (and its connection pool) on first use."""
+    global _http_client, _fal_client
+    if _fal_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=settings.fal_request_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.fal_max_connections,
+                max_keepalive_connections=settings.fal_max_connections
+            )
+        )
+        _fal_client = FalClient(
+            _http_client,
+            settings.fal_key,
+            settings.fal_queue_url,
+            poll_min_interval=settings.fal_poll_min_interval,
+            poll_max_interval=settings.fal_poll_max_interval,
+            max_retries=settings.fal_max_retries,
+            job_timeout=settings.fal_job_timeout,
+        )
+    return _fal_client
+
+
+async def close_fal_client():
+    """Closes the pooled HTTP connections used for Fal requests."""
+    global _http_client, _fal_client
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _fal_client = None
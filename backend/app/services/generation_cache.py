@@ -0,0 +1,248 @@
+"""
+Content-addressed cache of generated scene media (images and videos).
+
+The key is a SHA-256 of the normalized generation request: the kind of media, the Fal
+model (which is what an image "version" selects) and the model input with whitespace in
+every string collapsed and keys sorted. Regenerating a scene with the same prompt, product
+image and version therefore returns the stored media URL at once instead of paying for a
+new Fal job. Callers pass `bypass` to force a fresh generation (e.g. the user asked for a
+new variation); its result replaces the cached one.
+
+Entries live in a pluggable backend (GENERATION_CACHE_BACKEND):
+    sqlite    local file (GENERATION_CACHE_SQLITE_PATH), for development and single hosts
+    supabase  the `generation_cache` table, shared by every backend process
+    none      caching disabled
+Entries older than GENERATION_CACHE_TTL are not served (Fal's media URLs do not live
+forever), and beyond GENERATION_CACHE_MAX_ENTRIES the least recently used are evicted.
+
+The cache never fails a generation: backend errors are logged and treated as a miss.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+from ..config import settings
+from ..supabase_client import get_service_supabase_repository
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump when the key derivation changes so old entries stop matching
+KEY_VERSION = 1
+# Minimum seconds between eviction sweeps (run after a store)
+EVICT_INTERVAL = 60.0
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if item is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def generation_cache_key(kind: str, model: str, payload: Dict[str, Any]) -> str:
+    """Hex SHA-256 identifying a generation request, insensitive to whitespace and key order."""
+    document = {"v": KEY_VERSION, "kind": kind, "model": model, "input": _normalize(payload)}
+    encoded = json.dumps(document, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class GenerationCacheBackend(ABC):
+    """Storage for cache entries: key -> media URL, with created/last-used times for TTL and LRU eviction."""
+    name = ""
+
+    @abstractmethod
+    async def get(self, key: str, ttl: float) -> Optional[str]:
+        """The URL stored under `key` if younger than `ttl` seconds (0 = no expiry); records the use."""
+
+    @abstractmethod
+    async def set(self, key: str, kind: str, model: str, url: str) -> None:
+        ...
+
+    @abstractmethod
+    async def evict(self, max_entries: int, ttl: float) -> int:
+        """Deletes expired entries and the least recently used beyond `max_entries`; returns how many."""
+
+
+class SqliteGenerationCache(GenerationCacheBackend):
+    """Cache entries in a local SQLite file."""
+    name = "sqlite"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            key TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            model TEXT NOT NULL,
+            url TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS generation_cache_last_used_idx ON generation_cache (last_used_at);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(self._SCHEMA)
+
+    def _run(self, fn):
+        with self._lock:
+            return fn(self._conn)
+
+    async def get(self, key: str, ttl: float) -> Optional[str]:
+        def _get(conn: sqlite3.Connection):
+            now = time.time()
+            row = conn.execute("SELECT url, created_at FROM generation_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (ttl > 0 and row[1] <= now - ttl):
+                return None
+            conn.execute("UPDATE generation_cache SET hits = hits + 1, last_used_at = ? WHERE key = ?", (now, key))
+            return row[0]
+        return await metrics.to_thread(self._run, _get, call="generation_cache")
+
+    async def set(self, key: str, kind: str, model: str, url: str) -> None:
+        def _set(conn: sqlite3.Connection):
+            now = time.time()
+            conn.execute(
+                "INSERT INTO generation_cache (key, kind, model, url, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET url = excluded.url, created_at = excluded.created_at,"
+                " last_used_at = excluded.last_used_at",
+                (key, kind, model, url, now, now)
+            )
+        await metrics.to_thread(self._run, _set, call="generation_cache")
+
+    async def evict(self, max_entries: int, ttl: float) -> int:
+        def _evict(conn: sqlite3.Connection):
+            deleted = 0
+            if ttl > 0:
+                deleted += conn.execute("DELETE FROM generation_cache WHERE created_at <= ?", (time.time() - ttl,)).rowcount
+            deleted += conn.execute(
+                "DELETE FROM generation_cache WHERE key IN"
+                " (SELECT key FROM generation_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (max(0, max_entries),)
+            ).rowcount
+            return deleted
+        return await metrics.to_thread(self._run, _evict, call="generation_cache")
+
+
+class SupabaseGenerationCache(GenerationCacheBackend):
+    """
+    Cache entries in the `generation_cache` table (see
+    supabase/migrations/20250712100000_create_generation_cache_table.sql). Lookups go through
+    an RPC that checks the TTL and records the use in one statement.
+    """
+    name = "supabase"
+    TABLE = "generation_cache"
+
+    def _repository(self):
+        return get_service_supabase_repository()
+
+    async def get(self, key: str, ttl: float) -> Optional[str]:
+        return await self._repository().rpc("get_generation_cache_entry", {"p_key": key, "p_ttl_seconds": int(ttl)})
+
+    async def set(self, key: str, kind: str, model: str, url: str) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        await self._repository().upsert(self.TABLE, [{
+            "key": key, "kind": kind, "model": model, "url": url, "created_at": now, "last_used_at": now,
+        }], on_conflict="key")
+
+    async def evict(self, max_entries: int, ttl: float) -> int:
+        return await self._repository().rpc("evict_generation_cache", {"p_max_entries": max_entries, "p_ttl_seconds": int(ttl)}) or 0
+
+
+class GenerationCache:
+    def __init__(self, backend: Optional[GenerationCacheBackend], max_entries: int, ttl: float):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._last_evict = float("-inf")
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evicted = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    async def get(self, key: str, kind: str, bypass: bool = False) -> Optional[str]:
+        """The cached media URL for `key`, or None on a miss, with `bypass`, or if the backend fails."""
+        if not self.enabled:
+            return None
+        if bypass:
+            self.bypassed += 1
+            metrics.GENERATION_CACHE_LOOKUPS.inc(kind, "bypass")
+            return None
+        try:
+            url = await self.backend.get(key, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            metrics.GENERATION_CACHE_LOOKUPS.inc(kind, "error")
+            logger.warning(f"Generation cache lookup failed; generating instead: {e}")
+            return None
+        if url:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.GENERATION_CACHE_LOOKUPS.inc(kind, "hit" if url else "miss")
+        return url
+
+    async def put(self, key: str, kind: str, model: str, url: str):
+        """Stores a generated media URL, evicting old entries at most every EVICT_INTERVAL seconds."""
+        if not self.enabled:
+            return
+        try:
+            await self.backend.set(key, kind, model, url)
+            self.stores += 1
+            if time.monotonic() - self._last_evict >= EVICT_INTERVAL:
+                self._last_evict = time.monotonic()
+                self.evicted += await self.backend.evict(self.max_entries, self.ttl)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Could not store generated {kind} in the generation cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend.name if self.backend else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+
+generation_cache: Optional[GenerationCache] = None
+
+def get_generation_cache() -> GenerationCache:
+    """Returns the generation cache over the configured backend (GENERATION_CACHE_BACKEND: sqlite, supabase or none)."""
+    global generation_cache
+    if generation_cache is None:
+        backend_name = settings.generation_cache_backend.lower()
+        if backend_name == "supabase":
+            backend: Optional[GenerationCacheBackend] = SupabaseGenerationCache()
+        elif backend_name == "sqlite":
+            backend = SqliteGenerationCache(settings.generation_cache_sqlite_path)
+        elif backend_name == "none":
+            backend = None
+        else:
+            raise ValueError(f"Unknown GENERATION_CACHE_BACKEND: {settings.generation_cache_backend}")
+        generation_cache = GenerationCache(backend, settings.generation_cache_max_entries, settings.generation_cache_ttl)
+        logger.info(f"Generation cache backend: {backend_name}")
+    return generation_cache
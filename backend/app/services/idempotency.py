@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from ..config import settings
+from .caching import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Longest Idempotency-Key accepted (clients normally send a UUID)
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an Idempotency-Key is reused with a different request body."""
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a request's meaningful fields, used to detect key reuse."""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    __slots__ = ("fingerprint", "future", "attached")
+
+    def __init__(self, fingerprint: str, future: "asyncio.Future[Any]"):
+        self.fingerprint = fingerprint
+        self.future = future
+        self.attached = 0
+
+
+class IdempotencyStore:
+    """
+    Deduplicates retried requests that carry the same Idempotency-Key.
+
+    The first request runs the work in its own task, so a client that disconnects and
+    retries attaches to the attempt already under way instead of starting another. Once
+    done, the result is kept (bounded, with a TTL) and replayed to later retries. Failures
+    are not kept unless `store_error` says so (e.g. 4xx validation errors), so a retry after
+    a transient failure runs again. State is per process.
+    """
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self._in_flight: Dict[str, _InFlight] = {}
+        # key -> (fingerprint, is_error, result or exception)
+        self._completed: TTLCache[Tuple[str, bool, Any]] = TTLCache(max_size, ttl=ttl)
+        self.executed = 0
+        self.attached = 0
+        self.replayed = 0
+        self.conflicts = 0
+
+    async def run(self, key: str, request_fingerprint: str, fn: Callable[[], Awaitable[Any]],
+                  store_error: Optional[Callable[[BaseException], bool]] = None) -> Tuple[Any, bool]:
+        """
+        Returns (result, replayed). `replayed` is True when the result came from an earlier
+        or concurrent request with the same key rather than from running `fn` now.
+        """
+        stored = self._completed.get(key)
+        if stored is not None:
+            stored_fingerprint, is_error, value = stored
+            self._check_fingerprint(stored_fingerprint, request_fingerprint)
+            self.replayed += 1
+            if is_error:
+                raise value
+            return value, True
+
+        entry = self._in_flight.get(key)
+        if entry is not None:
+            self._check_fingerprint(entry.fingerprint, request_fingerprint)
+            entry.attached += 1
+            self.attached += 1
+            logger.info(f"Request with Idempotency-Key {key} is already in flight; attaching to it")
+            return await asyncio.shield(entry.future), True
+
+        future = asyncio.ensure_future(self._execute(key, request_fingerprint, fn, store_error))
+        self._in_flight[key] = _InFlight(request_fingerprint, future)
+        self.executed += 1
+        return await asyncio.shield(future), False
+
+    async def _execute(self, key: str, request_fingerprint: str, fn: Callable[[], Awaitable[Any]],
+                       store_error: Optional[Callable[[BaseException], bool]]) -> Any:
+        try:
+            result = await fn()
+        except Exception as e:
+            if store_error is not None and store_error(e):
+                self._completed.set(key, (request_fingerprint, True, e))
+            raise
+        else:
+            self._completed.set(key, (request_fingerprint, False, result))
+            return result
+        finally:
+            self._in_flight.pop(key, None)
+
+    def _check_fingerprint(self, stored: str, incoming: str):
+        if stored != incoming:
+            self.conflicts += 1
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request.")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._in_flight),
+            "stored": len(self._completed),
+            "executed": self.executed,
+            "attached": self.attached,
+            "replayed": self.replayed,
+            "conflicts": self.conflicts,
+        }
+
+
+# Shared by the chat and pipeline endpoints
+idempotency_store = IdempotencyStore(settings.idempotency_cache_size, ttl=settings.idempotency_ttl)
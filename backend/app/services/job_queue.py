@@ -0,0 +1,417 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from ..config import settings
+from ..supabase_client import get_service_supabase_repository
+from ..supabase_repository import eq
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat() if ts is not None else None
+
+
+class JobStore(ABC):
+    """
+    Persistent store for pipeline jobs. Jobs are plain dicts with: id, project_id, status,
+    attempts, max_attempts, available_at, lease_owner, lease_expires_at, last_error,
+    created_at, updated_at.
+
+    A worker claims a job by taking a time-limited lease on it; a job whose lease expires
+    (worker crashed) becomes claimable again. At most one queued/running job exists per
+    project, so enqueueing twice returns the existing job.
+    """
+    @abstractmethod
+    async def enqueue(self, project_id: str, max_attempts: int) -> Tuple[Dict[str, Any], bool]:
+        """Adds a job for the project unless one is active. Returns (job, created)."""
+
+    @abstractmethod
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Leases the next runnable job to `worker_id`, or returns None."""
+
+    @abstractmethod
+    async def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extends the lease; False if the worker no longer holds it."""
+
+    @abstractmethod
+    async def complete(self, job_id: str, worker_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def fail(self, job_id: str, worker_id: str, error: str, retry_delay: Optional[float]) -> None:
+        """Requeues the job after `retry_delay` seconds, or marks it failed if None."""
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_latest_for_project(self, project_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+
+class SqliteJobStore(JobStore):
+    """Job store backed by a local SQLite file, for development and single-host deployments."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pipeline_jobs (
+            id TEXT PRIMARY KEY,
+            project_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            available_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS pipeline_jobs_active_project_idx
+            ON pipeline_jobs (project_id) WHERE status IN ('queued', 'running');
+        CREATE INDEX IF NOT EXISTS pipeline_jobs_status_available_idx
+            ON pipeline_jobs (status, available_at);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(self._SCHEMA)
+
+    def _to_job(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("available_at", "lease_expires_at", "created_at", "updated_at"):
+            job[key] = _iso(job[key])
+        return job
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        # BEGIN IMMEDIATE takes the write lock up front so claims from several
+        # processes sharing the file cannot pick the same job.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def enqueue(self, project_id: str, max_attempts: int) -> Tuple[Dict[str, Any], bool]:
+        def _enqueue(conn: sqlite3.Connection):
+            existing = conn.execute(
+                "SELECT * FROM pipeline_jobs WHERE project_id = ? AND status IN ('queued', 'running')",
+                (project_id,)
+            ).fetchone()
+            if existing:
+                return self._to_job(existing), False
+            now = time.time()
+            job_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO pipeline_jobs (id, project_id, status, attempts, max_attempts, available_at, created_at, updated_at)"
+                " VALUES (?, ?, 'queued', 0, ?, ?, ?, ?)",
+                (job_id, project_id, max_attempts, now, now, now)
+            )
+            return self._to_job(conn.execute("SELECT * FROM pipeline_jobs WHERE id = ?", (job_id,)).fetchone()), True
+        return await metrics.to_thread(self._transaction, _enqueue, call="job_queue")
+
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        def _claim(conn: sqlite3.Connection):
+            now = time.time()
+            # Jobs whose final attempt's lease expired will not be retried
+            conn.execute(
+                "UPDATE pipeline_jobs SET status = 'failed', lease_owner = NULL, updated_at = ?,"
+                " last_error = 'Lease expired after final attempt'"
+                " WHERE status = 'running' AND lease_expires_at < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            row = conn.execute(
+                "SELECT id FROM pipeline_jobs"
+                " WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_expires_at < ?)"
+                " ORDER BY available_at LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE pipeline_jobs SET status = 'running', lease_owner = ?, lease_expires_at = ?,"
+                " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row["id"])
+            )
+            return self._to_job(conn.execute("SELECT * FROM pipeline_jobs WHERE id = ?", (row["id"],)).fetchone())
+        return await metrics.to_thread(self._transaction, _claim, call="job_queue")
+
+    async def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        def _heartbeat(conn: sqlite3.Connection):
+            now = time.time()
+            cursor = conn.execute(
+                "UPDATE pipeline_jobs SET lease_expires_at = ?, updated_at = ?"
+                " WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (now + lease_seconds, now, job_id, worker_id)
+            )
+            return cursor.rowcount > 0
+        return await metrics.to_thread(self._transaction, _heartbeat, call="job_queue")
+
+    async def complete(self, job_id: str, worker_id: str) -> None:
+        def _complete(conn: sqlite3.Connection):
+            conn.execute(
+                "UPDATE pipeline_jobs SET status = 'completed', lease_owner = NULL, lease_expires_at = NULL,"
+                " last_error = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                (time.time(), job_id, worker_id)
+            )
+        await metrics.to_thread(self._transaction, _complete, call="job_queue")
+
+    async def fail(self, job_id: str, worker_id: str, error: str, retry_delay: Optional[float]) -> None:
+        def _fail(conn: sqlite3.Connection):
+            now = time.time()
+            if retry_delay is None:
+                conn.execute(
+                    "UPDATE pipeline_jobs SET status = 'failed', lease_owner = NULL, lease_expires_at = NULL,"
+                    " last_error = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                    (error, now, job_id, worker_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE pipeline_jobs SET status = 'queued', lease_owner = NULL, lease_expires_at = NULL,"
+                    " available_at = ?, last_error = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                    (now + retry_delay, error, now, job_id, worker_id)
+                )
+        await metrics.to_thread(self._transaction, _fail, call="job_queue")
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        def _get(conn: sqlite3.Connection):
+            return self._to_job(conn.execute("SELECT * FROM pipeline_jobs WHERE id = ?", (job_id,)).fetchone())
+        return await metrics.to_thread(self._transaction, _get, call="job_queue")
+
+    async def get_latest_for_project(self, project_id: str) -> Optional[Dict[str, Any]]:
+        def _get_latest(conn: sqlite3.Connection):
+            return self._to_job(conn.execute(
+                "SELECT * FROM pipeline_jobs WHERE project_id = ? ORDER BY created_at DESC LIMIT 1",
+                (project_id,)
+            ).fetchone())
+        return await metrics.to_thread(self._transaction, _get_latest, call="job_queue")
+
+
+class SupabaseJobStore(JobStore):
+    """
+    Job store backed by the `pipeline_jobs` table in Supabase/Postgres
+    (see migrations/create_pipeline_jobs.sql). Enqueue and claim go through RPC functions
+    so dedupe and FOR UPDATE SKIP LOCKED leasing happen atomically in the database.
+    """
+    TABLE = "pipeline_jobs"
+
+    def _repository(self):
+        return get_service_supabase_repository()
+
+    async def enqueue(self, project_id: str, max_attempts: int) -> Tuple[Dict[str, Any], bool]:
+        result = await self._repository().rpc("enqueue_pipeline_job", {"p_project_id": project_id, "p_max_attempts": max_attempts})
+        return result["job"], bool(result["created"])
+
+    async def claim(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        rows = await self._repository().rpc("claim_pipeline_job", {"p_worker_id": worker_id, "p_lease_seconds": int(lease_seconds)})
+        return rows[0] if rows else None
+
+    async def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        now = time.time()
+        rows = await self._repository().update(
+            self.TABLE,
+            {"lease_expires_at": _iso(now + lease_seconds), "updated_at": _iso(now)},
+            {"id": eq(job_id), "lease_owner": eq(worker_id), "status": eq(RUNNING)}
+        )
+        return bool(rows)
+
+    async def complete(self, job_id: str, worker_id: str) -> None:
+        await self._repository().update(
+            self.TABLE,
+            {"status": COMPLETED, "lease_owner": None, "lease_expires_at": None, "last_error": None, "updated_at": _iso(time.time())},
+            {"id": eq(job_id), "lease_owner": eq(worker_id)}
+        )
+
+    async def fail(self, job_id: str, worker_id: str, error: str, retry_delay: Optional[float]) -> None:
+        now = time.time()
+        data: Dict[str, Any] = {"lease_owner": None, "lease_expires_at": None, "last_error": error, "updated_at": _iso(now)}
+        if retry_delay is None:
+            data["status"] = FAILED
+        else:
+            data["status"] = QUEUED
+            data["available_at"] = _iso(now + retry_delay)
+        await self._repository().update(self.TABLE, data, {"id": eq(job_id), "lease_owner": eq(worker_id)})
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._repository().select_one(self.TABLE, "*", {"id": eq(job_id)})
+
+    async def get_latest_for_project(self, project_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._repository().select(self.TABLE, "*", {"project_id": eq(project_id)}, order="created_at.desc", limit=1)
+        return rows[0] if rows else None
+
+
+def _lease_lost(heartbeat: asyncio.Task) -> bool:
+    return heartbeat.done() and not heartbeat.cancelled() and heartbeat.result() is True
+
+
+class PipelineWorkerPool:
+    """
+    Runs queued pipeline jobs with a fixed number of concurrent workers.
+    Each worker claims a job, keeps its lease alive while `runner(project_id)` executes,
+    and completes it or schedules a retry with jittered exponential backoff.
+    """
+    def __init__(self, store: JobStore, runner: Callable[[str], Awaitable[Any]], concurrency: int,
+                 lease_seconds: float, poll_interval: float, retry_base_delay: float, retry_max_delay: float = 600.0):
+        self.store = store
+        self.runner = runner
+        self.concurrency = max(1, concurrency)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+        self._running_jobs: Dict[str, str] = {}  # worker_id -> job_id
+
+    def start(self):
+        if self._tasks:
+            return
+        self._stopping.clear()
+        for i in range(self.concurrency):
+            worker_id = f"{self._worker_prefix}:{i}"
+            self._tasks.append(asyncio.create_task(self._work(worker_id)))
+        logger.info(f"Started {self.concurrency} pipeline workers ({self._worker_prefix})")
+
+    async def stop(self):
+        """Stops claiming new jobs and cancels in-flight ones; their leases expire and they are retried."""
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _retry_delay(self, attempts: int) -> float:
+        delay = min(self.retry_base_delay * (2 ** max(0, attempts - 1)), self.retry_max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _work(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                job = await self.store.claim(worker_id, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed to claim a job: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run_job(worker_id, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Recording the outcome failed (store unavailable): the lease expires and the
+                # job is reclaimed, so keep this worker alive for the next one
+                logger.error(f"Worker {worker_id} could not record the outcome of job {job['id']}: {e}")
+
+    async def _run_job(self, worker_id: str, job: Dict[str, Any]):
+        job_id, project_id = job["id"], job["project_id"]
+        logger.info(f"Worker {worker_id} running job {job_id} for project {project_id} (attempt {job['attempts']}/{job['max_attempts']})")
+        self._running_jobs[worker_id] = job_id
+        run = asyncio.ensure_future(self.runner(project_id))
+        heartbeat = asyncio.create_task(self._keep_lease(worker_id, job_id, run))
+        error: Optional[Exception] = None
+        try:
+            try:
+                await run
+            except asyncio.CancelledError:
+                if not _lease_lost(heartbeat):
+                    raise
+            except Exception as e:
+                error = e
+            if _lease_lost(heartbeat):
+                # The job was reclaimed by another worker; its outcome is not ours to record
+                logger.warning(f"Worker {worker_id} stopped job {job_id} for project {project_id} after losing its lease")
+            elif error is not None:
+                retry_delay = self._retry_delay(job["attempts"]) if job["attempts"] < job["max_attempts"] else None
+                if retry_delay is None:
+                    logger.error(f"Job {job_id} for project {project_id} failed permanently: {error}")
+                else:
+                    logger.warning(f"Job {job_id} for project {project_id} failed, retrying in {retry_delay:.1f}s: {error}")
+                await self.store.fail(job_id, worker_id, str(error), retry_delay)
+            else:
+                await self.store.complete(job_id, worker_id)
+                logger.info(f"Job {job_id} for project {project_id} completed")
+        finally:
+            heartbeat.cancel()
+            self._running_jobs.pop(worker_id, None)
+
+    async def _keep_lease(self, worker_id: str, job_id: str, run: asyncio.Future) -> bool:
+        """Renews the job's lease while it runs; returns True after cancelling `run` if the lease was lost."""
+        interval = max(1.0, self.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if not await self.store.heartbeat(job_id, worker_id, self.lease_seconds):
+                    logger.warning(f"Worker {worker_id} lost the lease on job {job_id}; cancelling it")
+                    run.cancel()
+                    return True
+            except Exception as e:
+                logger.error(f"Failed to renew lease on job {job_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": sum(1 for task in self._tasks if not task.done()),
+            "busy": len(self._running_jobs),
+            "running_jobs": list(self._running_jobs.values()),
+        }
+
+
+job_store: Optional[JobStore] = None
+
+def get_job_store() -> JobStore:
+    """Returns the configured job store (PIPELINE_QUEUE_BACKEND: sqlite or supabase)."""
+    global job_store
+    if job_store is None:
+        backend = settings.pipeline_queue_backend.lower()
+        if backend == "supabase":
+            job_store = SupabaseJobStore()
+        elif backend == "sqlite":
+            job_store = SqliteJobStore(settings.pipeline_queue_sqlite_path)
+        else:
+            raise ValueError(f"Unknown PIPELINE_QUEUE_BACKEND: {settings.pipeline_queue_backend}")
+        logger.info(f"Using {backend} pipeline job store")
+    return job_store
+
+def create_worker_pool(runner: Callable[[str], Awaitable[Any]]) -> PipelineWorkerPool:
+    """Builds a worker pool over the configured job store using the PIPELINE_* settings."""
+    return PipelineWorkerPool(
+        get_job_store(),
+        runner,
+        concurrency=settings.pipeline_worker_concurrency,
+        lease_seconds=settings.pipeline_job_lease_seconds,
+        poll_interval=settings.pipeline_queue_poll_interval,
+        retry_base_delay=settings.pipeline_job_retry_base_delay
+    )
@@ -0,0 +1,251 @@
+"""
+Named, time-limited leases that keep two backend processes (uvicorn workers, pipeline
+workers, hosts) from doing the same per-project work at once.
+
+A lease is held by one owner until it is released or its TTL passes without a renewal,
+so a crashed holder blocks others for at most one TTL. `LeaseManager.hold()` acquires a
+lease (optionally waiting for it), renews it in the background every third of its TTL
+and releases it on exit; every `hold()` has its own owner id, so two coroutines in the
+same process exclude each other too. If a renewal finds the lease gone (it expired and
+another owner took it), the block is cancelled and `hold()` raises LeaseLost: the work
+is no longer exclusive and must not go on.
+
+Leases live in a pluggable backend (LEASE_BACKEND):
+    memory    this process only; enough for a single worker and for tests
+    supabase  the `backend_leases` table, shared by every backend process
+Postgres advisory locks are tied to a database session, which PostgREST does not keep
+between requests, hence a lease table whose expiry is checked against the database
+clock.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from ..config import settings
+from ..supabase_client import get_service_supabase_repository
+from .metrics import LEASE_ACQUIRES, LEASES_LOST
+from .tracing import detached
+
+logger = logging.getLogger(__name__)
+
+# Seconds between attempts while waiting for a lease held by someone else
+RETRY_INTERVAL = 0.25
+
+
+class LeaseUnavailable(RuntimeError):
+    """Raised when a lease is held by another owner (and did not free up within the wait)."""
+    def __init__(self, name: str):
+        super().__init__(f"Lease {name} is held by another worker.")
+        self.name = name
+
+
+class LeaseLost(LeaseUnavailable):
+    """Raised from `hold()` when the lease was taken over while its block was running."""
+    def __init__(self, name: str):
+        RuntimeError.__init__(self, f"Lease {name} expired and was taken over by another worker.")
+        self.name = name
+
+
+def _scope(name: str) -> str:
+    """Metric label for a lease name: the part before the first ':' (never the ID after it)."""
+    return name.split(":", 1)[0]
+
+
+class Lease:
+    def __init__(self, name: str, owner: str, ttl: float):
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        # Set when a renewal finds the lease taken over (it had expired); the holder's work
+        # is no longer exclusive
+        self.lost = False
+
+
+class LeaseManager(ABC):
+    """Backend interface plus `hold()`, built on acquire / renew / release."""
+    name = ""
+
+    def __init__(self):
+        self._process_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._held: Dict[str, Lease] = {}
+        self._renewals: Dict[str, asyncio.Task] = {}
+        self.acquired = 0
+        self.busy = 0
+        self.lost = 0
+        self.errors = 0
+
+    @abstractmethod
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        """Takes the lease for `ttl` seconds if it is free, expired or already `owner`'s."""
+
+    @abstractmethod
+    async def release(self, name: str, owner: str) -> None:
+        """Frees the lease if `owner` still holds it."""
+
+    @abstractmethod
+    async def renew(self, name: str, owner: str, ttl: float) -> bool:
+        """Extends the lease if `owner` still holds it; False if it was released or taken over."""
+
+    @asynccontextmanager
+    async def hold(self, name: str, ttl: Optional[float] = None, wait: float = 0.0) -> AsyncIterator[Lease]:
+        """
+        Holds the lease `name` for the duration of the block. If another owner holds it,
+        retries for up to `wait` seconds, then raises LeaseUnavailable. If the lease is lost
+        while the block runs, the block's task is cancelled and LeaseLost raised instead.
+        """
+        lease = Lease(name, f"{self._process_id}:{uuid.uuid4().hex[:12]}", ttl or settings.lease_ttl)
+        await self._acquire_or_wait(lease, wait)
+        holder = asyncio.current_task()
+        self._held[lease.owner] = lease
+        with detached():
+            renewal = asyncio.ensure_future(self._keep(lease, holder))
+        self._renewals[lease.owner] = renewal
+        try:
+            yield lease
+        except asyncio.CancelledError:
+            if not lease.lost:
+                raise
+            # Our own cancellation (see _keep): surface it as an error the caller can handle
+            uncancel = getattr(holder, "uncancel", None)
+            if uncancel is not None:
+                uncancel()
+            raise LeaseLost(name) from None
+        finally:
+            renewal.cancel()
+            self._renewals.pop(lease.owner, None)
+            self._held.pop(lease.owner, None)
+            try:
+                await self.release(name, lease.owner)
+            except Exception as e:
+                # It expires on its own after the TTL
+                self.errors += 1
+                logger.warning(f"Could not release lease {name}: {e}")
+
+    async def _acquire_or_wait(self, lease: Lease, wait: float):
+        deadline = time.monotonic() + wait
+        while True:
+            try:
+                acquired = await self.acquire(lease.name, lease.owner, lease.ttl)
+            except Exception:
+                self.errors += 1
+                LEASE_ACQUIRES.inc(_scope(lease.name), "error")
+                raise
+            if acquired:
+                self.acquired += 1
+                LEASE_ACQUIRES.inc(_scope(lease.name), "acquired")
+                return
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.busy += 1
+                LEASE_ACQUIRES.inc(_scope(lease.name), "busy")
+                raise LeaseUnavailable(lease.name)
+            await asyncio.sleep(min(remaining, RETRY_INTERVAL * random.uniform(0.5, 1.5)))
+
+    async def _keep(self, lease: Lease, holder: Optional[asyncio.Task]):
+        interval = max(0.1, lease.ttl / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await self.renew(lease.name, lease.owner, lease.ttl)
+            except Exception as e:
+                # Keep trying; the lease survives until its TTL runs out
+                self.errors += 1
+                logger.error(f"Failed to renew lease {lease.name}: {e}")
+                continue
+            if not renewed:
+                lease.lost = True
+                self.lost += 1
+                LEASES_LOST.inc(_scope(lease.name))
+                logger.warning(f"Lease {lease.name} expired and was taken over by another worker; stopping its holder")
+                if holder is not None:
+                    holder.cancel()
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "held": sorted(lease.name for lease in self._held.values()),
+            "acquired": self.acquired,
+            "busy": self.busy,
+            "lost": self.lost,
+            "errors": self.errors,
+        }
+
+
+class InMemoryLeaseManager(LeaseManager):
+    """Leases in a dict: exclusive within this process only."""
+    name = "memory"
+
+    def __init__(self):
+        super().__init__()
+        # name -> (owner, monotonic expiry)
+        self._leases: Dict[str, Tuple[str, float]] = {}
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.monotonic()
+        current = self._leases.get(name)
+        if current is not None and current[0] != owner and current[1] > now:
+            return False
+        self._leases[name] = (owner, now + ttl)
+        return True
+
+    async def renew(self, name: str, owner: str, ttl: float) -> bool:
+        current = self._leases.get(name)
+        if current is None or current[0] != owner:
+            return False
+        self._leases[name] = (owner, time.monotonic() + ttl)
+        return True
+
+    async def release(self, name: str, owner: str) -> None:
+        current = self._leases.get(name)
+        if current is not None and current[0] == owner:
+            del self._leases[name]
+
+
+class SupabaseLeaseManager(LeaseManager):
+    """
+    Leases in the `backend_leases` table (see
+    supabase/migrations/20250713100000_create_backend_leases_table.sql). Taking, renewing
+    and releasing are single-statement RPCs, so two processes cannot both win a lease, and
+    a renewal only succeeds while the row still names the caller as owner.
+    """
+    name = "supabase"
+
+    def _repository(self):
+        return get_service_supabase_repository()
+
+    async def acquire(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(await self._repository().rpc("acquire_backend_lease", {
+            "p_name": name, "p_owner": owner, "p_ttl_seconds": ttl,
+        }))
+
+    async def renew(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(await self._repository().rpc("renew_backend_lease", {
+            "p_name": name, "p_owner": owner, "p_ttl_seconds": ttl,
+        }))
+
+    async def release(self, name: str, owner: str) -> None:
+        await self._repository().rpc("release_backend_lease", {"p_name": name, "p_owner": owner})
+
+
+lease_manager: Optional[LeaseManager] = None
+
+def get_lease_manager() -> LeaseManager:
+    """Returns the configured lease manager (LEASE_BACKEND: memory or supabase)."""
+    global lease_manager
+    if lease_manager is None:
+        backend = settings.lease_backend.lower()
+        if backend == "supabase":
+            lease_manager = SupabaseLeaseManager()
+        elif backend == "memory":
+            lease_manager = InMemoryLeaseManager()
+        else:
+            raise ValueError(f"Unknown LEASE_BACKEND: {settings.lease_backend}")
+        logger.info(f"Lease backend: {backend}")
+    return lease_manager
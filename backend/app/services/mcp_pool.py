@@ -0,0 +1,280 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from ..config import settings
+from .circuit_breaker import circuit_breakers
+from .metrics import MCP_SPAWNS
+
+logger = logging.getLogger(__name__)
+
+# StreamReader line limit for MCP responses (default 64KB is too small for generated content)
+STDOUT_LINE_LIMIT = 16 * 1024 * 1024
+# Restart a worker after this many consecutive timeouts/transport errors
+MAX_CONSECUTIVE_FAILURES = 3
+
+
+class McpWorkerError(Exception):
+    """Raised when an MCP worker process dies or cannot serve a request."""
+
+
+class McpWorker:
+    """
+    A single long-lived MCP server process speaking newline-delimited JSON-RPC over stdio.
+    Multiple requests can be in flight at once; responses are matched back by request id.
+    """
+    def __init__(self, script_path: str, env: Dict[str, str]):
+        self.script_path = script_path
+        self.env = env
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.last_used = time.monotonic()
+        self.consecutive_failures = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._write_lock = asyncio.Lock()
+        self._reader_task: Optional[asyncio.Task] = None
+        self._stderr_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    @property
+    def healthy(self) -> bool:
+        return (
+            not self._closed
+            and self.process is not None
+            and self.process.returncode is None
+            and self.consecutive_failures < MAX_CONSECUTIVE_FAILURES
+        )
+
+    async def start(self):
+        logger.info(f"Starting MCP server: node {self.script_path}")
+        MCP_SPAWNS.inc(os.path.basename(self.script_path))
+        self.process = await asyncio.create_subprocess_exec(
+            'node', self.script_path,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=self.env,
+            limit=STDOUT_LINE_LIMIT
+        )
+        self._reader_task = asyncio.create_task(self._read_stdout())
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+        logger.info(f"MCP server started (pid {self.process.pid}): {os.path.basename(self.script_path)}")
+
+    async def call(self, request_id: int, method: str, params: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        """Sends one JSON-RPC request and waits for the response carrying the same id."""
+        if not self.healthy:
+            raise McpWorkerError("MCP worker is not running.")
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self.last_used = time.monotonic()
+        request_json = json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}) + "\n"
+
+        try:
+            async with self._write_lock:
+                logger.info(f"Sending request to MCP server (pid {self.process.pid}): {request_json.strip()}")
+                self.process.stdin.write(request_json.encode('utf-8'))
+                await self.process.stdin.drain()
+            response = await asyncio.wait_for(future, timeout=timeout)
+            self.consecutive_failures = 0
+            return response
+        except (asyncio.TimeoutError, ConnectionError, BrokenPipeError) as e:
+            self.consecutive_failures += 1
+            logger.warning(f"MCP request {request_id} failed on pid {self.process.pid} ({self.consecutive_failures} consecutive): {e!r}")
+            raise
+        finally:
+            self._pending.pop(request_id, None)
+            self.last_used = time.monotonic()
+
+    async def _read_stdout(self):
+        """Routes each response line to the future waiting on its id."""
+        try:
+            while True:
+                line = await self.process.stdout.readline()
+                if not line:
+                    break  # Process closed stdout (exited)
+                text = line.decode('utf-8').strip()
+                if not text:
+                    continue
+                try:
+                    message = json.loads(text)
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring non-JSON output from MCP server ({os.path.basename(self.script_path)}): {text}")
+                    continue
+                future = self._pending.get(message.get("id")) if isinstance(message, dict) else None
+                if future is None:
+                    # Notifications or responses to requests that already timed out
+                    logger.debug(f"Unmatched MCP message: {text}")
+                    continue
+                if not future.done():
+                    future.set_result(message)
+        except Exception as e:
+            logger.error(f"Error reading from MCP server ({os.path.basename(self.script_path)}): {e}")
+        finally:
+            self._closed = True
+            self._fail_pending(McpWorkerError("MCP server process exited."))
+
+    async def _drain_stderr(self):
+        try:
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.warning(f"MCP server stderr ({os.path.basename(self.script_path)}): {line.decode('utf-8').rstrip()}")
+        except Exception:
+            pass
+
+    def _fail_pending(self, error: Exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    async def close(self):
+        """Terminates the process and fails anything still waiting on it."""
+        self._closed = True
+        if self.process and self.process.returncode is None:
+            try:
+                self.process.stdin.close()
+                self.process.terminate()
+                await asyncio.wait_for(self.process.wait(), timeout=5)
+            except ProcessLookupError:
+                pass  # Process already finished
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+            except Exception as term_err:
+                logger.error(f"Error terminating MCP process: {term_err}")
+        for task in (self._reader_task, self._stderr_task):
+            if task and not task.done():
+                task.cancel()
+        self._fail_pending(McpWorkerError("MCP worker closed."))
+
+
+class McpProcessPool:
+    """
+    Pool of long-lived MCP server processes for one script. Requests go to the least
+    loaded healthy worker; new workers are spawned on demand up to `size`, dead or
+    repeatedly failing workers are replaced, and idle workers are reaped. While the
+    script's circuit is open (it keeps timing out or dying), calls fail fast with
+    CircuitOpenError instead of spawning replacements.
+    """
+    def __init__(self, script_path: str, env: Dict[str, str], size: int, idle_timeout: float, call_timeout: float):
+        self.script_path = script_path
+        self.env = env
+        self.size = max(1, size)
+        self.idle_timeout = idle_timeout
+        self.call_timeout = call_timeout
+        self._workers: List[McpWorker] = []
+        self._ids = itertools.count(1)
+        self._lock = asyncio.Lock()
+        self._reaper_task: Optional[asyncio.Task] = None
+        self.breaker = circuit_breakers.get(f"mcp.{os.path.basename(script_path)}")
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Sends a JSON-RPC request to a pooled worker and returns the raw response message."""
+        # Any failure to get a response (spawn error, timeout, dead process) counts; JSON-RPC errors do not
+        with self.breaker.guard():
+            worker = await self._acquire()
+            try:
+                return await worker.call(next(self._ids), method, params, timeout=self.call_timeout)
+            finally:
+                if not worker.healthy:
+                    await self._discard(worker)
+
+    async def _acquire(self) -> McpWorker:
+        async with self._lock:
+            self._ensure_reaper()
+            for worker in [w for w in self._workers if not w.healthy]:
+                logger.warning(f"Restarting unhealthy MCP worker for {os.path.basename(self.script_path)}")
+                self._workers.remove(worker)
+                asyncio.create_task(worker.close())
+
+            idle = [w for w in self._workers if w.in_flight == 0]
+            if idle:
+                return idle[0]
+            if len(self._workers) < self.size:
+                worker = McpWorker(self.script_path, self.env)
+                await worker.start()
+                self._workers.append(worker)
+                return worker
+            return min(self._workers, key=lambda w: w.in_flight)
+
+    async def _discard(self, worker: McpWorker):
+        async with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        await worker.close()
+
+    def _ensure_reaper(self):
+        if self.idle_timeout > 0 and (self._reaper_task is None or self._reaper_task.done()):
+            self._reaper_task = asyncio.create_task(self._reap_idle_workers())
+
+    async def _reap_idle_workers(self):
+        interval = max(1.0, self.idle_timeout / 2)
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            async with self._lock:
+                expired = [w for w in self._workers if w.in_flight == 0 and now - w.last_used >= self.idle_timeout]
+                for worker in expired:
+                    self._workers.remove(worker)
+            for worker in expired:
+                logger.info(f"Reaping idle MCP worker for {os.path.basename(self.script_path)}")
+                await worker.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "script": os.path.basename(self.script_path),
+            "size": self.size,
+            "workers": len(self._workers),
+            "in_flight": sum(w.in_flight for w in self._workers),
+        }
+
+    async def close(self):
+        if self._reaper_task:
+            self._reaper_task.cancel()
+        async with self._lock:
+            workers, self._workers = self._workers, []
+        await asyncio.gather(*(w.close() for w in workers), return_exceptions=True)
+
+
+class McpPoolManager:
+    """Keeps one process pool per (script, environment) pair."""
+    def __init__(self):
+        self._pools: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], McpProcessPool] = {}
+
+    def get_pool(self, script_path: str, env: Optional[Dict[str, str]] = None) -> McpProcessPool:
+        key = (script_path, tuple(sorted((env or {}).items())))
+        pool = self._pools.get(key)
+        if pool is None:
+            # Combine current environment with provided env vars (like API keys from config)
+            process_env = os.environ.copy()
+            if env:
+                process_env.update(env)
+            pool = McpProcessPool(
+                script_path,
+                process_env,
+                size=settings.mcp_pool_size,
+                idle_timeout=settings.mcp_pool_idle_timeout,
+                call_timeout=settings.mcp_call_timeout
+            )
+            self._pools[key] = pool
+        return pool
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [pool.stats() for pool in self._pools.values()]
+
+    async def close_all(self):
+        pools, self._pools = list(self._pools.values()), {}
+        await asyncio.gather(*(pool.close() for pool in pools), return_exceptions=True)
+
+
+# Shared pool manager used by the MCP proxy endpoint
+mcp_pools = McpPoolManager()
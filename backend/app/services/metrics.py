@@ -0,0 +1,283 @@
+"""
+In-process metrics with Prometheus text exposition (served at GET /metrics).
+
+Recording is a dict lookup plus a few additions under a lock, so it is safe to leave on in
+hot paths (every OpenAI call, every Supabase query). Label values must come from small,
+fixed sets (method names, table names, stages), never IDs.
+"""
+import asyncio
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+# Seconds; covers fast PostgREST queries up to multi-minute generation stages
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def collect(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge set directly, or computed at scrape time from `callback` (unlabelled only)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def collect(self) -> List[str]:
+        if self._callback is not None:
+            try:
+                return self._header() + [f"{self.name} {_format_value(self._callback())}"]
+            except Exception:
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        """Context manager observing the elapsed wall-clock time."""
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self._series.items()]
+        lines = self._header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, *self._labels)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, tuple(labelnames)))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              callback: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, tuple(labelnames), callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, tuple(labelnames), buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- OpenAI ---
+OPENAI_REQUESTS = registry.counter("openai_requests_total", "OpenAI API calls.", ["method", "outcome"])
+OPENAI_LATENCY = registry.histogram("openai_request_duration_seconds", "OpenAI API call latency.", ["method"])
+
+# --- Supabase (PostgREST) ---
+SUPABASE_REQUESTS = registry.counter("supabase_requests_total", "Supabase PostgREST requests.", ["table", "operation", "outcome"])
+SUPABASE_LATENCY = registry.histogram("supabase_request_duration_seconds", "Supabase PostgREST request latency.", ["table", "operation"])
+
+# --- MCP servers ---
+MCP_SPAWNS = registry.counter("mcp_process_spawns_total", "MCP server processes started.", ["server"])
+MCP_CALLS = registry.counter("mcp_calls_total", "MCP tool calls via execute_mcp_stdio.", ["server", "outcome"])
+MCP_LATENCY = registry.histogram("mcp_call_duration_seconds", "MCP tool call latency.", ["server"])
+
+# --- Provider rate limiting (services/rate_limiter.py) ---
+RATE_LIMIT_WAIT = registry.histogram(
+    "rate_limit_wait_seconds", "Time a provider call waited for a rate limit token.", ["bucket"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+RATE_LIMIT_WAITING = registry.gauge("rate_limit_waiting", "Provider calls currently waiting for a rate limit token.", ["bucket"])
+RATE_LIMIT_PAUSES = registry.counter("rate_limit_pauses_total", "Buckets paused by a provider 429 with Retry-After.", ["bucket"])
+
+# --- Circuit breakers (services/circuit_breaker.py) ---
+CIRCUIT_STATE = registry.gauge("circuit_state", "Dependency circuit state (0 closed, 1 half-open, 2 open).", ["dependency"])
+CIRCUIT_TRANSITIONS = registry.counter("circuit_transitions_total", "Dependency circuit state changes, by new state.", ["dependency", "state"])
+CIRCUIT_REJECTED = registry.counter("circuit_rejected_total", "Calls failed fast because the dependency's circuit was open.", ["dependency"])
+
+# --- Cross-process leases (services/leases.py) ---
+LEASE_ACQUIRES = registry.counter("lease_acquires_total", "Lease acquisition attempts, by lease scope (pipeline, thread).", ["scope", "outcome"])
+LEASES_LOST = registry.counter("leases_lost_total", "Held leases that expired and were taken over before release.", ["scope"])
+
+# --- Fal queue API ---
+FAL_REQUESTS = registry.counter("fal_requests_total", "Fal queue API HTTP requests.", ["endpoint", "outcome"])
+FAL_JOBS = registry.counter("fal_jobs_total", "Fal generation jobs run to completion or failure.", ["model", "outcome"])
+FAL_JOB_LATENCY = registry.histogram("fal_job_duration_seconds", "Fal generation job duration, submit to result.", ["model"])
+FAL_POLLS = registry.counter("fal_status_polls_total", "Fal job status polls.", ["model"])
+
+# --- Generated media cache (services/generation_cache.py) ---
+GENERATION_CACHE_LOOKUPS = registry.counter("generation_cache_lookups_total", "Generated media cache lookups.", ["kind", "outcome"])
+
+# --- Generation pipeline ---
+PIPELINE_STAGE_LATENCY = registry.histogram("pipeline_stage_duration_seconds", "Generation pipeline stage duration per scene.", ["stage", "outcome"])
+PIPELINE_SCENES = registry.counter("pipeline_scenes_total", "Scenes finished by the generation pipeline.", ["status"])
+SCENE_CALLBACKS = registry.counter("scene_generation_callbacks_total", "Fal webhook callbacks for scene generation.", ["stage", "outcome"])
+PIPELINE_RUN_LATENCY = registry.histogram("pipeline_run_duration_seconds", "Whole-project generation pipeline duration.", ["outcome"])
+
+# --- to_thread executor ---
+TO_THREAD_IN_FLIGHT = registry.gauge("to_thread_in_flight", "Calls submitted via metrics.to_thread that have not finished (queued + running).")
+TO_THREAD_WAIT = registry.histogram(
+    "to_thread_queue_wait_seconds", "Time a to_thread call waited for a free executor worker.", ["call"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+TO_THREAD_QUEUED = registry.gauge("to_thread_queue_depth", "Calls submitted via metrics.to_thread still waiting for a worker.")
+
+
+async def to_thread(fn: Callable[..., T], *args: Any, call: str = "other", **kwargs: Any) -> T:
+    """
+    Drop-in for asyncio.to_thread that also measures executor queueing: in-flight calls,
+    calls waiting for a worker, and how long each waited (labelled by `call`).
+    """
+    submitted = time.perf_counter()
+    # Set by whichever side takes the call off the queue gauge first: the worker starting
+    # it, or the caller giving up on it (the executor job still runs after a cancellation)
+    dequeued = threading.Lock()
+
+    def run() -> T:
+        if dequeued.acquire(blocking=False):
+            TO_THREAD_QUEUED.dec()
+            TO_THREAD_WAIT.observe(time.perf_counter() - submitted, call)
+        return fn(*args, **kwargs)
+
+    TO_THREAD_IN_FLIGHT.inc()
+    TO_THREAD_QUEUED.inc()
+    try:
+        return await asyncio.to_thread(run)
+    finally:
+        TO_THREAD_IN_FLIGHT.dec()
+        if dequeued.acquire(blocking=False):
+            # Cancelled before a worker picked it up
+            TO_THREAD_QUEUED.dec()
+
+
+def render_latest() -> str:
+    """Prometheus text exposition format (version 0.0.4) of every registered metric."""
+    return registry.render()
+
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
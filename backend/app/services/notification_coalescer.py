@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from ..config import settings
+from .tracing import detached
+
+logger = logging.getLogger(__name__)
+
+# (scene_id, field, value) as last written by the frontend
+CanvasUpdate = Tuple[str, str, Any]
+
+
+class _Entry:
+    __slots__ = ("value", "first_seen", "last_seen", "attempts")
+
+    def __init__(self, value: Any, now: float):
+        self.value = value
+        self.first_seen = now
+        self.last_seen = now
+        self.attempts = 0
+
+
+class NotificationCoalescer:
+    """
+    Debounces canvas update notifications per (scene_id, field) with last-write-wins.
+
+    `submit` only records the latest value and returns. A background task flushes an entry
+    once it has been quiet for `debounce` seconds (or `max_delay` after its first write, so
+    continuous typing still gets persisted), handing every due update to `flush_fn` in one
+    call. The buffer holds at most `max_pending` keys; when it is full, everything pending
+    is flushed immediately regardless of debounce. While flushes are failing (database
+    down) a full buffer sheds its oldest keys instead of growing, counted in `shed`.
+    """
+    MAX_FLUSH_ATTEMPTS = 3
+
+    def __init__(self, flush_fn: Callable[[List[CanvasUpdate]], Awaitable[int]],
+                 debounce: Optional[float] = None, max_delay: Optional[float] = None,
+                 flush_interval: Optional[float] = None, max_pending: Optional[int] = None):
+        # flush_fn returns the number of database writes it made (for the coalescing ratio)
+        self._flush_fn = flush_fn
+        self.debounce = debounce if debounce is not None else settings.canvas_update_debounce
+        self.max_delay = max_delay if max_delay is not None else settings.canvas_update_max_delay
+        self.flush_interval = flush_interval if flush_interval is not None else settings.canvas_update_flush_interval
+        self.max_pending = max(1, max_pending if max_pending is not None else settings.canvas_update_max_pending)
+        self._pending: Dict[Tuple[str, str], _Entry] = {}
+        self._flush_now = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.writes = 0
+        self.dropped = 0
+        self.shed = 0
+        self.forced_flushes = 0
+        # Set by a failed flush, cleared by a successful one
+        self._flush_failing = False
+        self._shed_warned = False
+
+    def submit(self, scene_id: str, field: str, value: Any):
+        """Records the latest value for (scene_id, field); never waits on the database."""
+        now = time.monotonic()
+        key = (scene_id, field)
+        self.received += 1
+        entry = self._pending.get(key)
+        if entry is not None:
+            entry.value = value
+            entry.last_seen = now
+            self.coalesced += 1
+        else:
+            if self._flush_failing and len(self._pending) >= self.max_pending:
+                # A forced flush would fail too; keep the newest values within the bound,
+                # shedding a tenth of the buffer at a time
+                self._shed_oldest(max(len(self._pending) - self.max_pending + 1, self.max_pending // 10))
+            self._pending[key] = _Entry(value, now)
+            if len(self._pending) >= self.max_pending and not self._flush_now.is_set():
+                self.forced_flushes += 1
+                self._flush_now.set()
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            # Shared by every request; its writes belong to no single request's trace
+            with detached():
+                self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            force = self._flush_now.is_set()
+            self._flush_now.clear()
+            try:
+                await self.flush(force=force)
+            except Exception:
+                logger.exception("Canvas update flush failed")
+
+    def _take_due(self, force: bool) -> Dict[Tuple[str, str], _Entry]:
+        now = time.monotonic()
+        due = {
+            key: entry for key, entry in self._pending.items()
+            if force or now - entry.last_seen >= self.debounce or now - entry.first_seen >= self.max_delay
+        }
+        for key in due:
+            del self._pending[key]
+        return due
+
+    async def flush(self, force: bool = True):
+        """Flushes due entries (all of them when `force`) through flush_fn."""
+        async with self._flush_lock:
+            due = self._take_due(force)
+            if not due:
+                return
+            updates = [(scene_id, field, entry.value) for (scene_id, field), entry in due.items()]
+            try:
+                self.writes += await self._flush_fn(updates)
+                self.flushed += len(updates)
+                self._flush_failing = False
+                self._shed_warned = False
+            except Exception as e:
+                logger.error(f"Failed to flush {len(updates)} canvas updates: {e}")
+                self._flush_failing = True
+                self._requeue(due)
+
+    def _requeue(self, failed: Dict[Tuple[str, str], _Entry]):
+        """Puts failed entries back unless a newer value arrived meanwhile or attempts ran out."""
+        for key, entry in failed.items():
+            entry.attempts += 1
+            if key in self._pending:
+                continue  # newer value wins
+            if entry.attempts >= self.MAX_FLUSH_ATTEMPTS:
+                self.dropped += 1
+                logger.error(f"Dropping canvas update for scene {key[0]} field {key[1]} after {entry.attempts} failed flushes")
+                continue
+            self._pending[key] = entry
+        if len(self._pending) > self.max_pending:
+            self._shed_oldest(len(self._pending) - self.max_pending)
+
+    def _shed_oldest(self, count: int):
+        """Drops the `count` keys whose first write is oldest."""
+        oldest = heapq.nsmallest(count, self._pending, key=lambda key: self._pending[key].first_seen)
+        for key in oldest:
+            del self._pending[key]
+        self.shed += len(oldest)
+        if not self._shed_warned:
+            self._shed_warned = True
+            logger.warning(f"Canvas update buffer full while flushes fail; dropping the oldest updates (max_pending {self.max_pending})")
+
+    async def close(self):
+        """Stops the background flusher and flushes everything still buffered."""
+        if self._task and not self._task.done():
+            # Cancel only between flushes so no taken-but-unwritten entries are lost
+            async with self._flush_lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush(force=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+            "writes": self.writes,
+            "dropped": self.dropped,
+            "shed": self.shed,
+            "forced_flushes": self.forced_flushes,
+            # Notifications received per database write (higher = more coalescing)
+            "coalescing_ratio": round(self.received / self.writes, 2) if self.writes else None,
+        }
@@ -1,171 +1,349 @@
-import os
+import asyncio
+import json
 import logging
-from supabase import create_client, Client
-from typing import Optional, Dict, Any
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Union
 from .agent_service import agent_service # Import the agent service instance
+from ..config import settings
+from ..supabase_client import get_service_supabase_repository
+from ..supabase_repository import SupabaseRepository
+from .scene_status_writer import SceneStatusWriter
+from .leases import get_lease_manager
+from .snapshot_cache import snapshot_cache
+from .metrics import PIPELINE_RUN_LATENCY, PIPELINE_SCENES, PIPELINE_STAGE_LATENCY
+from .tracing import current_span, span, traced
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    logging.error("Supabase URL or Service Role Key not found in environment variables.")
-    # Depending on the server setup, might want to raise an exception or exit
-    # raise ValueError("Missing Supabase credentials")
-
 # --- Placeholder MCP Tool Functions Removed ---
 # Generation will be triggered via agent_service tool methods below
 
 # --- Supabase Helper ---
 
-def get_supabase_client() -> Optional[Client]:
-    """Initializes and returns a Supabase client using service role key."""
-    if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
-        try:
-            return create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-        except Exception as e:
-            logging.error(f"Failed to create Supabase client: {e}")
-            return None
-    return None
+def get_pipeline_repository() -> Optional[SupabaseRepository]:
+    """Returns the async Supabase repository using the service role key."""
+    try:
+        return get_service_supabase_repository()
+    except Exception as e:
+        logging.error(f"Failed to create Supabase repository: {e}")
+        return None
 
-def update_scene_status(supabase: Client, scene_id: str, status: str, data: Optional[Dict[str, Any]] = None):
-    """Updates the status and optionally other data for a scene."""
+async def update_scene_status(supabase: Union[SupabaseRepository, SceneStatusWriter], scene_id: str, status: str, data: Optional[Dict[str, Any]] = None):
+    """
+    Updates the status and optionally other data for a scene. Given a SceneStatusWriter,
+    the update is buffered and written in bulk with other scenes' updates. The snapshot
+    cache is patched right away; a writer that finally drops the update evicts the scene
+    (run_generation_pipeline's writer has `on_drop`) so the unwritten status is not served from the cache.
+    """
     update_data = {"status": status}
     if data:
         update_data.update(data)
 
     try:
-        response = supabase.table("canvas_scenes").update(update_data).eq("id", scene_id).execute()
-        if response.data:
+        updated = await supabase.update_scene(scene_id, update_data)
+        snapshot_cache.apply_scene_update(scene_id, update_data)
+        if status in ("completed", "failed"):
+            PIPELINE_SCENES.inc(status)
+        if updated:
             logging.info(f"Updated scene {scene_id} status to '{status}'")
         else:
             # Handle potential errors if needed, e.g., scene not found
-             logging.warning(f"Scene {scene_id} not found or update failed. Response: {response}")
+             logging.warning(f"Scene {scene_id} not found or update failed.")
     except Exception as e:
         logging.error(f"Error updating scene {scene_id} status to '{status}': {e}")
 
 
-# --- Core Pipeline Logic ---
+# --- Concurrency Limits ---
 
-async def run_generation_pipeline(project_id: str):
-    """Fetches pending scenes and runs the generation pipeline for them by triggering agent tools."""
-    logging.info(f"Starting generation pipeline for project {project_id}...")
-    supabase = get_supabase_client()
+# Process-wide cap on scenes in flight, shared by every project pipeline.
+# Created lazily so it binds to the running event loop.
+_global_scene_semaphore: Optional[asyncio.Semaphore] = None
+
+def _get_global_scene_semaphore() -> asyncio.Semaphore:
+    """Returns the process-wide scene semaphore, creating it on first use."""
+    global _global_scene_semaphore
+    if _global_scene_semaphore is None:
+        _global_scene_semaphore = asyncio.Semaphore(max(1, settings.pipeline_global_concurrency))
+    return _global_scene_semaphore
+
+
+# --- Checkpoints & Crash Recovery ---
+
+# Statuses a scene only holds while a pipeline is actively working on it
+IN_PROGRESS_STATUSES = ["generating_image", "generating_video"]
+
+# Values of canvas_scenes.pipeline_stage: the last stage that finished for the current run.
+# Cleared when the scene reaches a terminal status, so a user-initiated re-run starts fresh.
+STAGE_IMAGE_GENERATED = "image_generated"
+
+def _utc_now_iso(offset_seconds: float = 0.0) -> str:
+    """UTC timestamp for PostgREST filters/updates (Z suffix avoids '+' in query strings)."""
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+async def _heartbeat_scene(statuses: SceneStatusWriter, scene_id: str):
+    """Refreshes the scene's pipeline heartbeat until cancelled, so recovery leaves it alone."""
+    interval = max(1.0, settings.pipeline_scene_heartbeat_interval)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # The writer stamps pipeline_heartbeat_at, batching heartbeats of concurrent scenes
+            await statuses.update_scene(scene_id, {})
+        except Exception as e:
+            logging.warning(f"Failed to refresh pipeline heartbeat for scene {scene_id}: {e}")
+
+async def requeue_stale_scenes(supabase: SupabaseRepository, project_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Moves scenes left in generating_image/generating_video by a dead pipeline (no heartbeat
+    for PIPELINE_SCENE_LEASE_SECONDS) back to pending_generation. Their pipeline_stage
+    checkpoint is kept, so the next run resumes from the last completed stage.
+    """
+    stale_before = _utc_now_iso(-settings.pipeline_scene_lease_seconds)
+    scenes = await supabase.requeue_stale_pipeline_scenes(IN_PROGRESS_STATUSES, stale_before, project_id=project_id)
+    for scene in scenes:
+        logging.warning(f"Re-queued stale scene {scene.get('id')} (project {scene.get('project_id')}, "
+                        f"checkpoint: {scene.get('pipeline_stage') or 'none'})")
+    return scenes
+
+async def recover_interrupted_pipelines(job_store) -> List[str]:
+    """
+    Startup recovery sweep: re-queues abandoned scenes across all projects and enqueues a
+    pipeline job for each affected project. Returns the recovered project IDs.
+    """
+    supabase = get_pipeline_repository()
     if not supabase:
-        logging.error("Cannot run pipeline: Supabase client unavailable.")
+        logging.error("Cannot run pipeline recovery: Supabase repository unavailable.")
+        return []
+
+    try:
+        scenes = await requeue_stale_scenes(supabase)
+    except Exception as e:
+        logging.error(f"Pipeline recovery sweep failed: {e}")
+        return []
+
+    project_ids = sorted({scene["project_id"] for scene in scenes if scene.get("project_id")})
+    for project_id in project_ids:
+        try:
+            job, created = await job_store.enqueue(project_id, settings.pipeline_job_max_attempts)
+            logging.info(f"Recovery enqueued pipeline job {job['id']} for project {project_id} (new: {created})")
+        except Exception as e:
+            logging.error(f"Failed to enqueue recovery job for project {project_id}: {e}")
+    if project_ids:
+        logging.info(f"Recovered {len(scenes)} stale scenes across {len(project_ids)} projects.")
+    return project_ids
+
+def _raise_on_tool_failure(result_str: str, stage: str):
+    """Tools report failures in their JSON result; only a successful stage may be checkpointed."""
+    try:
+        result = json.loads(result_str)
+    except (TypeError, ValueError):
+        return
+    if isinstance(result, dict) and result.get("success") is False:
+        raise RuntimeError(f"{stage} failed: {result.get('error', 'unknown error')}")
+
+
+async def _run_stage(stage: str, scene_id: str, tool_call) -> str:
+    """Awaits a generation tool call, raising on a failure result; the duration is recorded per stage."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with span(f"pipeline.stage.{stage}", root=False, scene_id=scene_id):
+            result_str = await tool_call
+        logging.info(f"{stage.capitalize()} generation tool triggered for scene {scene_id}. Result: {result_str}")
+        _raise_on_tool_failure(result_str, f"{stage.capitalize()} generation")
+        outcome = "ok"
+        return result_str
+    finally:
+        PIPELINE_STAGE_LATENCY.observe(time.perf_counter() - started, stage, outcome)
+
+
+# --- Core Pipeline Logic ---
+
+@traced("pipeline.scene", root=False)
+async def _process_scene(supabase: SupabaseRepository, statuses: SceneStatusWriter, scene: Dict[str, Any]):
+    """
+    Runs image then video generation for a single scene, recording failures on the scene.
+    A scene whose image stage already completed (pipeline_stage checkpoint) goes straight to video.
+    Status transitions go through `statuses`, which also stamps the pipeline heartbeat.
+    With FAL_WEBHOOK_URL set, the scene is only started here and completes via callbacks.
+    """
+    scene_id = scene["id"]
+    logging.info(f"Processing scene {scene_id} (Index: {scene['scene_index']})...")
+    current_span().set_attribute("scene_id", scene_id)
+
+    from .scene_state_machine import scene_state_machine
+    if scene_state_machine.enabled:
+        # Submit the first job with a callback; Fal's webhooks advance the scene from here
+        await scene_state_machine.start(supabase, scene)
         return
 
+    heartbeat = asyncio.create_task(_heartbeat_scene(statuses, scene_id))
     try:
-        # Fetch project details to get aspect ratio (assuming it's on the project table)
-        project_response = supabase.table("canvas_projects").select("aspect_ratio").eq("id", project_id).maybe_single().execute()
-        if not project_response.data:
-             logging.error(f"Project {project_id} not found.")
+        resume_from_video = scene.get("pipeline_stage") == STAGE_IMAGE_GENERATED
+
+        # 1. Generate Description (if needed - assuming image_prompt might already exist)
+        #    If description generation is always required, add the call here.
+        #    For now, assume image_prompt is ready or generated earlier.
+        current_image_prompt = scene.get("image_prompt", "")
+        if not current_image_prompt and not resume_from_video:
+             logging.warning(f"Scene {scene_id} has no image_prompt. Skipping image generation.")
+             # Optionally call generate_scene_description here if it should create the prompt
+             # description = generate_scene_description(project_id, scene_id)
+             # update_scene_status(supabase, scene_id, 'description_generated', {'image_prompt': description}) # Example update
+             # current_image_prompt = description # Use the newly generated prompt
+             # If still no prompt, mark as failed or skip
+             await update_scene_status(statuses, scene_id, 'failed', {'error_message': 'Missing image prompt', 'pipeline_stage': None})
              return
-        aspect_ratio = project_response.data.get("aspect_ratio", "16:9") # Default aspect ratio
-
-        # Fetch pending scenes for the project, ordered by scene_index
-        scenes_response = supabase.table("canvas_scenes") \
-            .select("id, scene_index, image_prompt, custom_instruction") \
-            .eq("project_id", project_id) \
-            .eq("status", "pending_generation") \
-            .order("scene_index", desc=False) \
-            .execute()
-
-        if not scenes_response.data:
-            logging.info(f"No pending scenes found for project {project_id}.")
-            return
-
-        logging.info(f"Found {len(scenes_response.data)} pending scenes for project {project_id}.")
-
-        for scene in scenes_response.data:
-            scene_id = scene["id"]
-            logging.info(f"Processing scene {scene_id} (Index: {scene['scene_index']})...")
-
-            try:
-                # 1. Generate Description (if needed - assuming image_prompt might already exist)
-                #    If description generation is always required, add the call here.
-                #    For now, assume image_prompt is ready or generated earlier.
-                current_image_prompt = scene.get("image_prompt", "")
-                if not current_image_prompt:
-                     logging.warning(f"Scene {scene_id} has no image_prompt. Skipping image generation.")
-                     # Optionally call generate_scene_description here if it should create the prompt
-                     # description = generate_scene_description(project_id, scene_id)
-                     # update_scene_status(supabase, scene_id, 'description_generated', {'image_prompt': description}) # Example update
-                     # current_image_prompt = description # Use the newly generated prompt
-                     # If still no prompt, mark as failed or skip
-                     update_scene_status(supabase, scene_id, 'failed', {'error_message': 'Missing image prompt'})
-                     continue
-
-
-                # 2. Generate Image
-                update_scene_status(supabase, scene_id, 'generating_image')
-                # Trigger image generation via agent tool
-                # Assuming 'v2' is the desired version, adjust if needed
-                # The tool itself handles updating status/image_url via Supabase functions
-                logging.info(f"Triggering image generation tool for scene {scene_id}")
-                image_gen_result_str = await agent_service._tool_trigger_image_generation(
-                    scene_id=scene_id,
-                    image_prompt=current_image_prompt,
-                    version='v2' # Or fetch dynamically if needed
-                )
-                # TODO: Optionally check image_gen_result_str for success/failure if the tool returns meaningful status
-                logging.info(f"Image generation tool triggered for scene {scene_id}. Result: {image_gen_result_str}")
-                # We don't get the image_url back directly here, the triggered function handles updates.
-                # The status update below marks the *start* of video generation.
-                # We need to fetch the image_url before triggering video gen, or assume the video gen tool can fetch it.
-                # Let's assume video gen tool fetches the image_url based on scene_id.
-
-                # Fetch the updated scene data to get the image_url (or assume video tool does this)
-                # scene_update_resp = supabase.table("canvas_scenes").select("image_url").eq("id", scene_id).maybe_single().execute()
-                # image_url = scene_update_resp.data.get("image_url") if scene_update_resp.data else None
-                # if not image_url:
-                #     raise ValueError(f"Image URL not found for scene {scene_id} after triggering generation.")
-
-
-                # 3. Generate Video
-                update_scene_status(supabase, scene_id, 'generating_video') # Removed image_url update here
-                # Trigger video generation via agent tool
-                logging.info(f"Triggering video generation tool for scene {scene_id}")
-                video_gen_result_str = await agent_service._tool_trigger_video_generation(scene_id=scene_id)
-                # TODO: Optionally check video_gen_result_str for success/failure
-                logging.info(f"Video generation tool triggered for scene {scene_id}. Result: {video_gen_result_str}")
-                # Video URL is updated by the triggered function. We mark as completed here,
-                # but actual completion depends on the background Supabase function.
-                # The status update below might be premature. A separate mechanism should check final status.
-                # For now, we'll keep the 'completed' update, assuming success for pipeline flow.
-
-
-                # 4. Mark as Completed
-                # Mark as completed in the pipeline runner's view. Actual status handled by generation functions.
-                update_scene_status(supabase, scene_id, 'completed', {'error_message': None}) # Removed video_url update
-                logging.info(f"Successfully processed scene {scene_id}.")
-
-            except Exception as e:
-                error_message = f"Failed processing scene {scene_id}: {e}"
-                logging.error(error_message)
-                update_scene_status(supabase, scene_id, 'failed', {'error_message': str(e)})
-                # Continue to the next scene
-
-        logging.info(f"Finished generation pipeline for project {project_id}.")
+
+
+        # 2. Generate Image
+        if resume_from_video:
+            logging.info(f"Scene {scene_id} resumes after its completed image stage; skipping image generation.")
+        else:
+            await update_scene_status(statuses, scene_id, 'generating_image')
+            # Trigger image generation via agent tool
+            # Assuming 'v2' is the desired version, adjust if needed
+            # The tool waits for the Fal job and writes image_url to the scene
+            logging.info(f"Triggering image generation tool for scene {scene_id}")
+            await _run_stage("image", scene_id, agent_service._tool_trigger_image_generation(
+                scene_id=scene_id,
+                image_prompt=current_image_prompt,
+                version='v2' # Or fetch dynamically if needed
+            ))
+            # The video tool reads that image_url back from the scene
+
+
+        # 3. Generate Video
+        # Entering generating_video also checkpoints the finished image stage
+        await update_scene_status(statuses, scene_id, 'generating_video', {'pipeline_stage': STAGE_IMAGE_GENERATED})
+        # Trigger video generation via agent tool
+        logging.info(f"Triggering video generation tool for scene {scene_id}")
+        await _run_stage("video", scene_id, agent_service._tool_trigger_video_generation(scene_id=scene_id))
+        # The tool returns once the Fal job has finished and video_url is written
+
+
+        # 4. Mark as Completed
+        await update_scene_status(statuses, scene_id, 'completed', {'error_message': None, 'pipeline_stage': None})
+        logging.info(f"Successfully processed scene {scene_id}.")
 
     except Exception as e:
-        logging.error(f"Error during pipeline execution for project {project_id}: {e}")
+        error_message = f"Failed processing scene {scene_id}: {e}"
+        logging.error(error_message)
+        await update_scene_status(statuses, scene_id, 'failed', {'error_message': str(e), 'pipeline_stage': None})
+        # Continue to the next scene
+    finally:
+        heartbeat.cancel()
+
+@traced("pipeline.run")
+async def run_generation_pipeline(project_id: str, concurrency: Optional[int] = None):
+    """
+    Fetches pending scenes and runs the generation pipeline for them by triggering agent tools.
+
+    Scenes are independent, so up to `concurrency` of them (default
+    PIPELINE_SCENE_CONCURRENCY) are processed at once, further capped by the
+    process-wide PIPELINE_GLOBAL_CONCURRENCY limit. A concurrency of 1 keeps the
+    original one-scene-at-a-time behaviour.
+
+    Raises if the pipeline itself fails (e.g. Supabase unavailable) so the job queue
+    can retry it; individual scene failures are recorded on the scene and do not raise.
+    Scenes of this project abandoned by an earlier, crashed run are re-queued first and
+    resume from their last completed stage. Scene status transitions are coalesced and
+    written in bulk (see SceneStatusWriter); all of them are flushed before this returns.
+    The run holds the project's `pipeline:` lease (services/leases.py) throughout.
+    """
+    logging.info(f"Starting generation pipeline for project {project_id}...")
+    current_span().set_attribute("project_id", project_id)
+    supabase = get_pipeline_repository()
+    if not supabase:
+        logging.error("Cannot run pipeline: Supabase repository unavailable.")
+        raise ConnectionError("Supabase repository unavailable.")
+
+    # One run per project across all workers: two runs would each pick up the same
+    # pending scenes and generate them twice. Raises LeaseUnavailable (so the job
+    # queue retries later) while another worker is generating this project, and stops
+    # with LeaseLost if another worker takes the lease over mid-run.
+    async with get_lease_manager().hold(f"pipeline:{project_id}"):
+        scene_concurrency = concurrency if concurrency is not None else settings.pipeline_scene_concurrency
+        # Every status write also refreshes the scene's pipeline heartbeat
+        statuses = SceneStatusWriter(supabase, timestamp_field="pipeline_heartbeat_at",
+                                     on_drop=snapshot_cache.invalidate_scenes)
+        started = time.perf_counter()
+        outcome = "ok"
+
+        try:
+            # Fetch project details to get aspect ratio (assuming it's on the project table)
+            project = await supabase.get_project(project_id, "aspect_ratio")
+            if not project:
+                 logging.error(f"Project {project_id} not found.")
+                 return
+            aspect_ratio = project.get("aspect_ratio", "16:9") # Default aspect ratio
+
+            # Pick up scenes a crashed run left in generating_* (e.g. when this job is a retry)
+            await requeue_stale_scenes(supabase, project_id=project_id)
+
+            # Fetch pending scenes for the project, ordered by scene_index. Full rows prime the
+            # snapshot cache, so the generation tools do not re-fetch them.
+            scenes = await supabase.list_project_scenes(
+                project_id,
+                "*",
+                status="pending_generation",
+                order="scene_index.asc"
+            )
+            snapshot_cache.put_scenes(scenes)
+
+            if not scenes:
+                logging.info(f"No pending scenes found for project {project_id}.")
+                return
+
+            logging.info(f"Found {len(scenes)} pending scenes for project {project_id} (concurrency: {scene_concurrency}).")
+
+            if scene_concurrency <= 1:
+                for scene in scenes:
+                    await _process_scene(supabase, statuses, scene)
+            else:
+                project_semaphore = asyncio.Semaphore(scene_concurrency)
+                global_semaphore = _get_global_scene_semaphore()
+
+                async def _process_scene_bounded(scene: Dict[str, Any]):
+                    # Take the project slot first so one large project cannot hold
+                    # global slots while it waits on its own limit.
+                    async with project_semaphore:
+                        async with global_semaphore:
+                            await _process_scene(supabase, statuses, scene)
+
+                # _process_scene records its own failures; return_exceptions keeps one
+                # unexpected error from cancelling the sibling scenes.
+                results = await asyncio.gather(
+                    *(_process_scene_bounded(scene) for scene in scenes),
+                    return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        logging.error(f"Unexpected error in scene task for project {project_id}: {result}")
+
+            logging.info(f"Finished generation pipeline for project {project_id}.")
+
+        except Exception as e:
+            outcome = "error"
+            logging.error(f"Error during pipeline execution for project {project_id}: {e}")
+            # Re-raise so the job queue can retry; per-scene failures are recorded on the scenes instead
+            raise
+        finally:
+            await statuses.close()
+            PIPELINE_RUN_LATENCY.observe(time.perf_counter() - started, outcome)
+            logging.info(f"Scene status writes for project {project_id}: {statuses.stats()}")
 
 # --- MCP Tool Endpoint ---
 
 async def start_project_generation(project_id: str):
     """
     Triggers the asynchronous generation pipeline for a specific project.
-    Intended to be run as a background task.
+    Intended to be run by a pipeline job queue worker (see services/job_queue.py).
     """
     logging.info(f"Received request to start generation for project: {project_id}")
-    # Consider running this in a background thread/task queue if it's long-running
-    # For simplicity, running synchronously here.
+    # Already off the request path: the API enqueues the project and a worker calls this
     await run_generation_pipeline(project_id)
-    # The MCP framework would handle the response to the caller.
-    # This function might not need to return anything specific unless required by the framework.
 
 # Example of how you might run this manually for testing (if needed)
 # if __name__ == "__main__":
@@ -0,0 +1,252 @@
+"""
+Process-wide rate limiting and retries for calls to external providers (OpenAI, Fal).
+
+Each provider endpoint group has a token bucket. A call takes a token before it goes out
+and, when the bucket is empty, waits its turn (callers are served in arrival order), so a
+burst of chat or pipeline work is smoothed to the configured rate instead of tripping the
+provider's limit. When a provider does answer 429 with Retry-After, the whole bucket is
+paused for that long, so every caller backs off together instead of each finding the limit
+on its own. Token wait time is exported per bucket (rate_limit_wait_seconds).
+
+Retries wait for the provider's Retry-After when it sends one, else back off exponentially
+with full jitter.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple, TypeVar
+import openai
+from ..config import settings
+from .circuit_breaker import circuit_breakers
+from .metrics import OPENAI_LATENCY, OPENAI_REQUESTS, RATE_LIMIT_PAUSES, RATE_LIMIT_WAIT, RATE_LIMIT_WAITING, to_thread
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_BACKOFF = 8.0
+
+
+class TokenBucket:
+    """Refills at `rate` tokens/second up to `capacity`; a rate of 0 or less never limits."""
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self.waiting = 0
+        self.acquired = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.pauses = 0
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    async def acquire(self) -> float:
+        """Takes one token, waiting for it if needed; returns the seconds waited."""
+        self.acquired += 1
+        if self.unlimited:
+            return 0.0
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        started = time.monotonic()
+        self.waiting += 1
+        RATE_LIMIT_WAITING.inc(self.name)
+        try:
+            # The lock queues callers in arrival order; only the one at the head sleeps on the bucket
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._paused_until - now
+                    if delay <= 0:
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            break
+                        delay = (1 - self._tokens) / self.rate
+                    await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+            RATE_LIMIT_WAITING.dec(self.name)
+        waited = time.monotonic() - started
+        RATE_LIMIT_WAIT.observe(waited, self.name)
+        if waited > 0.001:
+            self.delayed += 1
+            self.wait_seconds += waited
+        return waited
+
+    def pause(self, seconds: float):
+        """Holds every caller for `seconds` (a provider's Retry-After), then refills from empty."""
+        if self.unlimited:
+            return
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            self._tokens = 0.0
+            self._updated = until
+            self.pauses += 1
+            RATE_LIMIT_PAUSES.inc(self.name)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "tokens": round(self._tokens, 2) if not self.unlimited else None,
+            "paused_for": round(max(0.0, self._paused_until - now), 3),
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "delayed": self.delayed,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "pauses": self.pauses,
+        }
+
+
+class RateLimiter:
+    """Token buckets per provider endpoint group; endpoints without a group are not limited."""
+    def __init__(self, burst_seconds: float):
+        self.burst_seconds = burst_seconds
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._routes: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def configure(self, provider: str, group: str, rate: float, endpoints: Iterable[str]):
+        bucket = TokenBucket(f"{provider}.{group}", rate, rate * self.burst_seconds)
+        self._buckets[bucket.name] = bucket
+        for endpoint in endpoints:
+            self._routes[(provider, endpoint)] = bucket
+
+    def bucket(self, provider: str, endpoint: str) -> Optional[TokenBucket]:
+        return self._routes.get((provider, endpoint))
+
+    async def acquire(self, provider: str, endpoint: str) -> float:
+        bucket = self.bucket(provider, endpoint)
+        return await bucket.acquire() if bucket is not None else 0.0
+
+    def pause(self, provider: str, endpoint: str, seconds: float):
+        bucket = self.bucket(provider, endpoint)
+        if bucket is not None:
+            bucket.pause(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: bucket.stats() for name, bucket in self._buckets.items()}
+
+
+rate_limiter = RateLimiter(settings.rate_limit_burst_seconds)
+rate_limiter.configure("openai", "threads", settings.openai_rate_threads, ["threads.create"])
+rate_limiter.configure("openai", "messages", settings.openai_rate_messages, ["messages.create", "messages.list"])
+rate_limiter.configure("openai", "runs", settings.openai_rate_runs,
+                       ["runs.create", "runs.submit_tool_outputs", "runs.cancel", "runs.stream"])
+rate_limiter.configure("openai", "run_polls", settings.openai_rate_run_polls, ["runs.retrieve"])
+rate_limiter.configure("fal", "submit", settings.fal_rate_submit, ["submit"])
+rate_limiter.configure("fal", "status", settings.fal_rate_status, ["status", "result", "cancel"])
+
+
+# --- Retry timing ---
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Seconds a response asks the client to wait (retry-after-ms, or Retry-After as seconds or an HTTP date)."""
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+    """
+    Delay before retry number `attempt` + 1: the provider's Retry-After if given, else
+    exponential backoff with full jitter. None if Retry-After exceeds RATE_LIMIT_MAX_RETRY_DELAY.
+    """
+    if retry_after is not None:
+        return retry_after if retry_after <= settings.rate_limit_max_retry_delay else None
+    return random.uniform(0, min(RETRY_MAX_BACKOFF, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+# --- OpenAI ---
+
+# Calls that create or change something: a 5xx or dropped connection may already have applied
+# them, so they are only retried when the API rejected them outright (429 / 503)
+_OPENAI_WRITES = {"threads.create", "messages.create", "runs.create", "runs.submit_tool_outputs", "runs.cancel"}
+# A retried stream would replay events the caller already consumed
+_OPENAI_NO_RETRY = {"runs.stream"}
+
+
+def _openai_retry_delay(method: str, error: Exception, attempt: int) -> Optional[float]:
+    if attempt >= settings.openai_max_retries or method in _OPENAI_NO_RETRY:
+        return None
+    status = error.status_code if isinstance(error, openai.APIStatusError) else None
+    if status == 429 and getattr(error, "code", None) == "insufficient_quota":
+        return None
+    if status not in (429, 503) and (method in _OPENAI_WRITES or (status is not None and status < 500)):
+        return None
+    retry_after = retry_after_seconds(error.response.headers) if isinstance(error, openai.APIStatusError) else None
+    if status == 429 and retry_after:
+        rate_limiter.pause("openai", method, retry_after)
+    return retry_delay(attempt, retry_after)
+
+
+def _openai_outage(error: BaseException) -> bool:
+    """Connection errors, timeouts and 5xx trip the OpenAI circuit; 4xx and 429 mean the API answered."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+
+async def openai_call(method: str, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking OpenAI client call in the executor behind its endpoint's rate limit,
+    retrying 429s and transient failures. Latency and outcome are recorded per attempt.
+    Raises CircuitOpenError without calling the API while the OpenAI circuit is open.
+    """
+    breaker = circuit_breakers.get("openai")
+    attempt = 0
+    while True:
+        await rate_limiter.acquire("openai", method)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with breaker.guard(_openai_outage), span(f"openai.{method}", root=False, attempt=attempt):
+                result = await to_thread(fn, *args, call=f"openai.{method}", **kwargs)
+            outcome = "ok"
+            return result
+        except (openai.APIStatusError, openai.APIConnectionError) as e:
+            delay = _openai_retry_delay(method, e, attempt)
+            if delay is None:
+                raise
+            outcome = "retry"
+            logger.warning(f"OpenAI {method} failed ({e.__class__.__name__}); retrying in {delay:.2f}s")
+        finally:
+            OPENAI_LATENCY.observe(time.perf_counter() - started, method)
+            OPENAI_REQUESTS.inc(method, outcome)
+        attempt += 1
+        await asyncio.sleep(delay)
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from openai import OpenAI
+from openai.types.beta.threads import Run
+from .rate_limiter import openai_call
+from .tracing import detached
+
+logger = logging.getLogger(__name__)
+
+
+class _PolledRun:
+    """Registry entry for one in-flight run and the handlers waiting on it."""
+    def __init__(self, thread_id: str, run_id: str, last_status: str, interval: float, now: float):
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.last_status = last_status
+        self.interval = interval
+        self.next_poll_at = now + interval
+        self.waiters: List[asyncio.Future] = []
+
+
+class RunStatusPoller:
+    """
+    Single shared poller for every in-flight Assistant run in the process.
+
+    Chat handlers register a (thread_id, run_id) pair with the status they last saw and
+    await a future. One background task retrieves due runs (with bounded concurrency),
+    backing off each run's interval while its status is unchanged, and resolves the
+    future with the new Run as soon as the status changes.
+    """
+    def __init__(self, client: OpenAI, min_interval: float, max_interval: float, backoff: float = 1.5, max_concurrency: int = 16):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = backoff
+        self.max_concurrency = max(1, max_concurrency)
+        self._runs: Dict[Tuple[str, str, str], _PolledRun] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._polls = 0
+
+    async def wait_for_status_change(self, thread_id: str, run_id: str, last_status: str, timeout: Optional[float] = None) -> Run:
+        """Waits until the run's status differs from `last_status` and returns the updated Run."""
+        loop = asyncio.get_running_loop()
+        key = (thread_id, run_id, last_status)
+        entry = self._runs.get(key)
+        if entry is None:
+            entry = _PolledRun(thread_id, run_id, last_status, self.min_interval, loop.time())
+            self._runs[key] = entry
+        future = loop.create_future()
+        entry.waiters.append(future)
+        self._ensure_running()
+
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            if future.cancelled():
+                # Timed out or caller cancelled: stop polling if nobody else is waiting
+                if future in entry.waiters:
+                    entry.waiters.remove(future)
+                if not entry.waiters and self._runs.get(key) is entry:
+                    del self._runs[key]
+
+    def _ensure_running(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            # Detached: the shared poll loop must not record into the trace of the request that started it
+            with detached():
+                self._task = asyncio.create_task(self._poll_loop())
+        else:
+            self._wakeup.set()  # New registration may be due before the current sleep ends
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def poll_bounded(entry: _PolledRun):
+            async with semaphore:
+                await self._poll(entry)
+
+        while self._runs:
+            now = loop.time()
+            due = [entry for entry in self._runs.values() if entry.next_poll_at <= now]
+            if due:
+                await asyncio.gather(*(poll_bounded(entry) for entry in due))
+                continue
+
+            next_poll_at = min(entry.next_poll_at for entry in self._runs.values())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, next_poll_at - now))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, entry: _PolledRun):
+        key = (entry.thread_id, entry.run_id, entry.last_status)
+        try:
+            self._polls += 1
+            run = await openai_call("runs.retrieve", self.client.beta.threads.runs.retrieve, thread_id=entry.thread_id, run_id=entry.run_id)
+        except Exception as e:
+            logger.error(f"Error polling run {entry.run_id} on thread {entry.thread_id}: {e}")
+            self._resolve(key, entry, exception=e)
+            return
+
+        if run.status != entry.last_status:
+            logger.info(f"Run {entry.run_id} status changed: {entry.last_status} -> {run.status}")
+            self._resolve(key, entry, run=run)
+        else:
+            entry.interval = min(entry.interval * self.backoff, self.max_interval)
+            entry.next_poll_at = asyncio.get_running_loop().time() + entry.interval
+
+    def _resolve(self, key: Tuple[str, str, str], entry: _PolledRun, run: Optional[Run] = None, exception: Optional[Exception] = None):
+        if self._runs.get(key) is entry:
+            del self._runs[key]
+        for waiter in entry.waiters:
+            if waiter.done():
+                continue
+            if exception is not None:
+                waiter.set_exception(exception)
+            else:
+                waiter.set_result(run)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_runs": len(self._runs),
+            "waiters": sum(len(entry.waiters) for entry in self._runs.values()),
+            "total_polls": self._polls,
+        }
@@ -0,0 +1,227 @@
+"""
+Webhook-driven generation state machine for canvas scenes.
+
+    pending_generation -> generating_image -> generating_video -> completed
+                                 |                   |
+                                 +-------------------+-------> failed
+
+With FAL_WEBHOOK_URL set, the pipeline only starts a scene: it submits the Fal job with a
+callback URL and moves on. Fal POSTs the outcome to /api/webhooks/fal and the callback
+advances the scene right away: an image result is stored and the video job submitted in
+the same request, and a video result completes the scene. Nothing polls and no worker
+sits waiting on a job.
+
+Every transition is a conditional PATCH on the scene's current status and the Fal
+request it is waiting on, so a callback Fal delivers twice, or one from a superseded job,
+matches no row and is ignored. Callbacks must carry FAL_WEBHOOK_SECRET (webhooks stay
+disabled without one) and the request_id of the job the scene waits on.
+"""
+import asyncio
+import hmac
+import logging
+from typing import Any, Dict, Optional
+from urllib.parse import urlencode
+from ..config import settings
+from ..supabase_repository import SupabaseRepository
+from .agent_service import (
+    IMAGE_RESULT_COLUMNS, image_generation_request, image_output_url, video_generation_request, video_output_url
+)
+from .fal_client import get_fal_client
+from .metrics import PIPELINE_SCENES, SCENE_CALLBACKS
+from .pipeline_runner import STAGE_IMAGE_GENERATED, _utc_now_iso
+from .snapshot_cache import snapshot_cache
+from .tracing import current_span, span
+
+logger = logging.getLogger(__name__)
+
+STAGE_IMAGE = "image"
+STAGE_VIDEO = "video"
+# Scene status while each stage's job runs
+STAGE_STATUSES = {STAGE_IMAGE: "generating_image", STAGE_VIDEO: "generating_video"}
+
+# Image version the pipeline generates
+PIPELINE_IMAGE_VERSION = "v2"
+# A callback can beat the submitter recording its request_id on the scene; it is retried
+# this many times, this many seconds apart, before Fal is asked to redeliver it
+EARLY_CALLBACK_RETRIES = 5
+EARLY_CALLBACK_DELAY = 0.2
+
+
+class CallbackNotReady(Exception):
+    """The scene is not waiting on the callback's request yet (its submit is still being recorded)."""
+
+
+class SceneGenerationMachine:
+    def __init__(self, webhook_url: Optional[str], webhook_secret: Optional[str]):
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        if webhook_url and not webhook_secret:
+            logger.error("FAL_WEBHOOK_URL is set without FAL_WEBHOOK_SECRET; Fal webhooks stay disabled.")
+        self.started = 0
+        self.submit_failures = 0
+        self.callbacks_applied = 0
+        self.callbacks_ignored = 0
+
+    @property
+    def enabled(self) -> bool:
+        # Without a secret anyone could post results for any scene
+        return bool(self.webhook_url and self.webhook_secret)
+
+    def verify(self, token: Optional[str]) -> bool:
+        """Checks a callback's token against FAL_WEBHOOK_SECRET."""
+        if not self.webhook_secret:
+            return False
+        return token is not None and hmac.compare_digest(token, self.webhook_secret)
+
+    def _callback_url(self, scene_id: str, stage: str) -> str:
+        params = {"scene_id": scene_id, "stage": stage, "token": self.webhook_secret}
+        separator = "&" if "?" in self.webhook_url else "?"
+        return f"{self.webhook_url}{separator}{urlencode(params)}"
+
+    @staticmethod
+    def _awaiting_callback() -> Dict[str, Any]:
+        # No pipeline task heartbeats a scene that waits on Fal; stamping the heartbeat ahead
+        # keeps recovery off it until the job would have timed out
+        ahead = max(0.0, settings.fal_job_timeout - settings.pipeline_scene_lease_seconds)
+        return {"pipeline_heartbeat_at": _utc_now_iso(ahead)}
+
+    # --- Transitions ---
+
+    async def start(self, repository: SupabaseRepository, scene: Dict[str, Any]) -> bool:
+        """
+        Claims a pending scene and submits its first job: the image, or the video when its
+        image stage already completed. Returns False if the scene was no longer pending.
+        """
+        scene_id = scene["id"]
+        resume_from_video = scene.get("pipeline_stage") == STAGE_IMAGE_GENERATED
+        if not resume_from_video and not scene.get("image_prompt"):
+            logger.warning(f"Scene {scene_id} has no image_prompt. Skipping image generation.")
+            return await self._fail(repository, scene_id, "pending_generation", "Missing image prompt")
+
+        stage = STAGE_VIDEO if resume_from_video else STAGE_IMAGE
+        with span("scene.start", root=False, scene_id=scene_id, stage=stage):
+            claimed = await repository.transition_scene(
+                scene_id, "pending_generation",
+                {"status": STAGE_STATUSES[stage], "pending_generation_id": None, **self._awaiting_callback()}
+            )
+            if claimed is None:
+                logger.info(f"Scene {scene_id} is no longer pending; not starting it.")
+                return False
+            snapshot_cache.apply_scene_update(scene_id, claimed)
+            self.started += 1
+            await self._submit(repository, claimed, stage)
+            return True
+
+    async def handle_callback(self, repository: SupabaseRepository, scene_id: str, stage: str, body: Dict[str, Any]) -> bool:
+        """
+        Applies a Fal webhook for `stage` of the scene. Returns False if the callback no
+        longer applies (duplicate delivery, superseded job, scene moved on). Raises
+        CallbackNotReady if the scene's submit has not recorded the request yet.
+        """
+        request_id = body["request_id"]
+        status = STAGE_STATUSES[stage]
+        output = body.get("payload") or {}
+        url = image_output_url(output) if stage == STAGE_IMAGE else video_output_url(output)
+
+        with span("scene.callback", scene_id=scene_id, stage=stage, request_id=request_id):
+            if body.get("status") != "OK" or not url:
+                error = body.get("error") or output.get("detail") or f"Fal returned no {stage}"
+                applied = await self._fail(repository, scene_id, status, f"{stage.capitalize()} generation failed: {error}", request_id)
+            elif stage == STAGE_IMAGE:
+                row = await repository.transition_scene(scene_id, status, {
+                    IMAGE_RESULT_COLUMNS[PIPELINE_IMAGE_VERSION]: url,
+                    "image_url": url,
+                    "status": STAGE_STATUSES[STAGE_VIDEO],
+                    "pipeline_stage": STAGE_IMAGE_GENERATED,
+                    "pending_generation_id": None,
+                    **self._awaiting_callback(),
+                }, generation_id=request_id)
+                applied = row is not None
+                if row is not None:
+                    snapshot_cache.apply_scene_update(scene_id, row)
+                    # Start the next stage within this callback: no idle gap between stages
+                    await self._submit(repository, row, STAGE_VIDEO)
+            else:
+                row = await repository.transition_scene(scene_id, status, {
+                    "video_url": url,
+                    "status": "completed",
+                    "error_message": None,
+                    "pipeline_stage": None,
+                    "pending_generation_id": None,
+                }, generation_id=request_id)
+                applied = row is not None
+                if row is not None:
+                    snapshot_cache.apply_scene_update(scene_id, row)
+                    PIPELINE_SCENES.inc("completed")
+                    logger.info(f"Scene {scene_id} completed.")
+
+            if not applied and await self._awaiting_record(repository, scene_id, status):
+                # Redo the transition once the submitter has recorded request_id
+                for _ in range(EARLY_CALLBACK_RETRIES):
+                    await asyncio.sleep(EARLY_CALLBACK_DELAY)
+                    if not await self._awaiting_record(repository, scene_id, status):
+                        return await self.handle_callback(repository, scene_id, stage, body)
+                raise CallbackNotReady(f"Scene {scene_id} is not waiting on request {request_id} yet.")
+
+            current_span().set_attribute("applied", applied)
+        if applied:
+            self.callbacks_applied += 1
+        else:
+            self.callbacks_ignored += 1
+            logger.info(f"Ignored {stage} callback for scene {scene_id} (request {request_id}); the scene has moved on.")
+        SCENE_CALLBACKS.inc(stage, "applied" if applied else "ignored")
+        return applied
+
+    async def _submit(self, repository: SupabaseRepository, scene: Dict[str, Any], stage: str):
+        """Submits the stage's job with a callback URL and records it as the generation the scene waits on."""
+        scene_id = scene["id"]
+        status = STAGE_STATUSES[stage]
+        try:
+            if stage == STAGE_IMAGE:
+                if not scene.get("product_image_url"):
+                    raise ValueError(f"Product image URL not found for scene {scene_id}.")
+                model, payload, _ = image_generation_request(scene, scene["image_prompt"], PIPELINE_IMAGE_VERSION)
+            else:
+                if not scene.get("image_url") or not scene.get("description"):
+                    raise ValueError(f"Image URL or description not found for scene {scene_id}.")
+                model, payload = video_generation_request(scene)
+            submitted = await get_fal_client().submit(model, payload, webhook_url=self._callback_url(scene_id, stage))
+        except Exception as e:
+            self.submit_failures += 1
+            logger.error(f"Failed to submit {stage} generation for scene {scene_id}: {e}")
+            await self._fail(repository, scene_id, status, f"{stage.capitalize()} generation failed: {e}")
+            return
+
+        request_id = submitted["request_id"]
+        logger.info(f"Submitted {stage} generation for scene {scene_id} (request {request_id}).")
+        # Only while no other job is recorded; a fast job's callback waits for this (see handle_callback)
+        await repository.transition_scene(scene_id, status, {"pending_generation_id": request_id}, unassigned=True)
+
+    @staticmethod
+    async def _awaiting_record(repository: SupabaseRepository, scene_id: str, status: str) -> bool:
+        """True if the scene is in `status` but its submit has not recorded a request_id yet."""
+        scene = await repository.get_scene(scene_id, "status,pending_generation_id")
+        return bool(scene) and scene.get("status") == status and not scene.get("pending_generation_id")
+
+    async def _fail(self, repository: SupabaseRepository, scene_id: str, from_status: str, message: str,
+                    generation_id: Optional[str] = None) -> bool:
+        data = {"status": "failed", "error_message": message, "pipeline_stage": None, "pending_generation_id": None}
+        row = await repository.transition_scene(scene_id, from_status, data, generation_id=generation_id)
+        if row is None:
+            return False
+        snapshot_cache.apply_scene_update(scene_id, data)
+        PIPELINE_SCENES.inc("failed")
+        logger.error(f"Scene {scene_id} failed: {message}")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "scenes_started": self.started,
+            "submit_failures": self.submit_failures,
+            "callbacks_applied": self.callbacks_applied,
+            "callbacks_ignored": self.callbacks_ignored,
+        }
+
+
+scene_state_machine = SceneGenerationMachine(settings.fal_webhook_url, settings.fal_webhook_secret)
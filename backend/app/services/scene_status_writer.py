@@ -0,0 +1,186 @@
+import asyncio
+import atexit
+import json
+import logging
+import weakref
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+from ..config import settings
+from ..supabase_repository import SupabaseRepository
+
+logger = logging.getLogger(__name__)
+
+# Writers with buffered updates, flushed synchronously at interpreter exit
+_live_writers: "weakref.WeakSet[SceneStatusWriter]" = weakref.WeakSet()
+
+
+class SceneStatusWriter:
+    """
+    Coalescing sink for canvas_scenes status updates.
+
+    `update_scene` buffers the update and returns immediately. Updates for the same scene
+    inside one flush window are merged (later fields win), and each flush writes every
+    group of scenes sharing an identical payload with a single bulk PATCH.
+
+    Ordering: at most one flush runs at a time and a scene's buffered update always holds
+    its latest state, so the row never ends up with an older transition than one submitted
+    after it. `flush()` is a barrier: everything submitted before it is written when it returns.
+    Failed updates are retried a flush window apart; one that still fails after
+    `max_retries` flushes is dropped and its scene ID passed to `on_drop`.
+    """
+    def __init__(self, repository: SupabaseRepository, flush_interval: Optional[float] = None,
+                 timestamp_field: Optional[str] = None, max_retries: Optional[int] = None,
+                 on_drop: Optional[Callable[[List[str]], None]] = None):
+        self._repository = repository
+        self._on_drop = on_drop
+        self.flush_interval = flush_interval if flush_interval is not None else settings.scene_status_flush_interval
+        # Column stamped with the flush time on every write (one value per flush keeps payloads groupable)
+        self.timestamp_field = timestamp_field
+        self.max_retries = max_retries if max_retries is not None else settings.scene_status_max_retries
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._failures: Dict[str, int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.writes = 0
+        self.scenes_written = 0
+        self.dropped = 0
+        _live_writers.add(self)
+
+    # Same signature as SupabaseRepository.update_scene so callers can use either
+    async def update_scene(self, scene_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        pending = self._pending.setdefault(scene_id, {})
+        pending.update(data)
+        self.submitted += 1
+        self._schedule_flush()
+        return dict(pending, id=scene_id)
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+        # Failed updates were requeued; retry them a window apart rather than spinning.
+        # (_schedule_flush cannot do it from here: this task is still the running one.)
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Writes all buffered updates now and waits for them to complete."""
+        async with self._flush_lock:
+            while self._pending:
+                batch, self._pending = self._pending, {}
+                if not await self._write_batch(self._repository, batch):
+                    # Failed updates were requeued; the background flush retries them after a window
+                    self._schedule_flush()
+                    break
+
+    async def _write_batch(self, repository: SupabaseRepository, batch: Dict[str, Dict[str, Any]]) -> bool:
+        """Writes one batch; returns False if any group failed (and was requeued)."""
+        stamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ") if self.timestamp_field else None
+
+        # Group scenes whose merged payloads are identical into one request each
+        groups: Dict[str, List[str]] = {}
+        payloads: Dict[str, Dict[str, Any]] = {}
+        for scene_id, data in batch.items():
+            if stamp:
+                data = dict(data, **{self.timestamp_field: stamp})
+            key = json.dumps(data, sort_keys=True, default=str)
+            groups.setdefault(key, []).append(scene_id)
+            payloads[key] = data
+
+        ok = True
+        for key, scene_ids in groups.items():
+            try:
+                await repository.update_scenes(scene_ids, payloads[key])
+                self.writes += 1
+                self.scenes_written += len(scene_ids)
+                for scene_id in scene_ids:
+                    self._failures.pop(scene_id, None)
+                logger.info(f"Flushed status update for {len(scene_ids)} scene(s): {payloads[key].get('status')}")
+            except Exception as e:
+                logger.error(f"Failed to flush status update for scenes {scene_ids}: {e}")
+                self._requeue_failed(scene_ids, batch)
+                ok = False
+        return ok
+
+    def _requeue_failed(self, scene_ids: List[str], batch: Dict[str, Dict[str, Any]]):
+        """Puts failed updates back underneath anything submitted since, unless retries are exhausted."""
+        dropped = []
+        for scene_id in scene_ids:
+            attempts = self._failures.get(scene_id, 0) + 1
+            if attempts > self.max_retries:
+                self._failures.pop(scene_id, None)
+                logger.error(f"Dropping status update for scene {scene_id} after {attempts} failed flushes: {batch[scene_id]}")
+                dropped.append(scene_id)
+                continue
+            self._failures[scene_id] = attempts
+            self._pending[scene_id] = {**batch[scene_id], **self._pending.get(scene_id, {})}
+        self._dropped(dropped)
+
+    def _dropped(self, scene_ids: List[str]):
+        if not scene_ids:
+            return
+        self.dropped += len(scene_ids)
+        if self._on_drop is not None:
+            self._on_drop(scene_ids)
+
+    async def close(self):
+        """Flushes everything still buffered (retrying failures) and stops the background flush."""
+        await self.flush()
+        while self._pending:
+            # Entries are dropped after max_retries failed flushes, so this terminates
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        _live_writers.discard(self)
+
+    def flush_sync(self, repository_factory: Optional[Callable[[httpx.AsyncClient], SupabaseRepository]] = None):
+        """
+        Blocking flush for interpreter exit, when the writer's event loop (and its pooled HTTP
+        client) is already gone. Uses a short-lived client on a fresh loop.
+        """
+        if not self._pending:
+            return
+        factory = repository_factory or _service_repository
+
+        async def _flush_with_fresh_client():
+            async with httpx.AsyncClient(timeout=settings.supabase_timeout) as client:
+                repository = factory(client)
+                while self._pending:
+                    batch, self._pending = self._pending, {}
+                    await self._write_batch(repository, batch)
+                    # No retries at exit: anything requeued by a failure is dropped
+                    if self._pending:
+                        logger.error(f"Dropping {len(self._pending)} unflushed scene status update(s) at exit.")
+                        self._dropped(list(self._pending))
+                        self._pending = {}
+
+        try:
+            asyncio.run(_flush_with_fresh_client())
+        except Exception as e:
+            logger.error(f"Synchronous scene status flush failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "submitted": self.submitted,
+            "writes": self.writes,
+            "scenes_written": self.scenes_written,
+            "dropped": self.dropped,
+        }
+
+
+def _service_repository(client: httpx.AsyncClient) -> SupabaseRepository:
+    return SupabaseRepository(client, settings.supabase_url, settings.supabase_service_role_key or settings.supabase_key)
+
+
+@atexit.register
+def _flush_writers_at_exit():
+    for writer in list(_live_writers):
+        writer.flush_sync()
@@ -0,0 +1,121 @@
+import copy
+import logging
+from typing import Any, Dict, Iterable, Optional
+from ..config import settings
+from ..supabase_repository import SupabaseRepository
+from .caching import SingleFlight, TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotCache:
+    """
+    Read-through cache of canvas_scenes rows and project (+ scene list) snapshots.
+
+    Scene rows are cached whole ("*") and projected to the requested columns on read, so
+    one fetch serves every caller. Writers invalidate explicitly; the TTL only bounds how
+    long an edit made through another path (frontend, Supabase functions) can stay invisible.
+    Concurrent misses for the same key share one query.
+    """
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self._scenes: TTLCache[Dict[str, Any]] = TTLCache(max_size, ttl=ttl)
+        self._projects: TTLCache[Dict[str, Any]] = TTLCache(max_size, ttl=ttl)
+        # scene_id -> project_id for scenes seen in either cache, so a scene write can
+        # invalidate the project snapshot that lists it
+        self._scene_projects: TTLCache[str] = TTLCache(max_size * 4)
+        self._singleflight = SingleFlight()
+        self.invalidations = 0
+
+    # --- Reads ---
+
+    async def get_scene(self, repository: SupabaseRepository, scene_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        """Returns the scene (limited to `columns`) from cache, fetching the full row on a miss."""
+        wanted = [c.strip() for c in columns.split(",")] if columns.strip() != "*" else None
+        row = self._scenes.get(scene_id)
+        if row is None or (wanted and any(c not in row for c in wanted)):
+            row = await self._singleflight.do(("scene", scene_id), lambda: self._load_scene(repository, scene_id))
+        if row is None:
+            return None
+        return {c: copy.deepcopy(row.get(c)) for c in wanted} if wanted else copy.deepcopy(row)
+
+    async def _load_scene(self, repository: SupabaseRepository, scene_id: str) -> Optional[Dict[str, Any]]:
+        row = await repository.get_scene(scene_id, "*")
+        if row is not None:
+            self.put_scenes([row])
+        return row
+
+    async def get_project_with_scenes(self, repository: SupabaseRepository, project_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the project with its scene list (id, title, scene_order), cached per project."""
+        snapshot = self._projects.get(project_id)
+        if snapshot is None:
+            snapshot = await self._singleflight.do(("project", project_id), lambda: self._load_project(repository, project_id))
+        return copy.deepcopy(snapshot) if snapshot is not None else None
+
+    async def _load_project(self, repository: SupabaseRepository, project_id: str) -> Optional[Dict[str, Any]]:
+        snapshot = await repository.get_project_with_scenes(project_id)
+        if snapshot is not None:
+            self._projects.set(project_id, snapshot)
+            for scene in snapshot.get("canvas_scenes") or []:
+                if scene.get("id"):
+                    self._scene_projects.set(scene["id"], project_id)
+        return snapshot
+
+    def put_scenes(self, rows: Iterable[Dict[str, Any]]):
+        """Primes the cache with full scene rows a caller already loaded (e.g. the pipeline)."""
+        for row in rows:
+            scene_id = row.get("id")
+            if not scene_id:
+                continue
+            self._scenes.set(scene_id, copy.deepcopy(row))
+            if row.get("project_id"):
+                self._scene_projects.set(scene_id, row["project_id"])
+
+    # --- Writes / invalidation ---
+
+    def apply_scene_update(self, scene_id: str, data: Dict[str, Any]):
+        """
+        Write-through for an update whose values are fully known (e.g. pipeline status
+        transitions): patches the cached row instead of evicting it, and drops the
+        containing project snapshot.
+        """
+        row = self._scenes.get(scene_id)
+        if row is not None:
+            row.update(copy.deepcopy(data))
+        project_id = self._scene_projects.get(scene_id)
+        if project_id:
+            self._projects.invalidate(project_id)
+        self.invalidations += 1
+
+    def invalidate_scene(self, scene_id: str):
+        """Drops a scene and the snapshot of the project that contains it (if known)."""
+        self.invalidate_scenes([scene_id])
+
+    def invalidate_scenes(self, scene_ids: Iterable[str]):
+        for scene_id in scene_ids:
+            self._scenes.invalidate(scene_id)
+            project_id = self._scene_projects.get(scene_id)
+            if project_id:
+                self._projects.invalidate(project_id)
+            self.invalidations += 1
+
+    def invalidate_project(self, project_id: str):
+        """Drops a project snapshot (e.g. after scenes were added to it)."""
+        self._projects.invalidate(project_id)
+        self.invalidations += 1
+
+    def clear(self):
+        self._scenes.clear()
+        self._projects.clear()
+        self._scene_projects.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "scenes": self._scenes.stats(),
+            "projects": self._projects.stats(),
+            "invalidations": self.invalidations,
+            "in_flight": self._singleflight.in_flight(),
+        }
+
+
+# Shared by the agent tools and the generation pipeline
+snapshot_cache = SnapshotCache(settings.snapshot_cache_size, ttl=settings.snapshot_cache_ttl)
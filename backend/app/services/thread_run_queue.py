@@ -0,0 +1,204 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Batch:
+    """User messages that will be sent together and answered by a single run."""
+    def __init__(self):
+        self.messages: List[str] = []
+        self.enqueued_at: List[float] = []
+        self.closed = False  # set once the batch starts running; later messages open a new batch
+        self.future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+
+
+class _ThreadState:
+    def __init__(self):
+        # Completes when the most recently reserved turn finishes. Turns are reserved
+        # synchronously on arrival, so they run strictly in arrival order.
+        self.tail: Optional["asyncio.Future[None]"] = None
+        self.running = False
+        self.pending: Optional[_Batch] = None
+        self.waiting_batches = 0
+        self.waiting_messages = 0
+        self.users = 0
+
+
+class ThreadRunQueue:
+    """
+    Serializes Assistant runs per OpenAI thread (the API rejects a second active run on a
+    thread), while different threads proceed in parallel.
+
+    Messages that arrive while a thread is busy are merged into the next run (up to
+    `max_merge` per run); every caller in a merged batch receives that run's result.
+    Streaming requests cannot share a run, so they take an exclusive turn instead.
+    """
+    def __init__(self, max_merge: int = 10):
+        self.max_merge = max(1, max_merge)
+        self._threads: Dict[str, _ThreadState] = {}
+        self.runs = 0
+        self.merged_messages = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waits = 0
+
+    def _acquire_state(self, thread_id: str) -> _ThreadState:
+        state = self._threads.get(thread_id)
+        if state is None:
+            state = self._threads[thread_id] = _ThreadState()
+        state.users += 1
+        return state
+
+    def _release_state(self, thread_id: str, state: _ThreadState):
+        state.users -= 1
+        if state.users == 0 and self._threads.get(thread_id) is state:
+            del self._threads[thread_id]
+
+    @staticmethod
+    def _reserve_turn(state: _ThreadState):
+        previous = state.tail
+        mine: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        state.tail = mine
+        return previous, mine
+
+    @staticmethod
+    async def _wait_turn(previous: Optional["asyncio.Future[None]"], mine: "asyncio.Future[None]"):
+        if previous is not None and not previous.done():
+            await asyncio.shield(previous)
+
+    @staticmethod
+    def _end_turn(state: _ThreadState, previous: Optional["asyncio.Future[None]"], mine: "asyncio.Future[None]"):
+        def _finish(_=None):
+            if not mine.done():
+                mine.set_result(None)
+            if state.tail is mine:
+                state.tail = None
+
+        if previous is not None and not previous.done():
+            # Cancelled while waiting: give up the turn without letting later turns
+            # overtake the ones still ahead of it
+            previous.add_done_callback(_finish)
+            return
+        state.running = False
+        _finish()
+
+    def _record_wait(self, enqueued_at: float):
+        waited = time.monotonic() - enqueued_at
+        self.waits += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def submit(self, thread_id: str, message: str, run_fn: Callable[[List[str]], Awaitable[T]]) -> T:
+        """
+        Queues `message` for the thread and returns the result of the run that answers it.
+        `run_fn(messages)` adds the messages to the thread and performs one run; the run_fn
+        of the caller that opened the batch is used for the whole batch.
+        """
+        state = self._acquire_state(thread_id)
+        try:
+            batch = state.pending
+            if batch is None or batch.closed or len(batch.messages) >= self.max_merge:
+                batch = state.pending = _Batch()
+                state.waiting_batches += 1
+                # The batch runs in its own task so a disconnecting caller cannot cancel
+                # the run other callers are waiting on. Its hold on the thread state is
+                # taken here, before the task starts, so the state cannot be dropped meanwhile.
+                state.users += 1
+                turn = self._reserve_turn(state)
+                asyncio.ensure_future(self._run_batch(thread_id, state, batch, run_fn, turn))
+            elif len(batch.messages) == 1:
+                logger.info(f"Thread {thread_id} is busy; merging queued messages into its next run")
+            batch.messages.append(message)
+            batch.enqueued_at.append(time.monotonic())
+            state.waiting_messages += 1
+            return await asyncio.shield(batch.future)
+        finally:
+            self._release_state(thread_id, state)
+
+    async def _run_batch(self, thread_id: str, state: _ThreadState, batch: _Batch,
+                         run_fn: Callable[[List[str]], Awaitable[Any]], turn):
+        previous, mine = turn
+        try:
+            await self._wait_turn(previous, mine)
+            state.running = True
+            batch.closed = True
+            if state.pending is batch:
+                state.pending = None
+            state.waiting_batches -= 1
+            state.waiting_messages -= len(batch.messages)
+            for enqueued_at in batch.enqueued_at:
+                self._record_wait(enqueued_at)
+            self.runs += 1
+            if len(batch.messages) > 1:
+                self.merged_messages += len(batch.messages) - 1
+                logger.info(f"Running {len(batch.messages)} merged messages in one run on thread {thread_id}")
+            try:
+                batch.future.set_result(await run_fn(list(batch.messages)))
+            except BaseException as e:
+                batch.future.set_exception(e)
+                # Retrieve the exception here so an unawaited batch does not log a warning
+                batch.future.exception()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+        finally:
+            if not batch.future.done():
+                # Cancelled before the run started; fail the waiting callers instead of hanging them
+                batch.future.set_exception(asyncio.CancelledError())
+                batch.future.exception()
+            self._end_turn(state, previous, mine)
+            self._release_state(thread_id, state)
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, thread_id: str) -> AsyncIterator[None]:
+        """Waits for the thread's turn and holds it for the duration (no merging)."""
+        state = self._acquire_state(thread_id)
+        enqueued_at = time.monotonic()
+        # Close the open batch so messages arriving after this request queue behind it
+        if state.pending is not None:
+            state.pending.closed = True
+            state.pending = None
+        state.waiting_batches += 1
+        state.waiting_messages += 1
+        counted = True
+        previous, mine = self._reserve_turn(state)
+        try:
+            await self._wait_turn(previous, mine)
+            state.running = True
+            state.waiting_batches -= 1
+            state.waiting_messages -= 1
+            counted = False
+            self._record_wait(enqueued_at)
+            self.runs += 1
+            yield
+        finally:
+            if counted:
+                state.waiting_batches -= 1
+                state.waiting_messages -= 1
+            self._end_turn(state, previous, mine)
+            self._release_state(thread_id, state)
+
+    def depth(self, thread_id: str) -> int:
+        """Messages waiting on the thread, plus one if a run currently holds it."""
+        state = self._threads.get(thread_id)
+        if state is None:
+            return 0
+        return state.waiting_messages + (1 if state.running else 0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threads": len(self._threads),
+            "busy_threads": sum(1 for s in self._threads.values() if s.running),
+            "queued_runs": sum(s.waiting_batches for s in self._threads.values()),
+            "queued_messages": sum(s.waiting_messages for s in self._threads.values()),
+            "depth_by_thread": {t: s.waiting_messages for t, s in self._threads.items() if s.waiting_messages},
+            "runs": self.runs,
+            "merged_messages": self.merged_messages,
+            "avg_wait_seconds": round(self.total_wait / self.waits, 4) if self.waits else 0.0,
+            "max_wait_seconds": round(self.max_wait, 4),
+        }
@@ -0,0 +1,230 @@
+import functools
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Validator: (value, path, errors) -> None, appending human-readable problems to `errors`
+Validator = Callable[[Any, str, List[str]], None]
+
+_JSON_TYPES = {
+    "object": (dict,),
+    "array": (list,),
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+}
+
+
+class ToolValidationError(ValueError):
+    """Raised when tool call arguments do not match the tool's parameter schema."""
+    def __init__(self, tool_name: str, errors: List[str]):
+        super().__init__(f"Invalid arguments for tool {tool_name}: {'; '.join(errors)}")
+        self.tool_name = tool_name
+        self.errors = errors
+
+
+class UnknownToolError(LookupError):
+    """Raised when the model calls a tool that is not registered."""
+
+
+def compile_validator(schema: Dict[str, Any]) -> Validator:
+    """
+    Compiles the JSON Schema subset used by Assistant function parameters (type, properties,
+    required, items, enum) into a closure, so validating a call does not re-walk the schema.
+    """
+    checks: List[Validator] = []
+
+    expected = schema.get("type")
+    if expected in _JSON_TYPES:
+        python_types = _JSON_TYPES[expected]
+
+        def check_type(value, path, errors):
+            # bool is an int subclass; JSON booleans are not numbers
+            if not isinstance(value, python_types) or (isinstance(value, bool) and expected != "boolean"):
+                errors.append(f"{path or 'arguments'} must be of type {expected}")
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path, errors):
+            if value not in allowed:
+                errors.append(f"{path} must be one of {allowed}")
+        checks.append(check_enum)
+
+    if expected == "object":
+        required = list(schema.get("required", []))
+        properties = {name: compile_validator(sub) for name, sub in schema.get("properties", {}).items()}
+
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in required:
+                if name not in value:
+                    errors.append(f"missing required argument {path + '.' if path else ''}{name}")
+            for name, validate in properties.items():
+                if name in value:
+                    validate(value[name], f"{path}.{name}" if path else name, errors)
+        checks.append(check_object)
+
+    if expected == "array" and "items" in schema:
+        validate_item = compile_validator(schema["items"])
+
+        def check_items(value, path, errors):
+            if not isinstance(value, list):
+                return
+            for index, item in enumerate(value):
+                validate_item(item, f"{path}[{index}]", errors)
+        checks.append(check_items)
+
+    def validate(value, path, errors):
+        for check in checks:
+            check(value, path, errors)
+    return validate
+
+
+class ToolStats:
+    """Per-tool call counters and latency."""
+    __slots__ = ("calls", "errors", "failures", "invalid", "cancelled", "total_seconds", "max_seconds", "last_error")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0      # raised an exception
+        self.failures = 0    # returned an error result to the model
+        self.invalid = 0     # rejected by argument validation
+        self.cancelled = 0   # cancelled, e.g. by its deadline
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        completed = self.calls - self.invalid
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "failures": self.failures,
+            "invalid": self.invalid,
+            "cancelled": self.cancelled,
+            "avg_seconds": round(self.total_seconds / completed, 4) if completed else 0.0,
+            "max_seconds": round(self.max_seconds, 4),
+            "last_error": self.last_error,
+        }
+
+
+class ToolSpec:
+    def __init__(self, name: str, description: str, parameters: Dict[str, Any],
+                 handler: Callable[..., Awaitable[str]], timeout: Optional[float]):
+        self.name = name
+        self.handler = handler
+        self.timeout = timeout
+        self.definition = {
+            "type": "function",
+            "function": {"name": name, "description": description, "parameters": parameters},
+        }
+        self.validator = compile_validator(parameters)
+        self.stats = ToolStats()
+
+
+class ToolRegistry:
+    """
+    Declarative registry of Assistant function tools.
+
+    Methods register themselves with `@registry.tool(name, description, parameters)`. The
+    tool definitions list sent with every run is built once, argument validators are
+    compiled at registration, and dispatch is a dict lookup.
+    """
+    def __init__(self):
+        self._tools: Dict[str, ToolSpec] = {}
+        self._definitions: Optional[List[Dict[str, Any]]] = None
+
+    def tool(self, name: str, description: str, parameters: Dict[str, Any], timeout: Optional[float] = None):
+        """
+        Decorator registering an async method as the handler for tool `name`. The method is
+        wrapped in a `tool.<name>` span, including when called directly (e.g. by the pipeline).
+        """
+        def register(handler: Callable[..., Awaitable[str]]):
+            if name in self._tools:
+                raise ValueError(f"Tool {name} is already registered.")
+
+            @functools.wraps(handler)
+            async def traced_handler(*args, **kwargs):
+                with span(f"tool.{name}") as tool_span:
+                    result = await handler(*args, **kwargs)
+                    if self._is_error_result(result):
+                        tool_span.set_attribute("tool_error", True)
+                    return result
+
+            self._tools[name] = ToolSpec(name, description, parameters, traced_handler, timeout)
+            self._definitions = None
+            return traced_handler
+        return register
+
+    def definitions(self) -> List[Dict[str, Any]]:
+        """Tool definitions for runs.create / runs.stream (built once, shared; do not mutate)."""
+        if self._definitions is None:
+            self._definitions = [spec.definition for spec in self._tools.values()]
+        return self._definitions
+
+    def timeout_for(self, name: str, default: float) -> float:
+        spec = self._tools.get(name)
+        return spec.timeout if spec is not None and spec.timeout is not None else default
+
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    async def dispatch(self, instance: Any, name: str, arguments: Dict[str, Any]) -> str:
+        """
+        Validates `arguments` and awaits the tool's handler bound to `instance`.
+        Raises UnknownToolError / ToolValidationError before anything runs.
+        """
+        spec = self._tools.get(name)
+        if spec is None:
+            raise UnknownToolError(name)
+
+        stats = spec.stats
+        stats.calls += 1
+        errors: List[str] = []
+        spec.validator(arguments, "", errors)
+        if errors:
+            stats.invalid += 1
+            stats.last_error = "; ".join(errors)
+            raise ToolValidationError(name, errors)
+
+        started = time.perf_counter()
+        try:
+            result = await spec.handler(instance, **arguments)
+        except Exception as e:
+            stats.errors += 1
+            stats.last_error = str(e)
+            raise
+        except BaseException:
+            stats.cancelled += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+        if self._is_error_result(result):
+            stats.failures += 1
+            stats.last_error = str(result)[:500]
+        return result
+
+    @staticmethod
+    def _is_error_result(result: Any) -> bool:
+        # Tools report failures as JSON ({"success": false, ...} or {"error": ...})
+        if not isinstance(result, str) or not result.startswith("{"):
+            return False
+        try:
+            payload = json.loads(result)
+        except ValueError:
+            return False
+        return isinstance(payload, dict) and (payload.get("success") is False or "error" in payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: spec.stats.as_dict() for name, spec in self._tools.items()}
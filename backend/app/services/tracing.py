@@ -0,0 +1,298 @@
+"""
+Lightweight in-process span tracing.
+
+The current span lives in a contextvar, so it follows awaits, asyncio tasks created while
+it is active (gather, ensure_future) and asyncio.to_thread calls. Every span of a trace is
+recorded (a few attribute writes); whether the finished trace is kept is decided when its
+root span ends: sampled at TRACE_SAMPLE_RATE, and always kept if it failed or took longer
+than TRACE_SLOW_MS. Kept traces go to an in-memory ring buffer (GET /debug/traces) and,
+if TRACE_EXPORT_PATH is set, are appended to that file as JSON lines (one span per line)
+by a background thread, so a slow disk never blocks the event loop.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Spans recorded per trace; a long pipeline run stops recording leaf spans past this
+MAX_SPANS_PER_TRACE = 2000
+# Kept traces waiting to be written to TRACE_EXPORT_PATH; beyond this they are dropped
+EXPORT_QUEUE_SIZE = 1000
+
+
+class _Trace:
+    """Spans of one trace, collected until the root span ends."""
+    __slots__ = ("trace_id", "spans", "closed", "errored", "dropped")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List["Span"] = []
+        self.closed = False
+        self.errored = False
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attributes", "start", "end", "_started", "status", "error")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.end: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        if self.end is None:
+            return (time.perf_counter() - self._started) * 1000
+        return (self.end - self.start) * 1000
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def _finish(self, error: Optional[BaseException]):
+        self.end = self.start + (time.perf_counter() - self._started)
+        if error is not None:
+            self.status = "error" if isinstance(error, Exception) else "cancelled"
+            self.error = f"{type(error).__name__}: {error}"
+            if self.status == "error":
+                self.trace.errored = True
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Returned when nothing is recorded, so callers can set attributes unconditionally."""
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    def __init__(self, sample_rate: float, slow_ms: float, buffer_size: int, export_path: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.export_path = export_path or None
+        self._traces: Deque[List[Dict[str, Any]]] = deque(maxlen=max(1, buffer_size))
+        self._export_queue: "queue.Queue[Optional[List[Dict[str, Any]]]]" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._export_thread: Optional[threading.Thread] = None
+        self._export_lock = threading.Lock()
+        self.started = 0
+        self.kept = 0
+        self.export_dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    @contextlib.contextmanager
+    def span(self, name: str, root: bool = True, **attributes: Any) -> Iterator[Any]:
+        """
+        Context manager recording a span under the current one. With no current span it
+        starts a new trace, unless `root` is False (used for leaf calls such as Supabase
+        queries, which are only interesting inside a traced request).
+        """
+        parent = _current_span.get()
+        if parent is not None and parent.trace.closed:
+            # Background task that outlived the trace it was started from
+            parent = None
+        if parent is None and (not root or not self.enabled):
+            yield _NOOP_SPAN
+            return
+
+        if parent is None:
+            trace = _Trace()
+            self.started += 1
+        else:
+            trace = parent.trace
+            if len(trace.spans) >= MAX_SPANS_PER_TRACE:
+                trace.dropped += 1
+                yield _NOOP_SPAN
+                return
+        span = Span(trace, name, parent.span_id if parent else None, attributes)
+        trace.spans.append(span)
+        token = _current_span.set(span)
+        error: Optional[BaseException] = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            span._finish(error)
+            if parent is None:
+                self._finish_trace(trace, span)
+
+    def _finish_trace(self, trace: _Trace, root: Span):
+        trace.closed = True
+        keep = (
+            trace.errored
+            or (self.slow_ms > 0 and root.duration_ms >= self.slow_ms)
+            or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        )
+        if not keep:
+            return
+        self.kept += 1
+        if trace.dropped:
+            root.attributes["dropped_spans"] = trace.dropped
+        spans = [s.as_dict() for s in trace.spans]
+        self._traces.append(spans)
+        if self.export_path:
+            self._export(spans)
+
+    def _export(self, spans: List[Dict[str, Any]]):
+        """Hands a kept trace to the export thread (started on first use)."""
+        if self._export_thread is None:
+            with self._export_lock:
+                if self._export_thread is None:
+                    self._export_thread = threading.Thread(target=self._export_worker, name="trace-export", daemon=True)
+                    self._export_thread.start()
+        try:
+            self._export_queue.put_nowait(spans)
+        except queue.Full:
+            self.export_dropped += 1
+
+    def _export_worker(self):
+        while True:
+            traces = [self._export_queue.get()]
+            # Write whatever else is waiting in the same append
+            while len(traces) < EXPORT_QUEUE_SIZE:
+                try:
+                    traces.append(self._export_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in traces
+            try:
+                lines = "".join(json.dumps(s, default=str) + "\n" for spans in traces if spans for s in spans)
+                if lines:
+                    with open(self.export_path, "a", encoding="utf-8") as f:
+                        f.write(lines)
+            except OSError as e:
+                logger.warning(f"Could not export traces to {self.export_path}: {e}")
+            if stop:
+                return
+
+    def close(self, timeout: float = 5.0):
+        """Writes the traces still queued for export and stops the export thread."""
+        with self._export_lock:
+            thread, self._export_thread = self._export_thread, None
+        if thread is None:
+            return
+        self._export_queue.put(None)
+        thread.join(timeout)
+
+    def recent(self, limit: int = 50, min_duration_ms: float = 0.0, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Most recent kept traces first, summarised by their root span."""
+        results = []
+        for spans in reversed(self._traces):
+            root = spans[0]
+            if root["duration_ms"] < min_duration_ms or (name and root["name"] != name):
+                continue
+            results.append({
+                "trace_id": root["trace_id"],
+                "name": root["name"],
+                "start": root["start"],
+                "duration_ms": root["duration_ms"],
+                "status": "error" if any(s["status"] == "error" for s in spans) else root["status"],
+                "span_count": len(spans),
+                "attributes": root["attributes"],
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+    def get_trace(self, trace_id: str) -> Optional[List[Dict[str, Any]]]:
+        for spans in self._traces:
+            if spans[0]["trace_id"] == trace_id:
+                return spans
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "export_path": self.export_path,
+            "traces_started": self.started,
+            "traces_kept": self.kept,
+            "buffered": len(self._traces),
+            "export_queued": self._export_queue.qsize(),
+            "export_dropped": self.export_dropped,
+        }
+
+
+tracer = Tracer(
+    settings.trace_sample_rate,
+    settings.trace_slow_ms,
+    settings.trace_buffer_size,
+    os.path.expanduser(settings.trace_export_path) if settings.trace_export_path else None,
+)
+
+
+def span(name: str, root: bool = True, **attributes: Any):
+    """Shorthand for tracer.span()."""
+    return tracer.span(name, root=root, **attributes)
+
+
+def current_span() -> Any:
+    """The active span, or a no-op stand-in when nothing is being recorded."""
+    active = _current_span.get()
+    return active if active is not None and not active.trace.closed else _NOOP_SPAN
+
+
+@contextlib.contextmanager
+def detached() -> Iterator[None]:
+    """Clears the current span, e.g. while creating a long-lived background task."""
+    token = _current_span.set(None)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name: str, root: bool = True, attributes: Optional[Callable[..., Dict[str, Any]]] = None):
+    """
+    Decorator wrapping an async function in a span. `attributes(*args, **kwargs)` may
+    return span attributes derived from the call's arguments.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            attrs = attributes(*args, **kwargs) if attributes is not None else {}
+            with tracer.span(name, root=root, **attrs):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
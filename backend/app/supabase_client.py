@@ -1,49 +1,55 @@
-from supabase import create_client, Client
 from .config import settings
+from .supabase_repository import SupabaseRepository
+import httpx
 import logging
 
 logger = logging.getLogger(__name__)
 
-supabase_client: Client | None = None
+# Async data layer: one pooled HTTP client shared by every repository instance
+_http_client: httpx.AsyncClient | None = None
+supabase_repository: SupabaseRepository | None = None
+service_supabase_repository: SupabaseRepository | None = None
 
-def get_supabase_client() -> Client:
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=settings.supabase_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.supabase_max_connections,
+                max_keepalive_connections=settings.supabase_max_connections
+            )
+        )
+    return _http_client
+
+def get_supabase_repository() -> SupabaseRepository:
     """
-    Initializes and returns the Supabase client instance.
-    Raises an exception if initialization fails.
+    Returns the async Supabase repository (anon/API key), creating it on first use.
     """
-    global supabase_client
-    if supabase_client is None:
-        try:
-            logger.info(f"Initializing Supabase client for URL: {settings.supabase_url}")
-            supabase_client = create_client(settings.supabase_url, settings.supabase_key)
-            logger.info("Supabase client initialized successfully.")
-            # Optional: Test connection (e.g., fetch user, be mindful of costs/rate limits)
-            # test_connection(supabase_client)
-        except Exception as e:
-            logger.exception("Failed to initialize Supabase client.")
-            raise ConnectionError("Could not connect to Supabase.") from e
-            
-    return supabase_client
+    global supabase_repository
+    if supabase_repository is None:
+        logger.info(f"Initializing async Supabase repository for URL: {settings.supabase_url}")
+        supabase_repository = SupabaseRepository(_get_http_client(), settings.supabase_url, settings.supabase_key)
+    return supabase_repository
 
-def test_connection(client: Client):
-    """Helper function to test the Supabase connection."""
-    try:
-        # Example: Try to get the current user session
-        response = client.auth.get_session()
-        if response:
-             logger.info("Supabase connection test successful (got session).")
-        else:
-             logger.warning("Supabase connection test completed, but no session returned (might be expected).")
-    except Exception as e:
-        logger.error(f"Supabase connection test failed: {e}")
-        raise
+def get_service_supabase_repository() -> SupabaseRepository:
+    """
+    Returns the async Supabase repository authenticated with the service role key
+    (used by the generation pipeline). Falls back to the regular key if none is configured.
+    """
+    global service_supabase_repository
+    if service_supabase_repository is None:
+        key = settings.supabase_service_role_key or settings.supabase_key
+        if not settings.supabase_service_role_key:
+            logger.warning("SUPABASE_SERVICE_ROLE_KEY not set; pipeline will use SUPABASE_KEY.")
+        service_supabase_repository = SupabaseRepository(_get_http_client(), settings.supabase_url, key)
+    return service_supabase_repository
 
-# Example usage (optional, for testing):
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    try:
-        client = get_supabase_client()
-        print("Supabase client obtained successfully.")
-        # You could add more tests here, e.g., fetching data
-    except ConnectionError as e:
-        print(f"Error: {e}")
\ No newline at end of file
+async def close_supabase_connections():
+    """Closes the pooled HTTP client used by the async repositories."""
+    global _http_client, supabase_repository, service_supabase_repository
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    supabase_repository = None
+    service_supabase_repository = None
@@ -0,0 +1,198 @@
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import httpx
+from .services.circuit_breaker import circuit_breakers
+from .services.metrics import SUPABASE_LATENCY, SUPABASE_REQUESTS
+from .services.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class SupabaseError(Exception):
+    """Raised when a PostgREST request fails."""
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def eq(value: Any) -> str:
+    """PostgREST equality filter value."""
+    return f"eq.{value}"
+
+
+def in_(values: Iterable[Any]) -> str:
+    """PostgREST `in` filter value; values are quoted so commas in ids are safe."""
+    quoted = ",".join('"' + str(v).replace('"', '\\"') + '"' for v in values)
+    return f"in.({quoted})"
+
+
+_OPERATIONS = {"GET": "select", "PATCH": "update", "POST": "insert", "DELETE": "delete"}
+
+
+def _metric_labels(method: str, table: str, prefer: Optional[str]) -> Tuple[str, str]:
+    """(table, operation) labels for request metrics; RPCs are labelled by function name."""
+    if table.startswith("rpc/"):
+        return table[4:], "rpc"
+    if method == "POST" and prefer and "merge-duplicates" in prefer:
+        return table, "upsert"
+    return table, _OPERATIONS.get(method, method.lower())
+
+
+def _is_outage(error: BaseException) -> bool:
+    """Connection errors, timeouts and 5xx trip the Supabase circuit; a 4xx means PostgREST answered."""
+    return not isinstance(error, SupabaseError) or error.status_code is None or error.status_code >= 500
+
+
+class SupabaseRepository:
+    """
+    Async data layer for the backend's Supabase tables, talking to PostgREST directly
+    over a shared, pooled httpx.AsyncClient. Requests run on the event loop, so there is
+    no thread hop per query (unlike the sync supabase-py client + asyncio.to_thread).
+    """
+    def __init__(self, http_client: httpx.AsyncClient, supabase_url: str, supabase_key: str):
+        self._http = http_client
+        self._base_url = f"{supabase_url.rstrip('/')}/rest/v1"
+        self._headers = {
+            "apikey": supabase_key,
+            "Authorization": f"Bearer {supabase_key}",
+        }
+        # Shared by every repository: they all talk to the same PostgREST
+        self._breaker = circuit_breakers.get("supabase")
+
+    # --- Generic PostgREST helpers ---
+
+    async def _request(self, method: str, table: str, params: Optional[Dict[str, Any]] = None,
+                       json: Any = None, prefer: Optional[str] = None) -> Any:
+        headers = dict(self._headers)
+        if prefer:
+            headers["Prefer"] = prefer
+        metric_table, operation = _metric_labels(method, table, prefer)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with self._breaker.guard(_is_outage):
+                try:
+                    with span(f"supabase.{operation}", root=False, table=metric_table):
+                        response = await self._http.request(method, f"{self._base_url}/{table}", params=params, json=json, headers=headers)
+                except httpx.HTTPError as e:
+                    raise SupabaseError(f"{method} {table} failed: {e!r}") from e
+
+                if response.status_code >= 400:
+                    raise SupabaseError(f"{method} {table} failed ({response.status_code}): {response.text}", response.status_code)
+            outcome = "ok"
+        finally:
+            SUPABASE_LATENCY.observe(time.perf_counter() - started, metric_table, operation)
+            SUPABASE_REQUESTS.inc(metric_table, operation, outcome)
+        if not response.content:
+            return None
+        return response.json()
+
+    async def select(self, table: str, columns: str = "*", filters: Optional[Dict[str, str]] = None,
+                     order: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        params: Dict[str, Any] = {"select": columns.replace(" ", "")}
+        params.update(filters or {})
+        if order:
+            params["order"] = order
+        if limit is not None:
+            params["limit"] = limit
+        return await self._request("GET", table, params=params) or []
+
+    async def select_one(self, table: str, columns: str = "*", filters: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        rows = await self.select(table, columns, filters, limit=1)
+        return rows[0] if rows else None
+
+    async def update(self, table: str, data: Dict[str, Any], filters: Dict[str, str]) -> List[Dict[str, Any]]:
+        if not filters:
+            raise ValueError("Refusing to update without filters.")
+        return await self._request("PATCH", table, params=filters, json=data, prefer="return=representation") or []
+
+    async def insert(self, table: str, rows: List[Dict[str, Any]], returning: str = "id") -> List[Dict[str, Any]]:
+        return await self._request("POST", table, params={"select": returning.replace(" ", "")}, json=rows,
+                                   prefer="return=representation") or []
+
+    async def upsert(self, table: str, rows: List[Dict[str, Any]], on_conflict: str) -> List[Dict[str, Any]]:
+        return await self._request("POST", table, params={"on_conflict": on_conflict}, json=rows,
+                                   prefer="resolution=merge-duplicates,return=representation") or []
+
+    async def rpc(self, function: str, args: Optional[Dict[str, Any]] = None) -> Any:
+        return await self._request("POST", f"rpc/{function}", json=args or {})
+
+    # --- chat_sessions ---
+
+    async def get_chat_thread_id(self, project_id: str) -> Optional[str]:
+        row = await self.select_one("chat_sessions", "openai_thread_id", {"project_id": eq(project_id)})
+        return row.get("openai_thread_id") if row else None
+
+    async def save_chat_thread_id(self, project_id: str, thread_id: str) -> None:
+        await self.upsert("chat_sessions", [{"project_id": project_id, "openai_thread_id": thread_id}], on_conflict="project_id")
+
+    # --- canvas_projects ---
+
+    async def get_project(self, project_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        return await self.select_one("canvas_projects", columns, {"id": eq(project_id)})
+
+    async def get_project_with_scenes(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """Project id/title with its scenes (id, title, scene_order) embedded."""
+        return await self.select_one("canvas_projects", "id, title, canvas_scenes(id, title, scene_order)", {"id": eq(project_id)})
+
+    # --- canvas_scenes ---
+
+    async def get_scene(self, scene_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        return await self.select_one("canvas_scenes", columns, {"id": eq(scene_id)})
+
+    async def list_project_scenes(self, project_id: str, columns: str = "*", status: Optional[str] = None,
+                                  order: str = "scene_index.asc") -> List[Dict[str, Any]]:
+        filters = {"project_id": eq(project_id)}
+        if status:
+            filters["status"] = eq(status)
+        return await self.select("canvas_scenes", columns, filters, order=order)
+
+    async def get_max_scene_order(self, project_id: str) -> int:
+        rows = await self.select("canvas_scenes", "scene_order", {"project_id": eq(project_id)},
+                                 order="scene_order.desc.nullslast", limit=1)
+        return (rows[0].get("scene_order") or 0) if rows else 0
+
+    async def insert_scenes(self, scenes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return await self.insert("canvas_scenes", scenes, returning="id")
+
+    async def update_scene(self, scene_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        rows = await self.update("canvas_scenes", data, {"id": eq(scene_id)})
+        return rows[0] if rows else None
+
+    async def update_scenes(self, scene_ids: List[str], data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Applies the same update to several scenes in one request."""
+        if not scene_ids:
+            return []
+        return await self.update("canvas_scenes", data, {"id": in_(scene_ids)})
+
+    async def transition_scene(self, scene_id: str, from_status: str, data: Dict[str, Any],
+                               generation_id: Optional[str] = None,
+                               unassigned: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Updates the scene only while it is still in `from_status` and, if `generation_id` is
+        given, waiting on exactly that generation (with `unassigned`, on none yet). Returns
+        the updated row, or None when the scene had already moved on.
+        """
+        filters = {"id": eq(scene_id), "status": eq(from_status)}
+        if generation_id is not None:
+            filters["pending_generation_id"] = eq(generation_id)
+        elif unassigned:
+            filters["pending_generation_id"] = "is.null"
+        rows = await self.update("canvas_scenes", data, filters)
+        return rows[0] if rows else None
+
+    async def requeue_stale_pipeline_scenes(self, statuses: List[str], stale_before: str,
+                                            project_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Resets scenes stuck in one of `statuses` whose pipeline heartbeat is older than
+        `stale_before` (ISO timestamp) back to pending_generation. The staleness check is
+        part of the PATCH filter, so a scene that is still heartbeating is never reset.
+        """
+        filters = {
+            "status": in_(statuses),
+            "or": f"(pipeline_heartbeat_at.is.null,pipeline_heartbeat_at.lt.{stale_before})",
+        }
+        if project_id:
+            filters["project_id"] = eq(project_id)
+        return await self.update("canvas_scenes", {"status": "pending_generation"}, filters)
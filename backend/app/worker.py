@@ -0,0 +1,45 @@
+import asyncio
+import logging
+import signal
+from dotenv import load_dotenv
+
+# Load environment variables from .env file before importing settings-dependent modules
+load_dotenv()
+
+from .services.pipeline_runner import start_project_generation, recover_interrupted_pipelines
+from .config import settings
+from .services.job_queue import create_worker_pool, get_job_store
+from .supabase_client import close_supabase_connections
+from .services.tracing import tracer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def run_worker():
+    """
+    Runs pipeline workers outside the API process, so pipeline capacity can scale separately.
+    Start as many of these as needed (all pointed at the same job store) and set
+    PIPELINE_WORKERS_IN_API=false on the API.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    if settings.pipeline_recover_on_startup:
+        await recover_interrupted_pipelines(get_job_store())
+
+    workers = create_worker_pool(start_project_generation)
+    workers.start()
+    logger.info("Pipeline worker running. Waiting for jobs...")
+    await stop.wait()
+
+    logger.info("Shutting down pipeline worker...")
+    await workers.stop()
+    await close_supabase_connections()
+    await asyncio.to_thread(tracer.close)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
@@ -0,0 +1,119 @@
+"""
+Benchmark: generation pipeline wall-clock time vs. scene count.
+
+Runs `run_generation_pipeline` against an in-memory Supabase repository stand-in and
+generation tools that just sleep for a configurable latency, then prints the
+wall-clock time for sequential and concurrent mode at each scene count, along with
+the number of canvas_scenes write requests each run made.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_pipeline --scenes 1,5,10,30 --concurrency 4
+"""
+import os
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+# Settings are validated at import time; the benchmark never talks to these services.
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("OPENAI_ASSISTANT_ID", "benchmark")
+
+from app.services import pipeline_runner  # noqa: E402
+
+
+class FakeSupabase:
+    """In-memory stand-in for the async SupabaseRepository methods the pipeline uses."""
+
+    def __init__(self, project_id: str, scene_count: int):
+        self.projects = {project_id: {"id": project_id, "aspect_ratio": "16:9"}}
+        self.scenes: Dict[str, Dict[str, Any]] = {
+            f"scene-{i}": {
+                "id": f"scene-{i}",
+                "project_id": project_id,
+                "scene_index": i,
+                "image_prompt": f"prompt {i}",
+                "custom_instruction": None,
+                "status": "pending_generation",
+            }
+            for i in range(scene_count)
+        }
+        self.writes = 0
+
+    async def get_project(self, project_id: str, columns: str = "*") -> Optional[Dict[str, Any]]:
+        return self.projects.get(project_id)
+
+    async def list_project_scenes(self, project_id: str, columns: str = "*", status: Optional[str] = None,
+                                  order: str = "scene_index.asc") -> List[Dict[str, Any]]:
+        rows = [dict(r) for r in self.scenes.values()
+                if r["project_id"] == project_id and (status is None or r["status"] == status)]
+        return sorted(rows, key=lambda r: r["scene_index"])
+
+    async def update_scene(self, scene_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        self.writes += 1
+        row = self.scenes.get(scene_id)
+        if row is not None:
+            row.update(data)
+        return row
+
+    async def update_scenes(self, scene_ids: List[str], data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.writes += 1
+        rows = [self.scenes[scene_id] for scene_id in scene_ids if scene_id in self.scenes]
+        for row in rows:
+            row.update(data)
+        return rows
+
+    async def requeue_stale_pipeline_scenes(self, statuses: List[str], stale_before: str,
+                                            project_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return []
+
+
+async def _run_once(scene_count: int, concurrency: int, image_latency: float, video_latency: float) -> Tuple[float, int]:
+    project_id = "benchmark-project"
+    fake = FakeSupabase(project_id, scene_count)
+    pipeline_runner.get_pipeline_repository = lambda: fake
+
+    async def fake_image(scene_id: str, image_prompt: str, version: str) -> str:
+        await asyncio.sleep(image_latency)
+        return "{}"
+
+    async def fake_video(scene_id: str) -> str:
+        await asyncio.sleep(video_latency)
+        return "{}"
+
+    pipeline_runner.agent_service._tool_trigger_image_generation = fake_image
+    pipeline_runner.agent_service._tool_trigger_video_generation = fake_video
+
+    started = time.perf_counter()
+    await pipeline_runner.run_generation_pipeline(project_id, concurrency=concurrency)
+    elapsed = time.perf_counter() - started
+
+    statuses = {row["status"] for row in fake.scenes.values()}
+    if statuses != {"completed"}:
+        raise RuntimeError(f"Unexpected scene statuses after run: {statuses}")
+    return elapsed, fake.writes
+
+
+async def main(args: argparse.Namespace):
+    scene_counts = [int(n) for n in args.scenes.split(",")]
+    print(f"image latency={args.image_latency}s video latency={args.video_latency}s "
+          f"concurrency={args.concurrency} global={pipeline_runner.settings.pipeline_global_concurrency}")
+    print(f"{'scenes':>8} {'sequential (s)':>16} {'concurrent (s)':>16} {'speedup':>9} {'writes (seq/conc)':>18}")
+    for count in scene_counts:
+        sequential, sequential_writes = await _run_once(count, 1, args.image_latency, args.video_latency)
+        concurrent, concurrent_writes = await _run_once(count, args.concurrency, args.image_latency, args.video_latency)
+        print(f"{count:>8} {sequential:>16.3f} {concurrent:>16.3f} {sequential / concurrent:>8.1f}x "
+              f"{f'{sequential_writes}/{concurrent_writes}':>18}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenes", default="1,5,10,30", help="Comma-separated scene counts to run.")
+    parser.add_argument("--concurrency", type=int, default=pipeline_runner.settings.pipeline_scene_concurrency,
+                        help="Per-project concurrency for the concurrent run.")
+    parser.add_argument("--image-latency", type=float, default=0.2, help="Simulated image generation latency (s).")
+    parser.add_argument("--video-latency", type=float, default=0.3, help="Simulated video generation latency (s).")
+    asyncio.run(main(parser.parse_args()))
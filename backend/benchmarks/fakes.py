@@ -0,0 +1,436 @@
+"""
+Local stand-ins for the services the backend talks to, so benchmarks run offline:
+
+- FakePostgREST: an in-memory PostgREST served through an httpx transport, so the real
+  SupabaseRepository (query building, metrics, tracing) is exercised end to end.
+- FakeAssistants: a thread-safe imitation of the synchronous OpenAI Assistants client
+  (threads, messages, runs) with configurable per-call and per-run latency.
+- FakeFal: Fal's queue API (submit, status, result, cancel) with a bounded number of
+  concurrent job slots, so the real FalClient's polling and retries are exercised. Jobs
+  submitted with a webhook are delivered to it when they finish.
+- stub_mcp_server.js (next to this file): a node MCP server answering CallTool requests.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace as NS
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import httpx
+import openai
+
+STUB_MCP_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_mcp_server.js")
+
+# Settings are validated at import time; benchmarks never talk to these services.
+_BENCH_ENV = {
+    "supabase_url": "http://fake-postgrest.local",
+    "supabase_key": "benchmark",
+    "supabase_service_role_key": "benchmark",
+    "openai_api_key": "benchmark",
+    "openai_assistant_id": "benchmark",
+    # Scenes share prompts across projects; --generation-cache opts in with a throwaway cache
+    "generation_cache_backend": "none",
+}
+
+
+def set_benchmark_env():
+    """Sets placeholder credentials (both spellings) before `app` is imported."""
+    for key, value in _BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+        os.environ.setdefault(key.upper(), value)
+
+
+# --- PostgREST ---
+
+# (parent table, embedded table) -> foreign key column on the embedded table
+_EMBED_KEYS = {("canvas_projects", "canvas_scenes"): "project_id"}
+_RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "or"}
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Splits on commas that are not inside parentheses."""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+    op, _, arg = expression.partition(".")
+    value = row.get(column)
+    if op == "eq":
+        # PostgREST renders booleans as true/false
+        return (str(value).lower() if isinstance(value, bool) else str(value)) == arg
+    if op == "neq":
+        return str(value) != arg
+    if op == "is":
+        return value is None if arg == "null" else str(value).lower() == arg
+    if op == "in":
+        options = [o.strip().strip('"').replace('\\"', '"') for o in _split_top_level(arg.strip("()"))]
+        return str(value) in options
+    if op in ("lt", "lte", "gt", "gte"):
+        if value is None:
+            return False
+        left, right = str(value), arg
+        return {"lt": left < right, "lte": left <= right, "gt": left > right, "gte": left >= right}[op]
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+class FakePostgREST:
+    """
+    In-memory PostgREST subset: eq/neq/is/in/lt/gt filters, or=(...), order, limit,
+    column selection with one level of embedding, insert/upsert/update/delete, and RPCs
+    registered in `rpcs`. Each request sleeps `latency` seconds first.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.rpcs: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self.requests: Counter = Counter()
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def seed(self, table: str, rows: List[Dict[str, Any]]):
+        self.tables[table].extend(dict(r) for r in rows)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        table = request.url.path.split("/rest/v1/", 1)[-1]
+        self.requests[f"{request.method} {table}"] += 1
+        params = dict(request.url.params.multi_items())
+        body = json.loads(request.content) if request.content else None
+        prefer = request.headers.get("Prefer", "")
+        try:
+            if table.startswith("rpc/"):
+                handler = self.rpcs.get(table[4:])
+                if handler is None:
+                    return httpx.Response(404, json={"message": f"function {table[4:]} not found"})
+                return httpx.Response(200, json=handler(body or {}))
+            if request.method == "GET":
+                return httpx.Response(200, json=self._select(table, params))
+            if request.method == "PATCH":
+                rows = [r for r in self.tables[table] if self._filter(r, params)]
+                for row in rows:
+                    row.update(body or {})
+                return self._written(rows, prefer)
+            if request.method == "POST":
+                return self._written(self._insert(table, body, params, prefer), prefer, status=201)
+            if request.method == "DELETE":
+                self.tables[table] = [r for r in self.tables[table] if not self._filter(r, params)]
+                return httpx.Response(204)
+        except ValueError as e:
+            return httpx.Response(400, json={"message": str(e)})
+        return httpx.Response(405)
+
+    @staticmethod
+    def _written(rows: List[Dict[str, Any]], prefer: str, status: int = 200) -> httpx.Response:
+        if "return=representation" in prefer:
+            return httpx.Response(status, json=[dict(r) for r in rows])
+        return httpx.Response(204 if status == 200 else status)
+
+    def _filter(self, row: Dict[str, Any], params: Dict[str, str]) -> bool:
+        for column, expression in params.items():
+            if column in _RESERVED_PARAMS:
+                continue
+            if not _matches(row, column, expression):
+                return False
+        if "or" in params:
+            clauses = _split_top_level(params["or"].strip()[1:-1])
+            if not any(_matches(row, *clause.split(".", 1)) for clause in clauses):
+                return False
+        return True
+
+    def _select(self, table: str, params: Dict[str, str]) -> List[Dict[str, Any]]:
+        rows = [r for r in self.tables[table] if self._filter(r, params)]
+        if "order" in params:
+            column, _, direction = params["order"].partition(".")
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction.startswith("desc"))
+        if "limit" in params:
+            rows = rows[:int(params["limit"])]
+        return [self._project(table, r, params.get("select", "*")) for r in rows]
+
+    def _project(self, table: str, row: Dict[str, Any], select: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for item in _split_top_level(select):
+            if "(" in item:
+                child, columns = item[:-1].split("(", 1)
+                key = _EMBED_KEYS.get((table, child))
+                children = [c for c in self.tables[child] if key and c.get(key) == row.get("id")]
+                result[child] = [self._project(child, c, columns) for c in children]
+            elif item == "*":
+                result.update(row)
+            else:
+                result[item] = row.get(item)
+        return result
+
+    def _insert(self, table: str, body: Any, params: Dict[str, str], prefer: str) -> List[Dict[str, Any]]:
+        rows = body if isinstance(body, list) else [body]
+        conflict = params.get("on_conflict") if "merge-duplicates" in prefer else None
+        written = []
+        for incoming in rows:
+            existing = None
+            if conflict:
+                existing = next((r for r in self.tables[table] if r.get(conflict) == incoming.get(conflict)), None)
+            if existing is not None:
+                existing.update(incoming)
+                written.append(existing)
+            else:
+                row = {"id": str(uuid.uuid4()), **incoming}
+                self.tables[table].append(row)
+                written.append(row)
+        select = params.get("select")
+        return [self._project(table, r, select) for r in written] if select else written
+
+
+# --- OpenAI Assistants ---
+
+class FakeAssistants:
+    """
+    Imitates `OpenAI().beta.threads` for the calls AgentService and RunStatusPoller make.
+    Every call blocks for `api_latency` (the real client is synchronous and runs in the
+    executor); a run completes `run_latency` seconds after it was created or after its tool
+    outputs were submitted. With `tool_rounds` > 0, a run first asks for
+    `tool_call_factory(thread_id, last_user_message)` tool calls that many times. With
+    `rate_limit` > 0, calls beyond that many per second are rejected with a 429 carrying
+    Retry-After, like the real API.
+    """
+    def __init__(self, api_latency: float = 0.05, run_latency: float = 0.5, tool_rounds: int = 0,
+                 tool_call_factory: Optional[Callable[[str, str], List[Tuple[str, Dict[str, Any]]]]] = None,
+                 rate_limit: float = 0.0):
+        self.rate_limit = rate_limit
+        self._window: Deque[float] = deque()
+        self.api_latency = api_latency
+        self.run_latency = run_latency
+        self.tool_rounds = tool_rounds
+        self.tool_call_factory = tool_call_factory
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._messages: Dict[str, List[Any]] = defaultdict(list)
+        self._runs: Dict[str, Dict[str, Any]] = {}
+        self.beta = NS(threads=NS(
+            create=self._create_thread,
+            messages=NS(create=self._create_message, list=self._list_messages),
+            runs=NS(create=self._create_run, retrieve=self._retrieve_run,
+                    submit_tool_outputs=self._submit_tool_outputs, cancel=self._cancel_run),
+        ))
+
+    def _call(self, name: str):
+        self.calls[name] += 1
+        if self.rate_limit > 0:
+            with self._lock:
+                now = time.monotonic()
+                while self._window and self._window[0] <= now - 1.0:
+                    self._window.popleft()
+                if len(self._window) >= self.rate_limit:
+                    self.calls["rate_limited"] += 1
+                    retry_after = self._window[0] + 1.0 - now
+                    response = httpx.Response(429, headers={"retry-after-ms": str(int(retry_after * 1000) + 1)},
+                                              request=httpx.Request("POST", f"https://api.openai.com/v1/{name}"))
+                    raise openai.RateLimitError("Rate limit reached", response=response, body=None)
+                self._window.append(now)
+        if self.api_latency:
+            time.sleep(self.api_latency)
+
+    def _next_id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids)}"
+
+    def _create_thread(self, **kwargs):
+        self._call("threads.create")
+        with self._lock:
+            return NS(id=self._next_id("thread"))
+
+    def _create_message(self, thread_id: str, role: str, content: str, **kwargs):
+        self._call("messages.create")
+        with self._lock:
+            message = NS(id=self._next_id("msg"), role=role, run_id=None,
+                         content=[NS(type="text", text=NS(value=content))])
+            self._messages[thread_id].append(message)
+            return message
+
+    def _list_messages(self, thread_id: str, order: str = "desc", limit: int = 20, **kwargs):
+        self._call("messages.list")
+        with self._lock:
+            messages = list(self._messages[thread_id])
+        if order == "desc":
+            messages.reverse()
+        return NS(data=messages[:limit])
+
+    def _run_view(self, state: Dict[str, Any]):
+        return NS(id=state["id"], thread_id=state["thread_id"], status=state["status"],
+                  required_action=state.get("required_action"), last_error=None)
+
+    def _create_run(self, thread_id: str, assistant_id: str, **kwargs):
+        self._call("runs.create")
+        with self._lock:
+            state = {"id": self._next_id("run"), "thread_id": thread_id, "status": "queued",
+                     "ready_at": time.monotonic() + self.run_latency, "tool_rounds": self.tool_rounds}
+            self._runs[state["id"]] = state
+            return self._run_view(state)
+
+    def _retrieve_run(self, thread_id: str, run_id: str, **kwargs):
+        self._call("runs.retrieve")
+        with self._lock:
+            state = self._runs[run_id]
+            if state["status"] in ("queued", "in_progress") and time.monotonic() >= state["ready_at"]:
+                self._advance(state)
+            elif state["status"] == "queued":
+                state["status"] = "in_progress"
+            return self._run_view(state)
+
+    def _advance(self, state: Dict[str, Any]):
+        thread_id = state["thread_id"]
+        if state["tool_rounds"] > 0 and self.tool_call_factory is not None:
+            state["tool_rounds"] -= 1
+            last_user = next((m.content[0].text.value for m in reversed(self._messages[thread_id]) if m.role == "user"), "")
+            tool_calls = [
+                NS(id=self._next_id("call"), type="function", function=NS(name=name, arguments=json.dumps(arguments)))
+                for name, arguments in self.tool_call_factory(thread_id, last_user)
+            ]
+            state["status"] = "requires_action"
+            state["required_action"] = NS(type="submit_tool_outputs", submit_tool_outputs=NS(tool_calls=tool_calls))
+            return
+        state["status"] = "completed"
+        state["required_action"] = None
+        self._messages[thread_id].append(NS(
+            id=self._next_id("msg"), role="assistant", run_id=state["id"],
+            content=[NS(type="text", text=NS(value="Done."))]
+        ))
+
+    def _submit_tool_outputs(self, thread_id: str, run_id: str, tool_outputs: List[Dict[str, str]], **kwargs):
+        self._call("runs.submit_tool_outputs")
+        with self._lock:
+            state = self._runs[run_id]
+            state.update(status="queued", required_action=None, ready_at=time.monotonic() + self.run_latency)
+            return self._run_view(state)
+
+    def _cancel_run(self, thread_id: str, run_id: str, **kwargs):
+        self._call("runs.cancel")
+        with self._lock:
+            state = self._runs[run_id]
+            state.update(status="cancelled", required_action=None)
+            return self._run_view(state)
+
+
+# --- Fal queue API ---
+
+class FakeFal:
+    """
+    Fal queue API served through an httpx transport. A submitted job waits for one of
+    `slots` workers, then runs for `video_latency` (models with "video" in their path) or
+    `image_latency` seconds. Each request sleeps `api_latency` first and fails with a 503
+    at `error_rate`, to exercise client retries. A job submitted with ?fal_webhook= is
+    passed to `deliver(url, body)` when it finishes, with the body Fal POSTs.
+    """
+    def __init__(self, image_latency: float = 0.2, video_latency: float = 0.3, slots: int = 32,
+                 api_latency: float = 0.0, error_rate: float = 0.0,
+                 deliver: Optional[Callable[[str, Dict[str, Any]], Awaitable[Any]]] = None):
+        self.image_latency = image_latency
+        self.video_latency = video_latency
+        self.slots = max(1, slots)
+        self.api_latency = api_latency
+        self.error_rate = error_rate
+        self.deliver = deliver
+        self.requests: Counter = Counter()
+        self._deliveries: Set[asyncio.Task] = set()
+        self._ids = itertools.count(1)
+        # request_id -> {"model", "starts_at", "ends_at", "cancelled"}
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        # Times at which the busy slots free up
+        self._slot_free_at: List[float] = []
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        path = request.url.path.strip("/")
+        endpoint = "submit" if request.method == "POST" else "cancel" if path.endswith("/cancel") else \
+            "status" if path.endswith("/status") else "result"
+        self.requests[endpoint] += 1
+        if not request.headers.get("Authorization", "").startswith("Key "):
+            return httpx.Response(401, json={"detail": "Missing Fal key"})
+        if self.error_rate and random.random() < self.error_rate:
+            return httpx.Response(503, json={"detail": "Service temporarily unavailable"})
+        if endpoint == "submit":
+            submitted = self._submit(path)
+            webhook = request.url.params.get("fal_webhook")
+            if webhook and self.deliver is not None:
+                task = asyncio.ensure_future(self._deliver_when_done(webhook, submitted["request_id"]))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+            return httpx.Response(200, json=submitted)
+
+        request_id = path.split("/requests/", 1)[-1].split("/", 1)[0]
+        job = self._jobs.get(request_id)
+        if job is None:
+            return httpx.Response(404, json={"detail": f"Request {request_id} not found"})
+        if endpoint == "cancel":
+            job["cancelled"] = True
+            return httpx.Response(202, json={"status": "CANCELLATION_REQUESTED"})
+        status = self._status(job)
+        if endpoint == "status":
+            body: Dict[str, Any] = {"status": status, "request_id": request_id}
+            if status == "IN_QUEUE":
+                body["queue_position"] = sum(
+                    1 for other in self._jobs.values()
+                    if not other["cancelled"] and other["starts_at"] < job["starts_at"] and self._status(other) == "IN_QUEUE"
+                )
+            return httpx.Response(200, json=body)
+        if status != "COMPLETED":
+            return httpx.Response(400, json={"detail": "Request is still in progress", "status": status})
+        return httpx.Response(200, json=self._output(request_id))
+
+    def _output(self, request_id: str) -> Dict[str, Any]:
+        if "video" in self._jobs[request_id]["model"]:
+            return {"video": {"url": f"https://fake-fal.local/{request_id}.mp4"}}
+        return {"images": [{"url": f"https://fake-fal.local/{request_id}.jpg"}]}
+
+    async def _deliver_when_done(self, url: str, request_id: str):
+        job = self._jobs[request_id]
+        await asyncio.sleep(max(0.0, job["ends_at"] - time.monotonic()))
+        if job["cancelled"]:
+            return
+        self.requests["webhook"] += 1
+        await self.deliver(url, {"request_id": request_id, "gateway_request_id": request_id,
+                                 "status": "OK", "payload": self._output(request_id)})
+
+    def _submit(self, model: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        while self._slot_free_at and self._slot_free_at[0] <= now:
+            heapq.heappop(self._slot_free_at)
+        starts_at = now if len(self._slot_free_at) < self.slots else heapq.heappop(self._slot_free_at)
+        ends_at = starts_at + (self.video_latency if "video" in model else self.image_latency)
+        heapq.heappush(self._slot_free_at, ends_at)
+        request_id = f"fal-{next(self._ids)}"
+        self._jobs[request_id] = {"model": model, "starts_at": starts_at, "ends_at": ends_at, "cancelled": False}
+        return {"request_id": request_id, "status": "IN_QUEUE"}
+
+    @staticmethod
+    def _status(job: Dict[str, Any]) -> str:
+        if job["cancelled"]:
+            return "CANCELLED"
+        now = time.monotonic()
+        if now < job["starts_at"]:
+            return "IN_QUEUE"
+        return "IN_PROGRESS" if now < job["ends_at"] else "COMPLETED"
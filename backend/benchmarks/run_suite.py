@@ -0,0 +1,381 @@
+"""
+Benchmark suite: chat latency, pipeline throughput and MCP call rate, fully offline.
+
+Runs the real AgentService, pipeline runner, Fal client and execute_mcp_stdio against
+local stand-ins (see benchmarks/fakes.py): a fake Assistants API, an in-memory PostgREST
+and a fake Fal queue, all with configurable latency, and a stub node MCP server. Results are printed and
+written as JSON; pass a previous results file to --compare to flag regressions.
+
+Usage (from the backend directory):
+    python -m benchmarks.run_suite
+    python -m benchmarks.run_suite --only chat,mcp --chat-requests 200
+    python -m benchmarks.run_suite --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from .fakes import STUB_MCP_SERVER, FakeAssistants, FakeFal, FakePostgREST, set_benchmark_env
+
+set_benchmark_env()
+
+import httpx  # noqa: E402
+from app import supabase_client  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.main import app, execute_mcp_stdio  # noqa: E402
+from app.services import fal_client, generation_cache, pipeline_runner  # noqa: E402
+from app.services.agent_service import agent_service  # noqa: E402
+from app.services.mcp_pool import mcp_pools  # noqa: E402
+from app.services.rate_limiter import rate_limiter  # noqa: E402
+from app.services.scene_state_machine import scene_state_machine  # noqa: E402
+from app.services.snapshot_cache import snapshot_cache  # noqa: E402
+
+SCENARIOS = ("chat", "pipeline", "mcp")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# (scenario, metric) -> True if higher is better; checked by --compare
+TRACKED_METRICS = {
+    ("chat", "p50_ms"): False,
+    ("chat", "p99_ms"): False,
+    ("chat", "throughput_rps"): True,
+    ("pipeline", "scenes_per_second"): True,
+    ("mcp", "calls_per_second"): True,
+    ("mcp", "p99_ms"): False,
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    ms = [l * 1000 for l in latencies]
+    return {
+        "p50_ms": round(percentile(ms, 50), 2),
+        "p90_ms": round(percentile(ms, 90), 2),
+        "p99_ms": round(percentile(ms, 99), 2),
+        "mean_ms": round(sum(ms) / len(ms), 2) if ms else 0.0,
+        "max_ms": round(max(ms), 2) if ms else 0.0,
+    }
+
+
+def install_fake_postgrest(fake: FakePostgREST):
+    """Points the shared Supabase repositories at `fake`."""
+    supabase_client._http_client = httpx.AsyncClient(transport=fake.transport())
+    supabase_client.supabase_repository = None
+    supabase_client.service_supabase_repository = None
+    snapshot_cache.clear()
+
+
+def install_fake_fal(fake: FakeFal, poll_min_interval: float, poll_max_interval: float) -> fal_client.FalClient:
+    """Points the shared Fal client at `fake`, polling on the given interval range."""
+    fal_client._http_client = httpx.AsyncClient(transport=fake.transport())
+    fal_client._fal_client = fal_client.FalClient(
+        fal_client._http_client, "benchmark", "http://fake-fal.local",
+        poll_min_interval=poll_min_interval, poll_max_interval=poll_max_interval,
+        max_retries=settings.fal_max_retries,
+    )
+    return fal_client._fal_client
+
+
+async def run_workers(count: int, concurrency: int, fn) -> List[Any]:
+    """Runs fn(i) for i in range(count) with at most `concurrency` in flight."""
+    next_index = iter(range(count))
+    results: List[Any] = []
+
+    async def worker():
+        for i in next_index:
+            results.append(await fn(i))
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return results
+
+
+# --- Scenarios ---
+
+async def bench_chat(args: argparse.Namespace) -> Dict[str, Any]:
+    postgrest = FakePostgREST(latency=args.supabase_latency)
+    project_ids = [f"bench-project-{i}" for i in range(args.chat_projects)]
+    postgrest.seed("canvas_projects", [{"id": p, "title": f"Project {p}"} for p in project_ids])
+    postgrest.seed("canvas_scenes", [
+        {"id": f"{p}-scene-{n}", "project_id": p, "title": f"Scene {n}", "scene_order": n}
+        for p in project_ids for n in range(3)
+    ])
+    install_fake_postgrest(postgrest)
+
+    # Each run asks for the project details tool, as a typical chat turn does
+    assistants = FakeAssistants(
+        api_latency=args.openai_latency,
+        run_latency=args.run_latency,
+        tool_rounds=args.tool_rounds,
+        tool_call_factory=lambda thread_id, message: [("get_project_details", {"project_id": message.rsplit(" ", 1)[-1]})],
+        rate_limit=args.openai_rate_limit,
+    )
+    agent_service.client = assistants
+    agent_service.run_poller.client = assistants
+
+    async def one_request(i: int):
+        project_id = project_ids[i % len(project_ids)]
+        started = time.perf_counter()
+        try:
+            await agent_service.process_chat_message(project_id, None, f"Summarise project {project_id}")
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, repr(e)
+
+    started = time.perf_counter()
+    outcomes = await run_workers(args.chat_requests, args.chat_concurrency, one_request)
+    elapsed = time.perf_counter() - started
+    errors = [e for _, e in outcomes if e]
+    return {
+        "requests": args.chat_requests,
+        "concurrency": args.chat_concurrency,
+        "projects": args.chat_projects,
+        **latency_summary([l for l, e in outcomes if not e]),
+        "throughput_rps": round(args.chat_requests / elapsed, 2),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "openai_calls": dict(assistants.calls),
+        "rate_limits": {k: v for k, v in rate_limiter.stats().items() if k.startswith("openai.")},
+        "postgrest_requests": dict(postgrest.requests),
+    }
+
+
+async def bench_pipeline(args: argparse.Namespace) -> Dict[str, Any]:
+    postgrest = FakePostgREST(latency=args.supabase_latency)
+    project_ids = [f"bench-pipeline-{i}" for i in range(args.pipeline_projects)]
+    postgrest.seed("canvas_projects", [{"id": p, "aspect_ratio": "16:9"} for p in project_ids])
+    postgrest.seed("canvas_scenes", [
+        {"id": f"{p}-scene-{n}", "project_id": p, "scene_index": n, "image_prompt": f"prompt {n}",
+         "product_image_url": "https://example.com/p.png", "image_url": "https://example.com/i.png",
+         "description": "d", "status": "pending_generation", "pipeline_stage": None, "pipeline_heartbeat_at": None}
+        for p in project_ids for n in range(args.pipeline_scenes)
+    ])
+    install_fake_postgrest(postgrest)
+
+    # With --webhooks, FakeFal calls the real /api/webhooks/fal endpoint in-process
+    backend = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://backend.local")
+
+    async def deliver(url: str, body: Dict[str, Any]):
+        response = await backend.post(url, json=body)
+        response.raise_for_status()
+
+    fal = FakeFal(image_latency=args.image_latency, video_latency=args.video_latency,
+                  slots=args.fal_slots, api_latency=args.fal_api_latency, error_rate=args.fal_error_rate,
+                  deliver=deliver)
+    client = install_fake_fal(fal, args.fal_poll_min, args.fal_poll_max)
+    cache_dir = tempfile.mkdtemp(prefix="bench-generation-cache-") if args.generation_cache else None
+    generation_cache.generation_cache = generation_cache.GenerationCache(
+        generation_cache.SqliteGenerationCache(os.path.join(cache_dir, "cache.db")) if cache_dir else None,
+        settings.generation_cache_max_entries, settings.generation_cache_ttl
+    )
+    scene_state_machine.webhook_url = "http://backend.local/api/webhooks/fal" if args.webhooks else None
+    scene_state_machine.webhook_secret = "bench-webhook-secret"
+    scenes = postgrest.tables["canvas_scenes"]
+
+    async def run_pass() -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            pipeline_runner.run_generation_pipeline(p, concurrency=args.pipeline_concurrency) for p in project_ids
+        ))
+        # Webhook mode returns once scenes are started; they finish as callbacks arrive
+        while args.webhooks and any(s["status"] not in ("completed", "failed") for s in scenes):
+            await asyncio.sleep(0.005)
+        return time.perf_counter() - started
+
+    rerun_scenes_per_second = None
+    try:
+        elapsed = await run_pass()
+        completed = sum(1 for s in scenes if s["status"] == "completed")
+        if cache_dir:
+            # Regenerate every scene with unchanged inputs: served from the cache
+            for scene in scenes:
+                scene["status"] = "pending_generation"
+            snapshot_cache.clear()
+            rerun_elapsed = await run_pass()
+            rerun_scenes_per_second = round(sum(1 for s in scenes if s["status"] == "completed") / rerun_elapsed, 3)
+    finally:
+        scene_state_machine.webhook_url = None
+        await backend.aclose()
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return {
+        "projects": args.pipeline_projects,
+        "scenes": len(scenes),
+        "completed": completed,
+        "concurrency": args.pipeline_concurrency,
+        "webhooks": args.webhooks,
+        "elapsed_s": round(elapsed, 3),
+        "scenes_per_second": round(completed / elapsed, 3),
+        "fal": client.stats(),
+        "rerun_scenes_per_second": rerun_scenes_per_second,
+        "generation_cache": generation_cache.generation_cache.stats(),
+        "fal_requests": dict(fal.requests),
+        "postgrest_requests": dict(postgrest.requests),
+    }
+
+
+async def bench_mcp(args: argparse.Namespace) -> Dict[str, Any]:
+    if shutil.which("node") is None:
+        return {"skipped": "node is not installed"}
+    env = {"STUB_MCP_LATENCY_MS": str(args.mcp_latency_ms)}
+
+    try:
+        # Process start-up (the pool grows under concurrent load) is reported separately
+        # from steady-state throughput
+        started = time.perf_counter()
+        await asyncio.gather(*(execute_mcp_stdio(STUB_MCP_SERVER, "warmup", {}, env=env)
+                               for _ in range(args.mcp_concurrency)))
+        warmup = time.perf_counter() - started
+
+        async def one_call(i: int):
+            call_started = time.perf_counter()
+            try:
+                await execute_mcp_stdio(STUB_MCP_SERVER, "echo", {"i": i}, env=env)
+                return time.perf_counter() - call_started, None
+            except Exception as e:
+                return time.perf_counter() - call_started, repr(e)
+
+        started = time.perf_counter()
+        outcomes = await run_workers(args.mcp_calls, args.mcp_concurrency, one_call)
+        elapsed = time.perf_counter() - started
+    finally:
+        await mcp_pools.close_all()
+
+    errors = [e for _, e in outcomes if e]
+    return {
+        "calls": args.mcp_calls,
+        "concurrency": args.mcp_concurrency,
+        "pool_size": settings.mcp_pool_size,
+        "warmup_ms": round(warmup * 1000, 2),
+        **latency_summary([l for l, e in outcomes if not e]),
+        "calls_per_second": round(args.mcp_calls / elapsed, 2),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+# --- Reporting ---
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Prints tracked metrics against the baseline and returns the regressions."""
+    regressions = []
+    print(f"\n{'metric':<30} {'baseline':>12} {'current':>12} {'change':>9}")
+    for (scenario, metric), higher_is_better in TRACKED_METRICS.items():
+        old = baseline.get("results", {}).get(scenario, {}).get(metric)
+        new = current["results"].get(scenario, {}).get(metric)
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old == 0:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        print(f"{scenario + '.' + metric:<30} {old:>12.2f} {new:>12.2f} {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append(f"{scenario}.{metric}")
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    scenarios = [s.strip() for s in args.only.split(",")] if args.only else list(SCENARIOS)
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    runners = {"chat": bench_chat, "pipeline": bench_pipeline, "mcp": bench_mcp}
+
+    report: Dict[str, Any] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": {},
+    }
+    for name in scenarios:
+        print(f"Running {name}...", flush=True)
+        report["results"][name] = await runners[name](args)
+        summary = {k: v for k, v in report["results"][name].items() if not isinstance(v, dict)}
+        print(f"  {json.dumps(summary)}")
+    await supabase_client.close_supabase_connections()
+    await fal_client.close_fal_client()
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help=f"Comma-separated scenarios to run ({', '.join(SCENARIOS)}).")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<UTC timestamp>.json).")
+    parser.add_argument("--compare", help="Baseline results file; exits 1 if a tracked metric regressed.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression for --compare.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the backend's INFO logging.")
+    # Stand-in latencies
+    parser.add_argument("--openai-latency", type=float, default=0.03, help="Seconds per fake Assistants API call.")
+    parser.add_argument("--run-latency", type=float, default=0.3, help="Seconds until a fake run completes.")
+    parser.add_argument("--openai-rate-limit", type=float, default=0.0,
+                        help="Fake Assistants calls/second before answering 429 (0 = no limit).")
+    parser.add_argument("--supabase-latency", type=float, default=0.005, help="Seconds per fake PostgREST request.")
+    # Chat
+    parser.add_argument("--chat-requests", type=int, default=100)
+    parser.add_argument("--chat-concurrency", type=int, default=10)
+    parser.add_argument("--chat-projects", type=int, default=10, help="Distinct projects (threads) the requests use.")
+    parser.add_argument("--tool-rounds", type=int, default=1, help="requires_action rounds per run.")
+    # Pipeline
+    parser.add_argument("--pipeline-projects", type=int, default=2)
+    parser.add_argument("--pipeline-scenes", type=int, default=20, help="Scenes per project.")
+    parser.add_argument("--pipeline-concurrency", type=int, default=settings.pipeline_scene_concurrency)
+    parser.add_argument("--image-latency", type=float, default=0.2, help="Seconds a fake Fal image job runs.")
+    parser.add_argument("--video-latency", type=float, default=0.3, help="Seconds a fake Fal video job runs.")
+    parser.add_argument("--fal-slots", type=int, default=32, help="Fake Fal jobs running at once; the rest queue.")
+    parser.add_argument("--fal-api-latency", type=float, default=0.005, help="Seconds per fake Fal HTTP request.")
+    parser.add_argument("--fal-error-rate", type=float, default=0.0, help="Fraction of fake Fal requests answered with 503.")
+    parser.add_argument("--webhooks", action="store_true", help="Drive scenes through Fal webhooks instead of polling.")
+    parser.add_argument("--generation-cache", action="store_true",
+                        help="Cache generated media in a fresh SQLite file, then regenerate every scene from it.")
+    parser.add_argument("--fal-poll-min", type=float, default=0.05, help="Fal status poll interval floor.")
+    parser.add_argument("--fal-poll-max", type=float, default=0.5, help="Fal status poll interval ceiling.")
+    # MCP
+    parser.add_argument("--mcp-calls", type=int, default=500)
+    parser.add_argument("--mcp-concurrency", type=int, default=16)
+    parser.add_argument("--mcp-latency-ms", type=int, default=5, help="Stub server delay per call.")
+    parsed = parser.parse_args()
+
+    if not parsed.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    sys.exit(asyncio.run(main(parsed)))
@@ -0,0 +1,34 @@
+#!/usr/bin/env node
+// Stand-in MCP server for benchmarks: answers newline-delimited JSON-RPC CallTool
+// requests after STUB_MCP_LATENCY_MS, echoing the tool name and arguments back.
+import readline from 'node:readline';
+
+const latencyMs = Number(process.env.STUB_MCP_LATENCY_MS || 0);
+const rl = readline.createInterface({ input: process.stdin });
+
+function respond(message) {
+  process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+rl.on('line', (line) => {
+  if (!line.trim()) return;
+  let request;
+  try {
+    request = JSON.parse(line);
+  } catch (err) {
+    process.stderr.write(`invalid request: ${line}\n`);
+    return;
+  }
+  if (request.method !== 'CallTool') {
+    respond({ jsonrpc: '2.0', id: request.id, error: { code: -32601, message: `Unknown method ${request.method}` } });
+    return;
+  }
+  const { name, arguments: args } = request.params || {};
+  setTimeout(() => {
+    respond({
+      jsonrpc: '2.0',
+      id: request.id,
+      result: { content: [{ type: 'text', text: JSON.stringify({ success: true, tool: name, arguments: args }) }] },
+    });
+  }, latencyMs);
+});
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# Settings are validated when `app` is imported; tests never talk to these services
+for key, value in {
+    "supabase_url": "http://supabase.test",
+    "supabase_key": "test",
+    "openai_api_key": "test",
+    "openai_assistant_id": "test",
+}.items():
+    os.environ.setdefault(key, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
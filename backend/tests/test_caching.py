@@ -0,0 +1,53 @@
+import asyncio
+
+from app.services.caching import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flights = SingleFlight()
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return {"value": calls}
+
+        results = await asyncio.gather(*(flights.do("k", load) for _ in range(5)))
+        assert calls == 1
+        assert all(result is results[0] for result in results)
+        assert flights.stats() == {"in_flight": 0, "shared": 4}
+
+    asyncio.run(scenario())
+
+
+def test_call_is_cancelled_only_when_its_last_waiter_leaves():
+    async def scenario():
+        flights = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def job():
+            try:
+                await asyncio.sleep(0.1)
+                return "done"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        # One of two waiters leaving keeps the shared call running for the other
+        first = asyncio.ensure_future(flights.do("k", job))
+        second = asyncio.ensure_future(flights.do("k", job))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "done"
+        assert not cancelled.is_set()
+
+        # A lone waiter leaving cancels the call
+        lone = asyncio.ensure_future(flights.do("k", job))
+        await asyncio.sleep(0.01)
+        lone.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        assert flights.in_flight() == 0
+
+    asyncio.run(scenario())
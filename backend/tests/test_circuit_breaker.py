@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from app.services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def _fail(breaker, error=None):
+    with pytest.raises(ConnectionError):
+        with breaker.guard():
+            raise error or ConnectionError("down")
+
+
+def test_circuit_opens_probes_and_closes():
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.05)
+    _fail(breaker)
+    assert breaker.state == CLOSED
+    _fail(breaker)
+    assert breaker.state == OPEN
+
+    # Open: calls fail fast without running
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard():
+            pytest.fail("call let through while open")
+
+    time.sleep(0.06)
+    # The probe after the recovery timeout is admitted; its success closes the circuit
+    with breaker.guard():
+        assert breaker.state == HALF_OPEN
+    assert breaker.state == CLOSED
+    assert breaker.stats()["times_opened"] == 1
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.05, half_open_max_calls=1)
+    _fail(breaker)
+    time.sleep(0.06)
+    with pytest.raises(ConnectionError):
+        with breaker.guard():
+            # Only one probe at a time while half-open
+            with pytest.raises(CircuitOpenError):
+                with breaker.guard():
+                    pass
+            raise ConnectionError("still down")
+    assert breaker.state == OPEN
+
+
+def test_errors_that_are_not_failures_do_not_open_the_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=60)
+    with pytest.raises(ValueError):
+        with breaker.guard(lambda e: not isinstance(e, ValueError)):
+            raise ValueError("bad request")
+    assert breaker.state == CLOSED
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+from app.services.job_queue import COMPLETED, FAILED, RUNNING, PipelineWorkerPool, SqliteJobStore
+
+
+def _store(tmp_path):
+    return SqliteJobStore(str(tmp_path / "jobs.db"))
+
+
+def _pool(store, runner, concurrency=1, lease_seconds=30.0):
+    return PipelineWorkerPool(store, runner, concurrency, lease_seconds=lease_seconds,
+                              poll_interval=0.01, retry_base_delay=0.01, retry_max_delay=0.02)
+
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not await condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+def test_enqueue_is_deduplicated_per_active_project(tmp_path):
+    async def scenario():
+        store = _store(tmp_path)
+        first, created = await store.enqueue("p1", 3)
+        again, created_again = await store.enqueue("p1", 3)
+        other, created_other = await store.enqueue("p2", 3)
+        assert created and not created_again and created_other
+        assert again["id"] == first["id"]
+        assert other["id"] != first["id"]
+
+        # Once the job is finished the project can be enqueued again
+        job = await store.claim("w", 30)
+        await store.complete(job["id"], "w")
+        assert (await store.get(job["id"]))["status"] == COMPLETED
+        _, created_after = await store.enqueue(job["project_id"], 3)
+        assert created_after
+
+    asyncio.run(scenario())
+
+
+def test_failing_runner_is_retried_then_fails_permanently(tmp_path):
+    async def scenario():
+        store = _store(tmp_path)
+        calls = []
+
+        async def runner(project_id):
+            calls.append(project_id)
+            raise RuntimeError("generation failed")
+
+        job, _ = await store.enqueue("p1", 2)
+        pool = _pool(store, runner)
+        pool.start()
+        try:
+            async def failed():
+                return (await store.get(job["id"]))["status"] == FAILED
+            await _wait_for(failed)
+        finally:
+            await pool.stop()
+        final = await store.get(job["id"])
+        assert calls == ["p1", "p1"]
+        assert final["attempts"] == 2
+        assert "generation failed" in final["last_error"]
+
+    asyncio.run(scenario())
+
+
+def test_lost_heartbeat_cancels_the_run_without_recording_an_outcome(tmp_path):
+    class LosingStore(SqliteJobStore):
+        async def heartbeat(self, job_id, worker_id, lease_seconds):
+            return False
+
+    async def scenario():
+        store = LosingStore(str(tmp_path / "jobs.db"))
+        cancelled = asyncio.Event()
+
+        async def runner(project_id):
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        job, _ = await store.enqueue("p1", 3)
+        claimed = await store.claim("w", 3.0)
+        pool = _pool(store, runner, lease_seconds=3.0)
+        await asyncio.wait_for(pool._run_job("w", claimed), timeout=5)
+        assert cancelled.is_set()
+        # Neither completed nor failed: the job belongs to whoever reclaims it
+        assert (await store.get(job["id"]))["status"] == RUNNING
+
+    asyncio.run(scenario())
+
+
+def test_store_errors_do_not_kill_the_worker(tmp_path):
+    class FlakyStore(SqliteJobStore):
+        async def complete(self, job_id, worker_id):
+            raise ConnectionError("supabase is down")
+
+    async def scenario():
+        store = FlakyStore(str(tmp_path / "jobs.db"))
+        ran = []
+
+        async def runner(project_id):
+            ran.append(project_id)
+
+        await store.enqueue("p1", 3)
+        await store.enqueue("p2", 3)
+        pool = _pool(store, runner)
+        pool.start()
+        try:
+            async def both_ran():
+                return len(ran) == 2
+            await _wait_for(both_ran)
+            assert pool.stats()["workers"] == 1
+        finally:
+            await pool.stop()
+        assert sorted(ran) == ["p1", "p2"]
+
+    asyncio.run(scenario())
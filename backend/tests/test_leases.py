@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from app.services.leases import InMemoryLeaseManager, LeaseLost, LeaseUnavailable
+
+
+def test_holders_exclude_each_other():
+    async def scenario():
+        leases = InMemoryLeaseManager()
+        async with leases.hold("pipeline:p1", ttl=5):
+            with pytest.raises(LeaseUnavailable):
+                async with leases.hold("pipeline:p1", ttl=5):
+                    pass
+            # Other names are independent
+            async with leases.hold("pipeline:p2", ttl=5):
+                pass
+        return leases.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["acquired"] == 2
+    assert stats["busy"] == 1
+
+
+def test_lease_is_released_on_exit():
+    async def scenario():
+        leases = InMemoryLeaseManager()
+        with pytest.raises(RuntimeError):
+            async with leases.hold("thread:p1", ttl=5):
+                raise RuntimeError("boom")
+        assert leases.stats()["held"] == []
+        async with leases.hold("thread:p1", ttl=5):
+            pass
+
+    asyncio.run(scenario())
+
+
+def test_waiter_gets_the_lease_once_it_is_released():
+    async def scenario():
+        leases = InMemoryLeaseManager()
+
+        async def wait_for_lease():
+            async with leases.hold("thread:p1", ttl=5, wait=2):
+                return "acquired"
+
+        async with leases.hold("thread:p1", ttl=5):
+            waiter = asyncio.ensure_future(wait_for_lease())
+            await asyncio.sleep(0.1)
+            assert not waiter.done()
+        return await waiter
+
+    assert asyncio.run(scenario()) == "acquired"
+
+
+def test_lost_lease_stops_its_holder():
+    async def scenario():
+        leases = InMemoryLeaseManager()
+        steps = []
+        with pytest.raises(LeaseLost):
+            async with leases.hold("pipeline:p1", ttl=0.3):
+                # Another worker takes over the lease (e.g. ours expired during an outage)
+                leases._leases["pipeline:p1"] = ("other-worker", float("inf"))
+                for step in range(20):
+                    await asyncio.sleep(0.05)
+                    steps.append(step)
+        return steps, leases.stats()
+
+    steps, stats = asyncio.run(scenario())
+    assert len(steps) < 20
+    assert stats["lost"] == 1
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from app.services import metrics
+
+
+def test_to_thread_queue_gauge_is_decremented_once_when_cancelled(monkeypatch):
+    started = threading.Event()
+
+    async def late_to_thread(fn):
+        # An executor job that still starts after its caller was cancelled (the worker had
+        # already picked it up when the cancellation arrived)
+        loop = asyncio.get_running_loop()
+        thread = threading.Thread(target=lambda: (started.wait(), fn()))
+        thread.start()
+        await loop.create_future()
+
+    monkeypatch.setattr(metrics.asyncio, "to_thread", late_to_thread)
+
+    async def scenario():
+        queued_before = metrics.TO_THREAD_QUEUED.value()
+        call = asyncio.ensure_future(metrics.to_thread(lambda: "done", call="test"))
+        await asyncio.sleep(0.01)
+        assert metrics.TO_THREAD_QUEUED.value() == queued_before + 1
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        started.set()
+        await asyncio.sleep(0.05)
+        assert metrics.TO_THREAD_QUEUED.value() == queued_before
+        assert metrics.TO_THREAD_IN_FLIGHT.value() == 0
+
+    asyncio.run(scenario())
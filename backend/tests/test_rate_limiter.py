@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from app.services import rate_limiter
+from app.services.circuit_breaker import circuit_breakers
+from app.services.rate_limiter import TokenBucket, openai_call
+
+
+@pytest.fixture(autouse=True)
+def fresh_openai_circuit():
+    # openai_call goes through the process-wide OpenAI breaker; keep tests independent of it
+    circuit_breakers._breakers.pop("openai", None)
+    yield
+    circuit_breakers._breakers.pop("openai", None)
+
+
+def _status_error(status, headers=None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "https://api.openai.test/v1"))
+    cls = {429: openai.RateLimitError}.get(status, openai.InternalServerError if status >= 500 else openai.BadRequestError)
+    return cls(f"HTTP {status}", response=response, body=None)
+
+
+def _failing(*errors, result="ok"):
+    """Blocking fake client call raising `errors` in turn, then returning `result`."""
+    calls = []
+
+    def call():
+        calls.append(time.perf_counter())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return call, calls
+
+
+def test_write_is_retried_on_429_and_503_honouring_retry_after():
+    call, calls = _failing(_status_error(429, {"retry-after-ms": "100"}), _status_error(503, {"retry-after": "0"}))
+    started = time.perf_counter()
+    assert asyncio.run(openai_call("messages.create", call)) == "ok"
+    assert len(calls) == 3
+    assert calls[1] - started >= 0.1
+
+
+def test_write_is_not_retried_on_500():
+    call, calls = _failing(_status_error(500))
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(openai_call("runs.create", call))
+    assert len(calls) == 1
+
+
+def test_read_is_retried_on_500_but_not_on_400():
+    call, calls = _failing(_status_error(500, {"retry-after-ms": "0"}))
+    assert asyncio.run(openai_call("runs.retrieve", call)) == "ok"
+    assert len(calls) == 2
+
+    call, calls = _failing(_status_error(400))
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(openai_call("runs.retrieve", call))
+    assert len(calls) == 1
+
+
+def test_stream_is_never_retried():
+    call, calls = _failing(_status_error(429, {"retry-after-ms": "0"}))
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(openai_call("runs.stream", call))
+    assert len(calls) == 1
+
+
+def test_token_bucket_spaces_calls_beyond_its_burst():
+    async def scenario():
+        bucket = TokenBucket("test", rate=20.0, capacity=1.0)
+        started = time.perf_counter()
+        for _ in range(3):
+            await bucket.acquire()
+        return time.perf_counter() - started
+
+    # One token up front, then one every 50ms
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_pause_holds_the_bucket_for_retry_after():
+    async def scenario():
+        bucket = TokenBucket("test", rate=1000.0, capacity=10.0)
+        bucket.pause(0.1)
+        started = time.perf_counter()
+        await bucket.acquire()
+        return time.perf_counter() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+    assert rate_limiter.retry_after_seconds({"retry-after": "2"}) == 2.0
@@ -0,0 +1,49 @@
+import asyncio
+
+from app.services.scene_status_writer import SceneStatusWriter
+
+
+class FlakyRepository:
+    """Stand-in for SupabaseRepository.update_scenes that fails the first `failures` calls."""
+    def __init__(self, failures):
+        self.failures = failures
+        self.rows = {}
+
+    async def update_scenes(self, scene_ids, data):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("supabase is down")
+        for scene_id in scene_ids:
+            self.rows.setdefault(scene_id, {}).update(data)
+        return [dict(self.rows[scene_id], id=scene_id) for scene_id in scene_ids]
+
+
+def test_failed_flush_is_retried_in_the_background():
+    async def scenario():
+        repository = FlakyRepository(failures=1)
+        writer = SceneStatusWriter(repository, flush_interval=0.01, max_retries=3)
+        await writer.update_scene("s1", {"status": "generating_video"})
+        # No further submissions: the retry must come from the writer itself
+        for _ in range(100):
+            if repository.rows:
+                break
+            await asyncio.sleep(0.01)
+        assert repository.rows == {"s1": {"status": "generating_video"}}
+        assert writer.stats()["pending"] == 0
+        await writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_update_dropped_after_max_retries_is_reported():
+    async def scenario():
+        dropped = []
+        repository = FlakyRepository(failures=100)
+        writer = SceneStatusWriter(repository, flush_interval=0.01, max_retries=2, on_drop=dropped.extend)
+        await writer.update_scene("s1", {"status": "completed"})
+        await writer.close()
+        assert dropped == ["s1"]
+        assert writer.stats()["dropped"] == 1
+        assert repository.rows == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,66 @@
+import asyncio
+
+from app.services.thread_run_queue import ThreadRunQueue
+
+
+def test_messages_queued_behind_a_run_are_merged_up_to_max_merge():
+    async def scenario():
+        queue = ThreadRunQueue(max_merge=2)
+        release = asyncio.Event()
+        runs = []
+
+        async def run_fn(messages):
+            runs.append(messages)
+            if len(runs) == 1:
+                await release.wait()
+            return f"answer to {'+'.join(messages)}"
+
+        first = asyncio.ensure_future(queue.submit("t1", "m1", run_fn))
+        await asyncio.sleep(0.01)
+        queued = [asyncio.ensure_future(queue.submit("t1", m, run_fn)) for m in ("m2", "m3", "m4")]
+        await asyncio.sleep(0.01)
+        assert queue.depth("t1") == 4
+        release.set()
+        results = await asyncio.gather(first, *queued)
+        assert runs == [["m1"], ["m2", "m3"], ["m4"]]
+        # Every caller in a merged batch gets that run's result
+        assert results == ["answer to m1", "answer to m2+m3", "answer to m2+m3", "answer to m4"]
+        assert queue.stats()["merged_messages"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_exclusive_turn_blocks_submit_until_it_ends():
+    async def scenario():
+        queue = ThreadRunQueue(max_merge=10)
+        runs = []
+
+        async def run_fn(messages):
+            runs.append(messages)
+            return "ok"
+
+        async with queue.exclusive("t1"):
+            waiting = asyncio.ensure_future(queue.submit("t1", "m1", run_fn))
+            await asyncio.sleep(0.02)
+            assert runs == []
+            assert not waiting.done()
+        assert await waiting == "ok"
+        assert runs == [["m1"]]
+
+    asyncio.run(scenario())
+
+
+def test_threads_do_not_block_each_other():
+    async def scenario():
+        queue = ThreadRunQueue()
+        runs = []
+
+        async def run_fn(messages):
+            runs.append(messages)
+            return "ok"
+
+        async with queue.exclusive("t1"):
+            assert await asyncio.wait_for(queue.submit("t2", "m1", run_fn), timeout=1) == "ok"
+        assert queue.stats()["threads"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,96 @@
+-- Migration file: supabase/migrations/20250710120000_create_pipeline_jobs_table.sql
+-- Durable job queue for the backend generation pipeline (backend/app/services/job_queue.py).
+
+-- 1. Create the pipeline_jobs table
+CREATE TABLE IF NOT EXISTS public.pipeline_jobs (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    project_id uuid NOT NULL REFERENCES public.canvas_projects(id) ON DELETE CASCADE,
+    status text NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'completed', 'failed')),
+    attempts integer NOT NULL DEFAULT 0,
+    max_attempts integer NOT NULL DEFAULT 3,
+    available_at timestamp with time zone NOT NULL DEFAULT now(),
+    lease_owner text,
+    lease_expires_at timestamp with time zone,
+    last_error text,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    updated_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+COMMENT ON TABLE public.pipeline_jobs IS 'Queued and running generation pipeline jobs, leased by backend workers.';
+COMMENT ON COLUMN public.pipeline_jobs.lease_owner IS 'Worker currently holding the job; the job becomes claimable again once lease_expires_at passes.';
+
+-- At most one queued/running job per project (dedupes repeated start requests)
+CREATE UNIQUE INDEX IF NOT EXISTS pipeline_jobs_active_project_idx
+    ON public.pipeline_jobs (project_id) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS pipeline_jobs_status_available_idx
+    ON public.pipeline_jobs (status, available_at);
+
+
+-- 2. Enqueue: insert a job unless the project already has an active one
+CREATE OR REPLACE FUNCTION public.enqueue_pipeline_job(p_project_id uuid, p_max_attempts integer DEFAULT 3)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_job public.pipeline_jobs;
+BEGIN
+    INSERT INTO public.pipeline_jobs (project_id, max_attempts)
+    VALUES (p_project_id, p_max_attempts)
+    ON CONFLICT (project_id) WHERE status IN ('queued', 'running') DO NOTHING
+    RETURNING * INTO v_job;
+
+    IF v_job.id IS NOT NULL THEN
+        RETURN jsonb_build_object('created', true, 'job', to_jsonb(v_job));
+    END IF;
+
+    SELECT * INTO v_job
+    FROM public.pipeline_jobs
+    WHERE project_id = p_project_id AND status IN ('queued', 'running')
+    LIMIT 1;
+
+    RETURN jsonb_build_object('created', false, 'job', to_jsonb(v_job));
+END;
+$$;
+
+
+-- 3. Claim: lease the next runnable job (queued and due, or running with an expired lease)
+CREATE OR REPLACE FUNCTION public.claim_pipeline_job(p_worker_id text, p_lease_seconds integer)
+RETURNS SETOF public.pipeline_jobs
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- Jobs whose final attempt's lease expired will not be retried
+    UPDATE public.pipeline_jobs
+    SET status = 'failed', lease_owner = NULL, updated_at = now(),
+        last_error = 'Lease expired after final attempt'
+    WHERE status = 'running' AND lease_expires_at < now() AND attempts >= max_attempts;
+
+    RETURN QUERY
+    UPDATE public.pipeline_jobs j
+    SET status = 'running',
+        lease_owner = p_worker_id,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        attempts = j.attempts + 1,
+        updated_at = now()
+    WHERE j.id = (
+        SELECT id FROM public.pipeline_jobs
+        WHERE (status = 'queued' AND available_at <= now())
+           OR (status = 'running' AND lease_expires_at < now())
+        ORDER BY available_at
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING j.*;
+END;
+$$;
+
+
+-- 4. Row Level Security: only the backend (service role) touches the queue
+ALTER TABLE public.pipeline_jobs ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow full access for service role"
+ON public.pipeline_jobs
+FOR ALL
+TO service_role
+USING (true)
+WITH CHECK (true);
@@ -0,0 +1,16 @@
+-- Migration file: supabase/migrations/20250710130000_add_scene_pipeline_checkpoints.sql
+-- Stage checkpoints and heartbeats used by the backend generation pipeline to recover
+-- scenes left in generating_image / generating_video by a crashed run.
+
+-- 1. Checkpoint and heartbeat columns
+ALTER TABLE public.canvas_scenes
+    ADD COLUMN IF NOT EXISTS pipeline_stage text,
+    ADD COLUMN IF NOT EXISTS pipeline_heartbeat_at timestamp with time zone;
+
+COMMENT ON COLUMN public.canvas_scenes.pipeline_stage IS 'Last generation stage completed by the current pipeline run (e.g. image_generated); cleared when the scene completes or fails.';
+COMMENT ON COLUMN public.canvas_scenes.pipeline_heartbeat_at IS 'Refreshed while a pipeline works on the scene; in-progress scenes with a stale heartbeat are re-queued.';
+
+-- 2. Index for the recovery sweep (only in-progress scenes are ever scanned)
+CREATE INDEX IF NOT EXISTS canvas_scenes_pipeline_heartbeat_idx
+    ON public.canvas_scenes (pipeline_heartbeat_at)
+    WHERE status IN ('generating_image', 'generating_video');
@@ -0,0 +1,72 @@
+-- Migration file: supabase/migrations/20250712100000_create_generation_cache_table.sql
+-- Content-addressed cache of generated scene images and videos
+-- (backend/app/services/generation_cache.py, GENERATION_CACHE_BACKEND=supabase).
+
+-- 1. Create the generation_cache table
+CREATE TABLE IF NOT EXISTS public.generation_cache (
+    key text PRIMARY KEY,
+    kind text NOT NULL CHECK (kind IN ('image', 'video')),
+    model text NOT NULL,
+    url text NOT NULL,
+    hits integer NOT NULL DEFAULT 0,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    last_used_at timestamp with time zone NOT NULL DEFAULT now()
+);
+
+COMMENT ON TABLE public.generation_cache IS 'Generated media keyed by a SHA-256 of the normalized generation request (kind, model, input).';
+COMMENT ON COLUMN public.generation_cache.last_used_at IS 'Last time the entry was stored or served; the least recently used entries are evicted first.';
+
+CREATE INDEX IF NOT EXISTS generation_cache_last_used_idx
+    ON public.generation_cache (last_used_at);
+
+
+-- 2. Lookup: the entry's URL if it is younger than the TTL, recording the hit
+CREATE OR REPLACE FUNCTION public.get_generation_cache_entry(p_key text, p_ttl_seconds integer DEFAULT 0)
+RETURNS text
+LANGUAGE sql
+AS $$
+    UPDATE public.generation_cache
+    SET hits = hits + 1, last_used_at = now()
+    WHERE key = p_key
+      AND (p_ttl_seconds <= 0 OR created_at > now() - make_interval(secs => p_ttl_seconds))
+    RETURNING url;
+$$;
+
+
+-- 3. Eviction: drop expired entries, then the least recently used beyond p_max_entries
+CREATE OR REPLACE FUNCTION public.evict_generation_cache(p_max_entries integer, p_ttl_seconds integer DEFAULT 0)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_expired integer := 0;
+    v_evicted integer := 0;
+BEGIN
+    IF p_ttl_seconds > 0 THEN
+        DELETE FROM public.generation_cache
+        WHERE created_at <= now() - make_interval(secs => p_ttl_seconds);
+        GET DIAGNOSTICS v_expired = ROW_COUNT;
+    END IF;
+
+    DELETE FROM public.generation_cache
+    WHERE key IN (
+        SELECT key FROM public.generation_cache
+        ORDER BY last_used_at DESC
+        OFFSET GREATEST(p_max_entries, 0)
+    );
+    GET DIAGNOSTICS v_evicted = ROW_COUNT;
+
+    RETURN v_expired + v_evicted;
+END;
+$$;
+
+
+-- 4. Row Level Security: only the backend (service role) reads and writes the cache
+ALTER TABLE public.generation_cache ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow full access for service role"
+ON public.generation_cache
+FOR ALL
+TO service_role
+USING (true)
+WITH CHECK (true);
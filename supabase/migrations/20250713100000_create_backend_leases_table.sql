@@ -0,0 +1,79 @@
+-- Migration file: supabase/migrations/20250713100000_create_backend_leases_table.sql
+-- Named, time-limited leases that keep backend processes from running the same
+-- per-project work at once (backend/app/services/leases.py, LEASE_BACKEND=supabase).
+-- Advisory locks would be released as soon as PostgREST returns the connection to its
+-- pool, so leases are rows whose expiry is compared with the database clock.
+
+-- 1. Create the backend_leases table
+CREATE TABLE IF NOT EXISTS public.backend_leases (
+    name text PRIMARY KEY,
+    owner text NOT NULL,
+    acquired_at timestamp with time zone NOT NULL DEFAULT now(),
+    expires_at timestamp with time zone NOT NULL
+);
+
+COMMENT ON TABLE public.backend_leases IS 'Leases such as pipeline:<project_id> and thread:<project_id>, held by one backend process until released or expired.';
+COMMENT ON COLUMN public.backend_leases.owner IS 'host:pid:nonce of the holder; renewing requires the same owner.';
+
+
+-- 2. Acquire: takes the lease if it is free, expired or already p_owner's
+CREATE OR REPLACE FUNCTION public.acquire_backend_lease(p_name text, p_owner text, p_ttl_seconds double precision)
+RETURNS boolean
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_owner text;
+BEGIN
+    INSERT INTO public.backend_leases AS l (name, owner, acquired_at, expires_at)
+    VALUES (p_name, p_owner, now(), now() + make_interval(secs => p_ttl_seconds))
+    ON CONFLICT (name) DO UPDATE
+        SET owner = EXCLUDED.owner,
+            acquired_at = CASE WHEN l.owner = EXCLUDED.owner THEN l.acquired_at ELSE now() END,
+            expires_at = EXCLUDED.expires_at
+        WHERE l.owner = EXCLUDED.owner OR l.expires_at <= now()
+    RETURNING owner INTO v_owner;
+
+    RETURN v_owner IS NOT NULL;
+END;
+$$;
+
+
+-- 3. Renew: extends the lease only while p_owner still holds it (a lease that was
+--    released or taken over is lost, even if it is free again by now)
+CREATE OR REPLACE FUNCTION public.renew_backend_lease(p_name text, p_owner text, p_ttl_seconds double precision)
+RETURNS boolean
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE public.backend_leases
+    SET expires_at = now() + make_interval(secs => p_ttl_seconds)
+    WHERE name = p_name AND owner = p_owner;
+
+    RETURN FOUND;
+END;
+$$;
+
+
+-- 4. Release: only the holder can free a lease
+CREATE OR REPLACE FUNCTION public.release_backend_lease(p_name text, p_owner text)
+RETURNS boolean
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM public.backend_leases
+    WHERE name = p_name AND owner = p_owner;
+
+    RETURN FOUND;
+END;
+$$;
+
+
+-- 5. Row Level Security: only the backend (service role) takes leases
+ALTER TABLE public.backend_leases ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Allow full access for service role"
+ON public.backend_leases
+FOR ALL
+TO service_role
+USING (true)
+WITH CHECK (true);